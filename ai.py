@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+AI-аналитика по менеджерам (Perplexity chat/completions) — без Streamlit.
+— Сводка по сделкам менеджера → промпт; ответ кэшируется по хэшу модели и промпта
+  (AnswerCache из store.py), одинаковая сводка не оплачивается повторно.
+— Запросы — параллельно в ограниченном пуле; analyze отдаёт ответы по мере готовности.
+— url настраивается: для тестов — локальная заглушка bench/fake_ai.py.
+"""
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+PERPLEXITY_URL = "https://api.perplexity.ai/chat/completions"
+MODEL = "sonar-pro"
+
+
+def manager_summary(g):
+    """Сводка по сделкам одного менеджера (кадр df_mod)."""
+    return {
+        "deals": int(len(g)),
+        "avg_health": float(pd.to_numeric(g["health"], errors="coerce").mean() or 0),
+        "avg_potential": float(pd.to_numeric(g["potential"], errors="coerce").mean() or 0),
+        "no_tasks": int(g["flag_no_tasks"].sum()),
+        "stuck": int(g["flag_stuck"].sum()),
+        "fails": int(g["is_fail"].sum()),
+        "reschedules": int(g["reschedules"].sum()),
+        "micro_tasks": int(g["micro_tasks"].sum()),
+    }
+
+def manager_prompt(mgr_name, summary):
+    return f"""
+Ты эксперт по CRM. Проанализируй работу менеджера "{mgr_name}".
+Данные: {summary}.
+1) Сильные стороны.
+2) Проблемные зоны.
+3) Чек-лист, чтобы здоровье сделок ≥70% и не падало (задачи, сроки, контакт-ритм, фиксация договорённостей).
+4) Признаки «обхода системы» (переносы дедлайнов, микро-задачи) и что делать руководителю.
+Пиши кратко, деловым стилем.
+"""
+
+def offline_advice(summary):
+    """Текст без AI (нет ключа API)."""
+    return f"AI недоступен. Сводка: {summary}\n\nРекомендации:\n• Конкретные задачи (цель/результат/дедлайн).\n• Не переносить дедлайны более 1 раза.\n• Контакт-ритм: 1 раз в 3–5 дней на активных стадиях.\n• Фиксировать исходы контактов (звонок/письмо/встреча) в активности."
+
+
+class AIClient:
+    """chat/completions с keep-alive пулом на max_workers соединений."""
+
+    def __init__(self, api_key, url=PERPLEXITY_URL, model=MODEL, max_workers=4, timeout=30):
+        self.api_key, self.url, self.model = api_key, url, model
+        self.max_workers, self.timeout = max(1, int(max_workers)), timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def key(self, prompt):
+        return hashlib.sha256(f"{self.model}\n{prompt}".encode()).hexdigest()
+
+    def ask(self, prompt):
+        resp = self.session.post(self.url, headers={"Authorization": f"Bearer {self.api_key}"},
+                                 json={"model": self.model, "messages": [{"role": "user", "content": prompt}],
+                                       "temperature": 0.3, "max_tokens": 800},
+                                 timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()["choices"][0]["message"]["content"]
+
+    def close(self):
+        self.session.close()
+
+
+def analyze(prompts, client, cache):
+    """prompts: {имя: промпт} → генератор (имя, текст, из_кэша) по мере готовности:
+    сначала ответы из кэша, затем запросы пула. Успешный ответ кладётся в кэш
+    рабочим потоком — даже если вызывающий перестал читать генератор (перезапуск
+    скрипта Streamlit), ответ достанется следующему запуску. Ошибки не кэшируются."""
+    todo = {}
+    for name, prompt in prompts.items():
+        text = cache.get(client.key(prompt))
+        if text is not None:
+            yield name, text, True
+        else:
+            todo[name] = prompt
+    if not todo:
+        return
+
+    def work(prompt):
+        text = client.ask(prompt)
+        cache.put(client.key(prompt), text)
+        return text
+
+    pool = ThreadPoolExecutor(max_workers=client.max_workers)
+    futures = {pool.submit(work, prompt): name for name, prompt in todo.items()}
+    try:
+        for fut in as_completed(futures):
+            try:
+                yield futures[fut], fut.result(), False
+            except Exception as e:
+                yield futures[fut], f"AI ошибка: {e}", False
+    finally:
+        pool.shutdown(wait=False)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк AI-аналитики на заглушке bench/fake_ai.py: последовательные запросы
+(как прежний цикл по менеджерам) против пула, затем повтор — из кэша ответов.
+
+    python bench/bench_ai.py                      # 20 менеджеров, ответ 0.5 с, пул 4
+    python bench/bench_ai.py --managers 40 --delay 1 --workers 8
+"""
+
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ai
+from store import AnswerCache
+from bench.fake_ai import FakeAI, serve
+
+
+def run(label, fake, prompts, client, cache):
+    requests, t = fake.requests, time.perf_counter()
+    first = None
+    for _ in ai.analyze(prompts, client, cache):
+        first = first or time.perf_counter() - t
+    total = time.perf_counter() - t
+    print(f"  {label:<22} всего {total:6.2f} с  первый ответ {first:5.2f} с  "
+          f"запросов {fake.requests - requests:>3}  пик параллельно {fake.peak}")
+    fake.peak = 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--managers", type=int, default=20)
+    ap.add_argument("--delay", type=float, default=0.5)
+    ap.add_argument("--workers", type=int, default=4)
+    args = ap.parse_args()
+    fake = FakeAI(args.delay)
+    server, url = serve(fake)
+    summary = {"deals": 10, "avg_health": 70.0}
+    prompts = {f"Менеджер{i}": ai.manager_prompt(f"Менеджер{i}", summary) for i in range(args.managers)}
+    print(f"{args.managers} менеджеров, ответ {args.delay} с")
+    run("последовательно", fake, prompts, ai.AIClient("x", url, max_workers=1), AnswerCache())
+    cache = AnswerCache()
+    client = ai.AIClient("x", url, max_workers=args.workers)
+    run(f"пул {args.workers}", fake, prompts, client, cache)
+    run("повтор (кэш)", fake, prompts, client, cache)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк и сверка античита: cheat_flags (все активности одним кадром) против
+прежнего cheat_flags_for_deal, вызывавшегося на каждую сделку.
+
+    python bench/bench_cheat.py                   # 1k и 10k сделок
+"""
+
+import argparse, os, sys, time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scoring import cheat_flags
+from bench.fake_bitrix import make_activities, make_deals
+
+
+def cheat_flags_for_deal(acts):
+    """Построчная реализация v5.7 (кадр и разбор дат на каждую сделку) — эталон для сверки."""
+    if not acts:
+        return {"reschedules": 0, "micro_tasks": 0}
+
+    df = pd.DataFrame(acts)
+
+    def _to_naive(series):
+        s = pd.to_datetime(series, errors="coerce", utc=True)
+        try:
+            s = s.dt.tz_convert(None)
+        except Exception:
+            try:
+                s = s.dt.tz_localize(None)
+            except Exception:
+                pass
+        return s
+
+    for col in ["CREATED","LAST_UPDATED","DEADLINE","START_TIME","END_TIME"]:
+        if col in df.columns:
+            df[col] = _to_naive(df[col])
+
+    # Переносы дедлайна (по SUBJECT → уникальные дни DEADLINE)
+    reschedules = 0
+    if "DEADLINE" in df.columns:
+        tmp = df.dropna(subset=["DEADLINE"]).copy()
+        subj = tmp["SUBJECT"] if "SUBJECT" in tmp.columns else pd.Series([""] * len(tmp))
+        tmp["_deadline_day"] = tmp["DEADLINE"].dt.floor("D")
+        grp = pd.DataFrame({"SUBJECT": subj, "_deadline_day": tmp["_deadline_day"]})
+        for _, g in grp.groupby("SUBJECT"):
+            uniq = g["_deadline_day"].nunique()
+            if uniq and uniq > 1:
+                reschedules += int(uniq - 1)
+
+    # Микро-задачи (<= 15 минут)
+    micro = 0
+    if "START_TIME" in df.columns and "END_TIME" in df.columns:
+        st_ = df["START_TIME"]; en_ = df["END_TIME"]
+        mask = st_.notna() & en_.notna()
+        if mask.any():
+            dur_min = (en_[mask] - st_[mask]).dt.total_seconds() / 60.0
+            micro = int((dur_min <= 15).sum())
+
+    return {"reschedules": int(reschedules), "micro_tasks": int(micro)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,10000")
+    args = ap.parse_args()
+    print(f"{'deals':>8} {'acts':>8} {'per-deal,s':>11} {'one-pass,s':>11} {'speedup':>8}  equal")
+    for n in [int(x) for x in args.sizes.split(",")]:
+        deals = make_deals(n)
+        activities = {}
+        for a in make_activities(deals):
+            activities.setdefault(int(a["OWNER_ID"]), []).append(a)
+        ids = pd.Series([int(d["ID"]) for d in deals])
+
+        t = time.perf_counter()
+        cheat = cheat_flags(activities)
+        new = pd.DataFrame({"reschedules": ids.map(cheat["reschedules"]).fillna(0).astype(int),
+                            "micro_tasks": ids.map(cheat["micro_tasks"]).fillna(0).astype(int)})
+        t_new = time.perf_counter() - t
+
+        t = time.perf_counter()
+        old = pd.DataFrame([cheat_flags_for_deal(activities.get(i, [])) for i in ids])[["reschedules", "micro_tasks"]]
+        t_old = time.perf_counter() - t
+
+        pd.testing.assert_frame_equal(new, old.astype(int))
+        print(f"{n:>8} {sum(map(len, activities.values())):>8} {t_old:>11.2f} {t_new:>11.3f} {t_old / t_new:>7.0f}x  yes")
+
+
+if __name__ == "__main__":
+    main()
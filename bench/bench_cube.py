@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк и сверка куба показателей (cube.py) на синтетическом портале: таблицы разделов
+«Обзор», «Проблемы», «По менеджерам» и «Градация» по срезу куба против прежнего расчёта
+по строкам df_created/df_closed/df_mod (группировки на каждый перезапуск).
+Куб собирается один раз на период (с номерами групп); отделы — фильтр ячеек.
+Таблицы должны совпасть, в том числе для отдела без успешных сделок и пустого отдела.
+
+    python bench/bench_cube.py                    # 20k сделок
+    python bench/bench_cube.py --deals 100000
+"""
+
+import argparse, os, random, sys, time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import snapshot
+from bitrix import BitrixClient
+from cube import DealCube
+from periods import DateIndex
+from scoring import CAT_MAIN, CAT_PHYS, CAT_LOW, failure_group
+from bench.fake_bitrix import FakeBitrix, make_portal, serve
+
+NOW = datetime(2025, 1, 1, 12)
+CATS = [CAT_MAIN, CAT_PHYS, CAT_LOW]
+
+
+def subsets(df_all, start, end):
+    """df_created, df_closed, df_mod — как в дашборде (маски DateIndex)."""
+    ix = {c: DateIndex(df_all[c]) for c in ("DATE_CREATE", "CLOSEDATE", "DATE_MODIFY")}
+    return tuple(df_all[ix[c].mask(start, end)] for c in ("DATE_CREATE", "CLOSEDATE", "DATE_MODIFY"))
+
+def tables_old(df_created, df_closed, df_mod):
+    """Прежний расчёт разделов по строкам поднаборов периода."""
+    out = {}
+    if not df_mod.empty:
+        hist = pd.cut(df_mod["health"], bins=list(range(0, 105, 5)), right=False).value_counts().sort_index()
+        out["health_dist"] = pd.DataFrame({"Диапазон": hist.index.astype(str), "Кол-во": hist.values})
+    else:
+        out["health_dist"] = pd.DataFrame(columns=["Диапазон","Кол-во"])
+    for cat in CATS:
+        sub = df_created[(df_created["cat_norm"]==cat) & (~df_created["is_fail"])]
+        out[f"funnel {cat}"] = (sub.groupby(["STAGE_ID","stage_name","stage_sort"], observed=True)["ID"].count()
+                                .reset_index().rename(columns={"ID":"Количество"}).sort_values("stage_sort"))
+    fails = df_mod[df_mod["is_fail"]].copy()
+    if not fails.empty:
+        fails["Причина"] = fails["stage_name"]
+        fails["Этап (из истории)"] = fails["fail_from_stage_hist"]
+        fails["Группа"] = fails["Причина"].map(failure_group)
+        out["fails_by_reason"] = (fails.groupby(["category","Группа","Причина","Этап (из истории)"], observed=True)["ID"].count()
+                                  .reset_index().rename(columns={"ID":"Количество"}))
+    else:
+        out["fails_by_reason"] = pd.DataFrame(columns=["category","Группа","Причина","Этап (из истории)","Количество"])
+    out["problems"] = {c: int(df_mod[c].sum()) for c in ("flag_no_tasks", "flag_no_company", "flag_no_contact", "flag_stuck", "is_fail")}
+
+    succ = df_closed[(df_closed["is_success"]) & (df_closed["cat_norm"].isin(CATS))]
+    won_cnt = succ.groupby("manager", observed=True)["ID"].count().rename("Выиграно").reset_index()
+    won_sum = succ.groupby("manager", observed=True)["OPPORTUNITY"].sum().rename("Выручка, ₽").reset_index()
+    lost_cnt = df_mod[df_mod["is_fail"]].groupby("manager", observed=True)["ID"].count().rename("Проиграно").reset_index()
+    base = df_mod.groupby("manager", observed=True).agg(Сделок=("ID","count"), СрЗдоровье=("health","mean")).reset_index()
+    mgr = base.merge(won_cnt, on="manager", how="left").merge(won_sum, on="manager", how="left").merge(lost_cnt, on="manager", how="left")
+    mgr[["Выиграно","Выручка, ₽","Проиграно"]] = mgr[["Выиграно","Выручка, ₽","Проиграно"]].fillna(0)
+    mgr["Конверсия в победу, %"] = (mgr["Выиграно"]/mgr["Сделок"]*100).round(1).replace([np.inf,np.nan],0)
+    mgr["СрЗдоровье"] = mgr["СрЗдоровье"].round(1)
+    out["managers"] = mgr
+    for cat in CATS:
+        sub = df_mod[df_mod["cat_norm"]==cat]
+        stages = sub[~sub["is_fail"]].groupby(["stage_name","stage_sort"], observed=True).size().reset_index(name="Кол-во").sort_values("stage_sort")
+        total = stages["Кол-во"].sum() or 1
+        stages["Доля, %"] = (stages["Кол-во"]/total*100).round(1)
+        out[f"stages {cat}"] = stages
+        fails_by = sub[sub["is_fail"]].groupby("fail_from_stage_hist", observed=True).size().reset_index(name="Кол-во")
+        out[f"fails_hist {cat}"] = fails_by.rename(columns={"fail_from_stage_hist":"Этап (из истории)"}).sort_values("Кол-во", ascending=False)
+        out[f"fails_group {cat}"] = sub[sub["is_fail"]].groupby(["fail_group","stage_name"], observed=True).size().reset_index(name="Кол-во")
+
+    quick = df_mod[(~df_mod["is_fail"]) & (df_mod["PROBABILITY"]>=50) & (df_mod["health"]>=60)]
+    work = df_mod[(~df_mod["is_fail"]) & (~df_mod.index.isin(quick.index))]
+    drop = df_mod[df_mod["is_fail"]]
+    out["grades"] = {k: (len(g), g["OPPORTUNITY"].sum()) for k, g in (("quick", quick), ("work", work), ("drop", drop))}
+    return out
+
+def tables_cube(view):
+    out = {"health_dist": view.health_dist()}
+    for cat in CATS:
+        out[f"funnel {cat}"] = view.funnel(cat)
+    out["fails_by_reason"] = view.fails_by_reason()
+    out["problems"] = view.problems()
+    out["managers"] = view.managers(CATS)
+    for cat in CATS:
+        out[f"stages {cat}"] = view.stage_counts(cat)
+        out[f"fails_hist {cat}"] = view.fails_by_stage(cat, True)
+        out[f"fails_group {cat}"] = view.fails_by_stage(cat, False)
+    out["grades"] = view.grades()
+    return out
+
+def compare(old, new, label):
+    for k, a in old.items():
+        b = new[k]
+        if isinstance(a, pd.DataFrame):
+            pd.testing.assert_frame_equal(a, b, obj=f"{label}: {k}")
+        elif k == "grades":
+            for g in a:
+                assert a[g][0] == b[g][0] and abs(a[g][1] - b[g][1]) < 0.01, f"{label}: {k} {g} {a[g]} != {b[g]}"
+        else:
+            assert a == b, f"{label}: {k} {a} != {b}"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--deals", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=5, help="повторов смены отдела на период")
+    args = ap.parse_args()
+    fake = FakeBitrix(**make_portal(args.deals, now=NOW))
+    server, url = serve(fake)
+    snap_df, meta = snapshot.build(BitrixClient(url, rate=1e6, burst=1e6), days=400, now=NOW)
+    server.shutdown()
+    users = sorted(snap_df["ASSIGNED_BY_ID"].unique().tolist())
+    rnd = random.Random(3)
+    end = NOW.date() - timedelta(days=1)
+    print(f"{args.deals} сделок в снимке ({len(snap_df)} в окне), менеджеров {len(users)}")
+    for days, label in ((7, "неделя"), (30, "месяц"), (90, "квартал"), (365, "год")):
+        start = end - timedelta(days=days - 1)
+        src = snapshot.period_slice(snap_df, start, end)
+        t = time.perf_counter()
+        cube = DealCube(src)
+        tables_cube(cube.view(start, end))  # номера групп — один раз на куб, как первый запрос раздела
+        t_build = time.perf_counter() - t
+        t_old = t_new = 0.0
+        depts = [None] + [tuple(rnd.sample(users, len(users) // 3)) for _ in range(args.repeat)]
+        for assigned in depts:
+            df_all = snapshot.period_slice(snap_df, start, end, assigned=assigned)
+            parts = subsets(df_all, start, end)  # нужны дашборду и с кубом (ряды, списки сделок)
+            t = time.perf_counter(); old = tables_old(*parts); t_old += time.perf_counter() - t
+            t = time.perf_counter(); new = tables_cube(cube.view(start, end, assigned)); t_new += time.perf_counter() - t
+            compare(old, new, f"{label}, отделы {assigned and len(assigned)}")
+        n = len(depts)
+        # крайние срезы: отдел без успешных сделок в периоде (Выручка 0 — float, как по строкам) и пустой отдел
+        won = set(src.loc[src["is_success"] & src["cat_norm"].isin(CATS)
+                          & src["CLOSEDATE"].dt.date.between(start, end), "ASSIGNED_BY_ID"].tolist())
+        no_success = tuple(u for u in users if u not in won)
+        for assigned, what in ((no_success, "без успешных"), ((max(users) + 1000,), "пустой")):
+            if not assigned:
+                continue
+            df_all = snapshot.period_slice(snap_df, start, end, assigned=assigned)
+            compare(tables_old(*subsets(df_all, start, end)), tables_cube(cube.view(start, end, assigned)), f"{label}, отдел {what}")
+        print(f"  {label:<8} строк {len(src):>6}  ячеек куба {cube.size:>6}  сборка {t_build * 1000:6.0f} мс  "
+              f"по строкам {t_old / n * 1000:6.1f} мс  по кубу {t_new / n * 1000:6.1f} мс на смену фильтра")
+    print("  таблицы разделов по кубу = расчёт по строкам df_all (и для отделов без успешных сделок и без сделок)")
+
+
+if __name__ == "__main__":
+    main()
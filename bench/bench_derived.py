@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк и сверка производного кадра: полная сборка build_deals_frame против
+пересчёта порога «нет активности» (apply_stuck_days) по готовому кадру; история
+стадий одним кадром (history_frame) против кадра на сделку; is_success без apply.
+Результаты должны совпадать. Версия исходных данных (raw_version) меняется при переносе
+срока задачи и замене записи истории, даже если число записей то же.
+
+    python bench/bench_derived.py                 # 1k и 10k сделок
+    python bench/bench_derived.py --sizes 50000
+"""
+
+import argparse, os, sys, time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scoring import SUCCESS_NAME_BY_CAT, apply_stuck_days
+from pipeline import deals_frame, add_stages, history_frame, add_fail_stage, build_deals_frame, raw_version
+from bench.fake_bitrix import CATEGORIES, make_portal, stage_list
+
+NOW = datetime(2025, 1, 1)
+
+
+def history_frames_per_deal(history_raw):
+    """Прежняя реализация: кадр на сделку — эталон для сверки."""
+    history_info = {}
+    for did, items in history_raw.items():
+        h = pd.DataFrame(items)
+        if h.empty:
+            continue
+        if "STAGE_ID" not in h.columns and "STATUS_ID" in h.columns:
+            h["STAGE_ID"] = h["STATUS_ID"]
+        time_cols = []
+        for c in ["CREATED_TIME","CREATED","CHANGED_TIME","DATE_CREATE"]:
+            if c in h.columns:
+                h[c] = pd.to_datetime(h[c], errors="coerce"); time_cols.append(c)
+        if not time_cols:
+            continue
+        tcol = time_cols[0]
+        h = h.dropna(subset=[tcol]).sort_values(tcol)
+        history_info[did] = h[["STAGE_ID", tcol]].rename(columns={tcol:"TS"})
+    return history_info
+
+def fail_stage_per_deal(history_info, name_map):
+    out = {}
+    for did, hist in history_info.items():
+        if len(hist) >= 2:
+            prev = hist.iloc[-2]["STAGE_ID"]
+            out[did] = name_map.get(str(prev), str(prev))
+    return out
+
+
+def timed(fn, *args, **kw):
+    t = time.perf_counter()
+    out = fn(*args, **kw)
+    return out, time.perf_counter() - t
+
+
+def run(size):
+    portal = make_portal(size, now=NOW, users=max(20, size // 500))
+    deals = portal["deals"]
+    acts = {}
+    for a in portal["activities"]:
+        acts.setdefault(int(a["OWNER_ID"]), []).append(a)
+    history_raw = {}
+    for r in portal["history"]:
+        history_raw.setdefault(int(r["OWNER_ID"]), []).append(r)
+    stages = [s for cat in CATEGORIES for s in stage_list(cat)]
+    sort_map = {s["STATUS_ID"]: int(s["SORT"]) for s in stages}
+    name_map = {s["STATUS_ID"]: s["NAME"] for s in stages}
+    users_map = {u: f"Менеджер{u}" for u in range(1, 1 + max(20, size // 500))}
+    df_raw = deals_frame(deals)
+    print(f"\n{size} сделок, {len(portal['activities'])} активностей, {len(portal['history'])} записей истории")
+
+    # история стадий
+    old_info, t_old = timed(history_frames_per_deal, history_raw)
+    old = fail_stage_per_deal(old_info, name_map)
+    hist, t_new = timed(history_frame, history_raw)
+    new = add_fail_stage(pd.DataFrame({"ID": list(history_raw)}), hist, name_map)
+    new = dict(zip(new["ID"], new["fail_from_stage_hist"]))
+    assert {k: v for k, v in new.items() if pd.notna(v)} == old
+    print(f"  история: кадр на сделку {t_old:.3f} с  один кадр {t_new:.3f} с  этапы провала совпадают")
+
+    # is_success: apply(axis=1) против map + сравнение
+    df = add_stages(df_raw.copy(), users_map, CATEGORIES, sort_map, name_map)
+    ref, t_old = timed(df.apply, lambda r: (SUCCESS_NAME_BY_CAT.get(r["cat_norm"]) == r["stage_name"]), axis=1)
+    np.testing.assert_array_equal(ref.to_numpy(dtype=bool), df["is_success"].to_numpy())
+    print(f"  is_success: apply(axis=1) {t_old:.3f} с  совпадает с колоночным")
+
+    # полная сборка против пересчёта порога
+    base, t_full = timed(build_deals_frame, df_raw, acts, users_map, CATEGORIES, sort_map, name_map,
+                         history=hist, stuck_days=5, now=NOW)
+    for days in (2, 9, 21):
+        full = build_deals_frame(df_raw, acts, users_map, CATEGORIES, sort_map, name_map,
+                                 history=hist, stuck_days=days, now=NOW)
+        inc, t_inc = timed(apply_stuck_days, base, days)
+        pd.testing.assert_frame_equal(full, inc)
+    print(f"  сборка кадра {t_full:.3f} с  apply_stuck_days {t_inc * 1000:.1f} мс  кадры совпадают")
+
+    # версия исходных данных (ключ кэша кадра): правка без изменения числа записей
+    version, t_ver = timed(raw_version, deals, acts, history_raw, users_map, CATEGORIES, sort_map, name_map)
+    did = next(d for d, v in acts.items() if v)
+    moved = {**acts, did: [{**acts[did][0], "DEADLINE": "2030-01-01T00:00:00+03:00"}] + acts[did][1:]}
+    did = next(iter(history_raw))
+    replaced = {**history_raw, did: history_raw[did][:-1] + [{**history_raw[did][-1], "ID": "0"}]}
+    assert raw_version(deals, dict(acts), dict(history_raw), users_map, CATEGORIES, sort_map, name_map) == version
+    assert raw_version(deals, moved, history_raw, users_map, CATEGORIES, sort_map, name_map) != version
+    assert raw_version(deals, acts, replaced, users_map, CATEGORIES, sort_map, name_map) != version
+    print(f"  raw_version {t_ver * 1000:.1f} мс  перенос срока задачи и замена записи истории меняют версию")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,10000")
+    args = ap.parse_args()
+    for size in [int(x) for x in args.sizes.split(",")]:
+        run(size)
+
+
+if __name__ == "__main__":
+    main()
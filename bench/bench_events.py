@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк и сверка приёмника событий (events.py) на синтетическом портале:
+изменяем сделки и активности на фейке, шлём события ONCRM* в приёмник и ждём,
+пока локальная база догонит портал. Затем повтор записанных событий во вторую
+базу. Обе базы должны совпасть с полной синхронизацией с нуля. Сделки, удалённые
+без события, убирает обход только ID (DealStore.prune). Разбор, упавший на ошибке
+Bitrix, повторяется сам — без новых событий.
+
+    python bench/bench_events.py                  # 10k сделок, 50 изменений
+    python bench/bench_events.py --deals 100000 --changes 200
+"""
+
+import argparse, json, os, random, sys, tempfile, time
+from datetime import date, datetime, timedelta
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import events, loaders
+from bitrix import BitrixClient
+from store import ActivityCache, DealStore
+from bench.fake_bitrix import FakeBitrix, make_portal, serve
+
+
+def dump(store):
+    return {r[0]: json.loads(r[1]) for r in store.db.execute("SELECT id, data FROM deals")}
+
+def post(url, body):
+    with urlopen(url, data=body.encode(), timeout=10) as r:
+        return r.status
+
+class FailingOnce:
+    """Клиент, первый get_all которого падает (сбой Bitrix во время разбора)."""
+    def __init__(self, client):
+        self.client, self.failed = client, False
+
+    def get_all(self, *args, **kw):
+        if not self.failed:
+            self.failed = True
+            raise RuntimeError("сбой Bitrix")
+        return self.client.get_all(*args, **kw)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--deals", type=int, default=10000)
+    ap.add_argument("--changes", type=int, default=50)
+    args = ap.parse_args()
+    now = datetime.now().replace(microsecond=0)
+    portal = make_portal(args.deals, now=now)
+    fake = FakeBitrix(**portal)
+    bx_server, webhook = serve(fake)
+    client = BitrixClient(webhook, rate=1e6, burst=1e6)
+    tmp = tempfile.mkdtemp()
+    live, replayed = DealStore(os.path.join(tmp, "live.sqlite")), DealStore(os.path.join(tmp, "replay.sqlite"))
+    live.sync(client); replayed.sync(client)
+    acts = ActivityCache(os.path.join(tmp, "live.sqlite"))
+    rnd = random.Random(7)
+    ids = sorted(dump(live))
+    touched = rnd.sample(ids, args.changes * 2)
+    acts.get_many({d: "v" for d in touched}, lambda x: loaders.fetch_activities(client, x))
+    record = os.path.join(tmp, "events.jsonl")
+    sink = events.EventSink(client, live, acts, token="t", delay=0.2).start()
+    ev_server, url = events.serve(sink, record=record)
+    print(f"{args.deals} сделок; изменений: {args.changes} сделок, {args.changes // 2} активностей, 3 удаления")
+
+    # ---- изменения на портале + события ----
+    stamp = lambda: (now + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S+03:00")
+    bodies = []
+    for did in touched[:args.changes]:
+        d = dict(fake.deals.get(did), OPPORTUNITY=str(rnd.randint(1, 900) * 1000), DATE_MODIFY=stamp())
+        fake.deals.put(d)
+        bodies.append(events.event_body("ONCRMDEALUPDATE", did, "t"))
+    next_act = max(int(a["ID"]) for a in portal["activities"]) + 1
+    for k, did in enumerate(touched[args.changes:args.changes + args.changes // 2]):
+        fake.activities.put({"ID": str(next_act + k), "OWNER_ID": str(did), "OWNER_TYPE_ID": "2", "TYPE_ID": "2",
+                             "COMPLETED": "N", "DEADLINE": stamp(), "CREATED": stamp(), "LAST_UPDATED": stamp()})
+        fake.deals.put(dict(fake.deals.get(did), LAST_ACTIVITY_TIME=stamp()))
+        bodies.append(events.event_body("ONCRMACTIVITYADD", next_act + k, "t"))
+    for did in touched[-3:]:
+        fake.deals.remove(did)
+        bodies.append(events.event_body("ONCRMDEALDELETE", did, "t"))
+    bodies.append(events.event_body("ONCRMCONTACTUPDATE", 1, "t"))  # чужая сущность — пропускается
+    try:
+        post(url, events.event_body("ONCRMDEALUPDATE", ids[0], "чужой"))
+        raise AssertionError("событие с чужим токеном принято")
+    except HTTPError as e:
+        assert e.code == 403
+
+    http, t = fake.http, time.perf_counter()
+    for b in bodies:
+        post(url, b)
+    t_post = time.perf_counter() - t
+    while sink.stats["applied"] < sink.stats["received"]:
+        time.sleep(0.01)
+    t_fresh = time.perf_counter() - t
+    print(f"  приём {len(bodies)} событий {t_post * 1000:.0f} мс; база догнала портал за {t_fresh:.2f} с, "
+          f"запросов к Bitrix {fake.http - http}; {sink.stats}")
+
+    # ---- сверка с полной синхронизацией ----
+    fresh = DealStore(":memory:"); fresh.sync(client)
+    assert dump(live) == dump(fresh), "база после событий расходится с порталом"
+    got = acts.get_many({d: "v" for d in touched[args.changes:args.changes + args.changes // 2]},
+                        lambda x: loaders.fetch_activities(client, x))
+    assert all(any(int(a["ID"]) >= next_act for a in v) for v in got.values()), "кэш активностей не сброшен"
+    print("  база = полная синхронизация; активности затронутых сделок обновлены")
+
+    # ---- повтор записи во вторую базу ----
+    n = events.replay(record, events.EventSink(client, replayed, ActivityCache(os.path.join(tmp, "replay.sqlite"))))
+    assert dump(replayed) == dump(fresh), "повтор событий расходится с порталом"
+    print(f"  повтор {n} записанных событий → вторая база = полная синхронизация")
+
+    # ---- только активность (перенос срока): ревизия базы — ключ кэша дашборда — меняется ----
+    act = dict(next(a for a in portal["activities"] if int(a["OWNER_ID"]) in dump(live)))
+    fake.activities.put(dict(act, DEADLINE=stamp(), LAST_UPDATED=stamp()))
+    rev, applied = live.revision(), sink.stats["applied"]
+    post(url, events.event_body("ONCRMACTIVITYUPDATE", act["ID"], "t"))
+    while sink.stats["applied"] == applied:
+        time.sleep(0.01)
+    assert live.revision() > rev, "событие активности не сменило ревизию базы"
+    print(f"  перенос срока задачи: ревизия базы {rev} → {live.revision()}")
+
+    # ---- удаления без событий: обход только ID ----
+    for did in touched[-6:-3]:
+        fake.deals.remove(did)
+    http, t = fake.http, time.perf_counter()
+    live.sync(client)  # как запрос дашборда: удалённые сделки не видит
+    pruned = live.prune(client)
+    fresh = DealStore(":memory:"); fresh.sync(client)
+    assert pruned == 3 and dump(live) == dump(fresh), "обход ID не удалил сделки без событий"
+    print(f"  синхронизация + обход ID (3 удаления без событий) {time.perf_counter() - t:.2f} с, "
+          f"запросов {fake.http - http}; база = полная синхронизация")
+
+    # ---- повтор разбора после ошибки, без новых событий ----
+    flaky = events.EventSink(FailingOnce(client), DealStore(":memory:"), ActivityCache(), delay=0.05, retry=0.2).start()
+    did = ids[1]
+    fake.deals.put(dict(fake.deals.get(did), TITLE="после сбоя", DATE_MODIFY=stamp()))
+    flaky.submit(events.parse_event(events.event_body("ONCRMDEALUPDATE", did)))
+    t = time.perf_counter()
+    while flaky.stats["applied"] < 1 and time.perf_counter() - t < 5:
+        time.sleep(0.01)
+    assert flaky.client.failed and flaky.stats["applied"] == 1, "разбор после ошибки не повторён"
+    assert flaky.store.deals_for_period(date(2000, 1, 1), date(2100, 1, 1))[0]["TITLE"] == "после сбоя"
+    print(f"  разбор после ошибки Bitrix повторён через {time.perf_counter() - t:.2f} с без новых событий")
+
+    # ---- для сравнения: перезагрузка периода без базы ----
+    http, t = fake.http, time.perf_counter()
+    loaders.deals_dual(client, None, date.today() - timedelta(days=365), date.today(), limit=None)
+    print(f"  для сравнения: перезагрузка года без базы {time.perf_counter() - t:.2f} с, запросов {fake.http - http}")
+    ev_server.shutdown(); bx_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Сквозной бенчмарк дашборда на синтетическом портале: каждый загрузчик (bx_get_*
+без кэша Streamlit) и каждый этап сборки кадра — время, HTTP-запросы, строки.
+
+    python bench/bench_loaders.py                        # 1k и 10k сделок, без лимитов
+    python bench/bench_loaders.py --sizes 100000
+    python bench/bench_loaders.py --rate 2 --burst 50    # с лимитами Bitrix24 на фейке и клиенте
+
+Сделки периода из API и из базы (DealStore) должны совпасть (дни периода — UTC, конец
+периода — целиком). История стадий сверяется с полным путём сделок на портале, в том
+числе у проваленной сделки, предыдущий этап которой раньше окна истории (начало периода
+− 90 дней).
+"""
+
+import argparse, os, sys, time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import loaders
+from bitrix import BitrixClient
+from store import ActivityCache, DealStore, HistoryStore
+from scoring import CAT_MAIN, CAT_PHYS, CAT_LOW, compute_health_scores, compact_scored
+from pipeline import deals_frame, deal_versions, add_stages, add_cheat, history_frame, add_fail_stage
+from periods import DateIndex, ts_batch
+from bench.fake_bitrix import FakeBitrix, make_portal, serve, _iso
+
+NOW = datetime(2025, 1, 1)
+
+
+class Timer:
+    def __init__(self, fake):
+        self.fake = fake
+        print(f"  {'этап':<34} {'сек':>8} {'запросов':>9} {'строк':>9}")
+
+    def __call__(self, label, fn, *args, **kw):
+        http = self.fake.http
+        t = time.perf_counter()
+        out = fn(*args, **kw)
+        dt = time.perf_counter() - t
+        rows = len(out) if hasattr(out, "__len__") else ""
+        print(f"  {label:<34} {dt:>8.3f} {self.fake.http - http:>9} {rows:>9}")
+        return out
+
+
+def add_old_fail(portal, end):
+    """Проваленная в периоде сделка, созданная за 300 дней до конца периода: предыдущий
+    этап (PREPARATION) — раньше окна истории (начало периода − 90 дней). ID сделки."""
+    did, hid = str(len(portal["deals"]) + 1), len(portal["history"])
+    created = datetime.combine(end, datetime.min.time()) - timedelta(days=300)
+    lost = datetime.combine(end, datetime.min.time()) - timedelta(days=2)
+    portal["deals"].append({**portal["deals"][0], "ID": did, "STAGE_ID": "LOSE", "STAGE_SEMANTIC_ID": "F", "CATEGORY_ID": "0",
+                            "DATE_CREATE": _iso(created), "DATE_MODIFY": _iso(lost), "CLOSEDATE": _iso(lost)})
+    for k, (t, stage, sem) in enumerate(((created, "NEW", "P"), (created + timedelta(days=10), "PREPARATION", "P"),
+                                         (lost, "LOSE", "F"))):
+        portal["history"].append({"ID": str(hid + k + 1), "TYPE_ID": "1" if k == 0 else "2", "OWNER_ID": did,
+                                  "CREATED_TIME": _iso(t), "CATEGORY_ID": "0", "STAGE_SEMANTIC_ID": sem, "STAGE_ID": stage})
+    return int(did)
+
+def check_history(portal, history_raw, deal_ids):
+    """Загруженная история каждой сделки = весь её путь по стадиям на портале."""
+    full = {}
+    for h in portal["history"]:
+        full.setdefault(int(h["OWNER_ID"]), []).append(h["ID"])
+    for did in deal_ids:
+        got = [h["ID"] for h in history_raw.get(did, [])]
+        assert got == full.get(did, []), f"история сделки {did}: {got} != {full.get(did)}"
+
+
+def run(size, args):
+    portal = make_portal(size, now=NOW, users=max(20, size // 500))
+    old_fail = add_old_fail(portal, NOW.date() - timedelta(days=1))
+    fake = FakeBitrix(**portal, rate=args.rate or None, burst=args.burst)
+    server, url = serve(fake)
+    limits = {"rate": args.rate, "burst": args.burst} if args.rate else {"rate": 1e6, "burst": 1e6}
+    client = BitrixClient(url, max_workers=args.workers, **limits)
+    end = NOW.date() - timedelta(days=1)
+    start = end - timedelta(days=args.days - 1)
+    print(f"\n{size} сделок, период {start} → {end}, лимит {args.rate or '—'} rps")
+    t = Timer(fake)
+
+    # ---- загрузчики ----
+    deals = t("deals_dual (API)", loaders.deals_dual, client, None, start, end, limit=size)
+    store = DealStore(":memory:")
+    stored = t("deals_dual (база, холодная)", loaders.deals_dual, client, store, start, end, limit=size)
+    assert [d["ID"] for d in deals] == [d["ID"] for d in stored], "сделки периода: API != база"
+    t("deals_dual (база, тёплая)", loaders.deals_dual, client, store, start, end, limit=size)
+    users = t("users_full", loaders.users_full, client)
+    t("departments", loaders.departments, client)
+    categories = t("categories", loaders.categories, client)
+    cat_ids = sorted({int(d["CATEGORY_ID"]) for d in deals})
+    sort_map, name_map = t("stage_map_by_category", loaders.stage_map_by_category, client, cat_ids)
+    cache = ActivityCache()
+    versions = deal_versions(deals)
+    acts = t("activities (холодный кэш)", loaders.activities, client, cache, versions)
+    t("activities (тёплый кэш)", loaders.activities, client, cache, versions)
+    hist_store = HistoryStore()
+    ids = [int(d["ID"]) for d in deals]
+    since = start - timedelta(days=loaders.HISTORY_LOOKBACK_DAYS)
+    history_raw = t("stage_history (холодная)", loaders.stage_history, client, hist_store, ids, since)
+    t("stage_history (тёплая)", loaders.stage_history, client, hist_store, ids, since)
+    assert old_fail in ids
+    check_history(portal, history_raw, ids)
+
+    # ---- сборка кадра ----
+    users_map = {uid: u["name"] for uid, u in users.items()}
+    df_raw = t("deals_frame", deals_frame, deals)
+    df = t("compute_health_scores", compute_health_scores, df_raw, acts, now=NOW)
+    df = t("add_stages", add_stages, df, users_map, categories, sort_map, name_map)
+    df = t("add_cheat", add_cheat, df, acts)
+    info = t("history_frame", history_frame, history_raw)
+    df = t("add_fail_stage", add_fail_stage, df, info, name_map)
+    prev = df.loc[df["ID"] == old_fail, "fail_from_stage_hist"].iloc[0]
+    assert prev == name_map.get("PREPARATION", "PREPARATION"), f"этап провала старой сделки: {prev}"
+    df = t("compact_scored", compact_scored, df)
+    ix = t("DateIndex ×3", lambda: {c: DateIndex(df[c]) for c in ("DATE_CREATE", "CLOSEDATE", "DATE_MODIFY")})
+    m_created, m_closed, m_modify = (ix[c].mask(start, end) for c in ("DATE_CREATE", "CLOSEDATE", "DATE_MODIFY"))
+    m_succ = m_closed & df["is_success"].to_numpy() & df["cat_norm"].isin([CAT_MAIN, CAT_PHYS, CAT_LOW]).to_numpy()
+    specs = {
+        "deals": {"date": "DATE_CREATE", "value": "ID", "agg": "count", "rows": m_created},
+        "rev": {"date": "CLOSEDATE", "value": "OPPORTUNITY", "agg": "sum", "rows": m_succ,
+                "by": "cat_norm", "groups": [CAT_MAIN, CAT_PHYS, CAT_LOW]},
+        "health": {"date": "DATE_MODIFY", "value": "health", "agg": "mean", "rows": m_modify},
+        **{c: {"date": "DATE_MODIFY", "value": c, "agg": "sum", "rows": m_modify}
+           for c in ("flag_no_tasks", "flag_no_company", "flag_no_contact", "flag_stuck", "is_fail")},
+    }
+    t("ts_batch (ряды Обзора/Проблем)", ts_batch, df, specs, start, end, "НИТ", index=ix)
+    if fake.rejected:
+        print(f"  отказов QUERY_LIMIT_EXCEEDED: {fake.rejected}")
+    client.close()
+    server.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,10000")
+    ap.add_argument("--days", type=int, default=90, help="длина периода, дней до 2025-01-01")
+    ap.add_argument("--rate", type=float, default=0, help="лимит запросов/сек (0 — без лимитов)")
+    ap.add_argument("--burst", type=int, default=50)
+    ap.add_argument("--workers", type=int, default=4)
+    args = ap.parse_args()
+    for size in [int(x) for x in args.sizes.split(",")]:
+        run(size, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Память кадра сделок: схема «как есть» (object-строки, int64/float64) против
+compact_scored (категории, узкие числа, bool). Проверяет, что группировки
+по менеджеру/этапу дают те же цифры в обеих схемах.
+
+    python bench/bench_memory.py                  # 100k сделок
+    python bench/bench_memory.py --rows 10000 --columns
+"""
+
+import argparse, os, sys, time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scoring import compute_health_scores, compact_scored, memory_report, is_failure_reason, failure_group
+from bench.bench_scoring import raw_frame
+
+STAGE_NAMES = {"NEW": "Новая", "PREPARATION": "Подготовка", "EXECUTING": "В работе",
+               "WON": "Успешно реализовано", "LOSE": "Дорого", "1": "Недозвон"}
+CATEGORIES = {0: "Основная воронка продаж", 1: "Физ.Лица", 2: "Не приоритетные сделки"}
+
+
+def scored_frame(n):
+    """Кадр с теми же производными колонками, что строит дашборд."""
+    now = pd.Timestamp("2025-01-01 12:00:00")
+    df = compute_health_scores(raw_frame(n), {i: [{}] for i in range(1, n + 1, 3)}, stuck_days=5, now=now)
+    df["stage_sort"] = df["STAGE_ID"].map(lambda s: list(STAGE_NAMES).index(s.split(":")[-1]) * 10)
+    df["stage_name"] = df["STAGE_ID"].map(lambda s: STAGE_NAMES[s.split(":")[-1]])
+    df["manager"]    = df["ASSIGNED_BY_ID"].map(lambda u: f"Менеджер {u}")
+    df["category"]   = df["CATEGORY_ID"].map(lambda x: CATEGORIES.get(int(x or 0), "Воронка"))
+    df["cat_norm"]   = df["category"].str.strip().str.casefold()
+    df["is_success"] = df["stage_name"] == "Успешно реализовано"
+    df["is_fail"]    = df["stage_name"].map(is_failure_reason)
+    df["fail_group"] = df["stage_name"].map(failure_group)
+    rnd = np.random.default_rng(3)
+    df["reschedules"] = rnd.integers(0, 6, len(df))
+    df["micro_tasks"] = rnd.integers(0, 8, len(df))
+    df["cheat_flag"]  = (df["reschedules"] >= 3) | (df["micro_tasks"] >= 5)
+    df["fail_from_stage_hist"] = df["stage_name"].where(df["is_fail"])
+    return df
+
+
+def summary(df):
+    by_mgr = df.groupby("manager", observed=True).agg(
+        deals=("ID", "count"), revenue=("OPPORTUNITY", "sum"), health=("health", "mean"),
+        stuck=("flag_stuck", "sum"), cheat=("cheat_flag", "sum"))
+    by_stage = df.groupby(["stage_name", "stage_sort"], observed=True).size()
+    return by_mgr.astype(float), by_stage.rename(None).astype(int)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--columns", action="store_true", help="показать память по колонкам")
+    args = ap.parse_args()
+    df = scored_frame(args.rows)
+    t = time.perf_counter(); compact = compact_scored(df); t_cast = time.perf_counter() - t
+
+    before, after = memory_report(df), memory_report(compact)
+    if args.columns:
+        print(before.join(after, rsuffix="_compact").to_string())
+    mb_before, mb_after = before["MB"].sum(), after["MB"].sum()
+    print(f"rows={args.rows}  было {mb_before:.1f} МБ  стало {mb_after:.1f} МБ  "
+          f"(x{mb_before / mb_after:.1f}, приведение {t_cast:.2f} с)")
+
+    for a, b in zip(summary(df), summary(compact)):
+        a, b = a.reset_index(), b.reset_index()
+        pd.testing.assert_frame_equal(a.astype(str), b.astype(str))
+    print("группировки совпадают")
+
+
+if __name__ == "__main__":
+    main()
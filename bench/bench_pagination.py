@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк пагинации crm.deal.list: offset (start=N) против keyset (filter[>ID], start=-1).
+Печатает латентность первой/последней страницы и среднюю по объёму выборки.
+
+    python bench/bench_pagination.py                      # фейковый вебхук, 1k/5k/20k сделок
+    python bench/bench_pagination.py --webhook https://…  # реальный портал (только чтение)
+"""
+
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bitrix import BitrixClient
+from bench.fake_bitrix import FakeBitrix, make_deals, serve
+
+
+def timed_pages(client, keyset):
+    lat = []
+    call = client.call
+    def _timed(*a, **kw):
+        t = time.perf_counter()
+        try:
+            return call(*a, **kw)
+        finally:
+            lat.append((time.perf_counter() - t) * 1000)
+    client.call = _timed
+    rows = client.get_all("crm.deal.list", {"select[]": ["ID", "DATE_CREATE"]}, keyset=keyset)
+    client.call = call
+    return len(rows), lat
+
+
+def report(label, n, lat):
+    print(f"{label:<8} {n:>7} {len(lat):>6} {lat[0]:>10.1f} {lat[-1]:>10.1f} {sum(lat)/len(lat):>10.1f} {sum(lat)/1000:>8.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--webhook", default="")
+    ap.add_argument("--sizes", default="1000,5000,20000")
+    ap.add_argument("--row-cost", type=float, default=1e-6)
+    args = ap.parse_args()
+    print(f"{'mode':<8} {'rows':>7} {'pages':>6} {'first,ms':>10} {'last,ms':>10} {'mean,ms':>10} {'total,s':>8}")
+    if args.webhook:
+        sizes = [None]
+    else:
+        sizes = [int(x) for x in args.sizes.split(",")]
+    for size in sizes:
+        server = None
+        if size is None:
+            url = args.webhook
+        else:
+            server, url = serve(FakeBitrix(make_deals(size), row_cost=args.row_cost))
+        for label, keyset in (("offset", False), ("keyset", True)):
+            # на фейке меряем сервер, а не лимитер; реальный портал — с лимитами по умолчанию
+            limits = {} if size is None else {"rate": 1e6, "burst": 1e6}
+            client = BitrixClient(url, max_workers=1, **limits)
+            n, lat = timed_pages(client, keyset)
+            report(label, n, lat)
+            client.close()
+        if server:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк и сверка среза по периоду: .dt.date.between (дата Python на строку)
+против DateIndex (searchsorted по отсортированным позициям), и набора рядов
+дашборда: отдельные вызовы ts_with_prev против одного ts_batch. Маски и ряды
+должны совпадать.
+
+    python bench/bench_periods.py                 # 100k сделок, 20 периодов
+    python bench/bench_periods.py --rows 10000 --periods 50
+"""
+
+import argparse, os, random, sys, time
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scoring import to_dt_col
+from periods import DateIndex, previous_period, period_freq, ts_batch, ts_with_prev
+from bench.fake_bitrix import make_deals
+
+COLS = ["DATE_CREATE", "CLOSEDATE", "DATE_MODIFY"]
+
+
+def ts_with_prev_between(df, date_col, value_col, start, end, mode, agg="sum", freq_override=None):
+    """Прежняя реализация через .dt.date.between — эталон для сверки."""
+    if df.empty:
+        return pd.DataFrame(columns=["period", "value", "prev_value"])
+    m = df[date_col].dt.date.between(start, end)
+    freq = freq_override or period_freq(mode)
+    cur = df.loc[m].copy().set_index(date_col).resample(freq)[value_col].agg(agg).rename("value")
+    pstart, pend = previous_period(start, end)
+    m2 = df[date_col].dt.date.between(pstart, pend)
+    prev = df.loc[m2].copy().set_index(date_col).resample(freq)[value_col].agg(agg).rename("prev_value")
+    return pd.concat([cur, prev], axis=1, sort=True).fillna(0).reset_index().rename(columns={date_col: "period"})
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--periods", type=int, default=20)
+    args = ap.parse_args()
+    raw = pd.DataFrame(make_deals(args.rows))
+    df = pd.DataFrame({c: to_dt_col(raw[c]) for c in COLS})
+    df["ID"] = np.arange(1, len(df) + 1)
+    df["OPPORTUNITY"] = pd.to_numeric(raw["OPPORTUNITY"])
+    df["cat"] = raw["CATEGORY_ID"]
+    df["flag"] = raw["COMPANY_ID"].isna()
+    rnd = random.Random(5)
+    periods = []
+    for _ in range(args.periods):
+        s = date(2024, 1, 1) + timedelta(days=rnd.randint(0, 330))
+        periods.append((s, s + timedelta(days=rnd.choice([0, 6, 30, 90]))))
+
+    t = time.perf_counter()
+    old = [df[c].dt.date.between(s, e).to_numpy() for s, e in periods for c in COLS]
+    t_old = time.perf_counter() - t
+    t = time.perf_counter(); ix = {c: DateIndex(df[c]) for c in COLS}; t_build = time.perf_counter() - t
+    t = time.perf_counter()
+    new = [ix[c].mask(s, e) for s, e in periods for c in COLS]
+    t_new = time.perf_counter() - t
+    for a, b in zip(old, new):
+        np.testing.assert_array_equal(a, b)
+    n = len(old)
+    print(f"rows={args.rows}  срезов={n}  between {t_old / n * 1000:.2f} мс/срез  "
+          f"DateIndex {t_new / n * 1000:.3f} мс/срез (+ построение {t_build * 1000:.0f} мс)  маски совпадают")
+
+    for s, e in periods[:5]:
+        a = ts_with_prev_between(df, "DATE_MODIFY", "ID", s, e, "НИТ", agg="count")
+        b = ts_with_prev(df, "DATE_MODIFY", "ID", s, e, "НИТ", agg="count", index=ix["DATE_MODIFY"])
+        pd.testing.assert_frame_equal(a, b)
+    print("ряды ts_with_prev совпадают")
+
+    # Набор рядов как в дашборде: каждый ряд — по своему поднабору периода
+    s, e = date(2024, 10, 1), date(2024, 12, 31)
+    masks = {c: ix[c].mask(s, e) for c in COLS}
+    specs = {
+        "deals":  {"date": "DATE_CREATE", "value": "ID", "agg": "count", "rows": masks["DATE_CREATE"]},
+        "rev":    {"date": "CLOSEDATE", "value": "OPPORTUNITY", "agg": "sum", "rows": masks["CLOSEDATE"]},
+        "rev_cat": {"date": "CLOSEDATE", "value": "OPPORTUNITY", "agg": "sum", "rows": masks["CLOSEDATE"],
+                    "by": "cat", "groups": ["0", "1", "2"]},
+        "mean":   {"date": "DATE_MODIFY", "value": "OPPORTUNITY", "agg": "mean", "rows": masks["DATE_MODIFY"]},
+        **{f"flag{k}": {"date": "DATE_MODIFY", "value": "flag", "agg": "sum", "rows": masks["DATE_MODIFY"]} for k in range(5)},
+    }
+    for freq in ["D", "W-MON"]:
+        t = time.perf_counter()
+        old = {}
+        for name, sp in specs.items():
+            sub = df[sp["rows"]]
+            if sp.get("by"):
+                parts = [ts_with_prev_between(sub[sub[sp["by"]] == g], sp["date"], sp["value"], s, e, "НИТ", sp["agg"], freq)
+                         .assign(**{sp["by"]: g}) for g in sp["groups"]]
+                old[name] = pd.concat(parts, ignore_index=True)
+            else:
+                old[name] = ts_with_prev_between(sub.assign(flag=sub["flag"].astype(int)), sp["date"], sp["value"],
+                                                 s, e, "НИТ", sp["agg"], freq)
+        t_old = time.perf_counter() - t
+        t = time.perf_counter(); new = ts_batch(df, specs, s, e, "НИТ", freq_override=freq, index=ix); t_new = time.perf_counter() - t
+        for name in specs:
+            pd.testing.assert_frame_equal(old[name], new[name], check_freq=False)
+        print(f"{len(specs)} рядов, {freq}: по отдельности {t_old * 1000:.0f} мс  ts_batch {t_new * 1000:.0f} мс  совпадают")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк и сверка помесячной выручки плана/факта (store.RevenueStore) на синтетическом портале:
+полный разбор базы сделок против прежнего расчёта раздела «План/факт» по кадру за год,
+затем изменения на портале (стадии, суммы, удаления) → синхронизация базы → разбор только
+изменённых сделок. Агрегат после каждого шага сверяется с пересчётом с нуля.
+
+    python bench/bench_revenue.py                     # 10k сделок, 300 изменений
+    python bench/bench_revenue.py --deals 100000 --changes 2000
+"""
+
+import argparse, json, os, random, sys, tempfile, time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import loaders
+from bitrix import BitrixClient
+from store import DealStore, RevenueStore
+from scoring import CAT_MAIN, CAT_PHYS, CAT_LOW
+from pipeline import deals_frame, build_deals_frame, revenue_frame, revenue_rows, revenue_months
+from bench.fake_bitrix import FakeBitrix, make_portal, serve
+
+
+def by_month(months):
+    return months.groupby("month")["amount"].sum().reindex(range(1, 13), fill_value=0).round(2)
+
+def plan_fact_old(df_all, year):
+    """Прежний расчёт факта по месяцам в разделе «План/факт» (по кадру сделок)."""
+    succ_y = df_all[(df_all["is_success"]) & (df_all["cat_norm"].isin({CAT_MAIN, CAT_PHYS, CAT_LOW}))].copy()
+    succ_y["rev_date"] = succ_y["CLOSEDATE"].fillna(succ_y["DATE_MODIFY"])
+    succ_y = succ_y[succ_y["rev_date"].dt.year == year]
+    return succ_y.groupby(succ_y["rev_date"].dt.month)["OPPORTUNITY"].sum().reindex(range(1, 13), fill_value=0).round(2)
+
+def check(store, revenue, contrib, year, label):
+    all_deals = [json.loads(r[0]) for r in store.db.execute("SELECT data FROM deals")]
+    ref = revenue_months(contrib(all_deals))
+    got = revenue.months(year)
+    ref = ref[ref["year"] == year].reset_index(drop=True)
+    keys = ["month", "cat_norm", "ASSIGNED_BY_ID"]
+    a = got.sort_values(keys).reset_index(drop=True)
+    b = ref.sort_values(keys).reset_index(drop=True)
+    assert a[keys + ["deals"]].equals(b[keys + ["deals"]].astype(a[keys + ["deals"]].dtypes)), f"{label}: ячейки агрегата"
+    assert (a["amount"] - b["amount"]).abs().max() < 0.01 if len(a) else True, f"{label}: суммы агрегата"
+    print(f"  {label}: агрегат = пересчёт с нуля ({len(a)} ячеек месяц×воронка×менеджер)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--deals", type=int, default=10000)
+    ap.add_argument("--changes", type=int, default=300)
+    args = ap.parse_args()
+    now = datetime.now().replace(microsecond=0)
+    year = now.year
+    portal = make_portal(args.deals, now=now)
+    fake = FakeBitrix(**portal)
+    server, url = serve(fake)
+    client = BitrixClient(url, rate=1e6, burst=1e6)
+    path = os.path.join(tempfile.mkdtemp(), "deals.sqlite")
+    store, revenue = DealStore(path), RevenueStore(path)
+    store.sync(client)
+    categories = loaders.categories(client)
+    sort_map, name_map = loaders.stage_map_by_category(client, list(categories))
+    contrib = lambda deals: revenue_rows(revenue_frame(deals, categories, name_map))
+    rules = json.dumps([categories, name_map], sort_keys=True, ensure_ascii=False)
+    print(f"{args.deals} сделок, год {year}")
+
+    # ---- полный разбор против прежнего расчёта по кадру года ----
+    t = time.perf_counter()
+    n = revenue.refresh(contrib, rules)
+    print(f"  полный разбор базы: {n} сделок за {time.perf_counter() - t:.2f} с")
+    http, t = fake.http, time.perf_counter()
+    deals = loaders.deals_dual(client, None, date(year, 1, 1), date(year, 12, 31), limit=None)
+    users = loaders.users_full(client)
+    df_all = build_deals_frame(deals_frame(deals), {}, {u: v["name"] for u, v in users.items()}, categories, sort_map, name_map)
+    old = plan_fact_old(df_all, year)
+    print(f"  прежний путь (кадр за год из Bitrix): {time.perf_counter() - t:.2f} с, запросов {fake.http - http}")
+    new = by_month(revenue.months(year))
+    # прежний кадр года не видит успешных сделок без даты создания/закрытия в году — их и нет в портале
+    assert (old - new).abs().max() < 0.01, f"факт по месяцам расходится:\n{old}\n{new}"
+    print(f"  факт по месяцам = прежний расчёт по году: {new.sum():,.0f} ₽".replace(",", " "))
+    check(store, revenue, contrib, year, "после полного разбора")
+
+    # ---- изменения на портале → синхронизация → разбор только изменённых ----
+    rnd = random.Random(11)
+    ids = [int(d["ID"]) for d in portal["deals"]]
+    # DATE_MODIFY фейка — до created + 60 дней: изменения позже всех, чтобы попасть в синхронизацию
+    stamp = (now + timedelta(days=61)).strftime("%Y-%m-%dT%H:%M:%S+03:00")
+    for did in rnd.sample(ids, args.changes):
+        d = dict(fake.deals.get(did), DATE_MODIFY=stamp)
+        prefix = f"C{d['CATEGORY_ID']}:" if d["CATEGORY_ID"] != "0" else ""
+        what = rnd.choice(["won", "lose", "sum", "move"])
+        if what == "won": d.update(STAGE_ID=prefix + "WON", CLOSEDATE=stamp)
+        elif what == "lose": d.update(STAGE_ID=prefix + "LOSE")
+        elif what == "sum": d.update(OPPORTUNITY=f"{rnd.randint(1, 900) * 1000}.00")
+        else: d.update(ASSIGNED_BY_ID=str(rnd.randint(1, 20)), CLOSEDATE=f"{year}-0{rnd.randint(1, 9)}-15T12:00:00+03:00")
+        fake.deals.put(d)
+    for did in rnd.sample(ids, 5):
+        fake.deals.remove(did)
+    store.sync(client)
+    store.delete([did for did in ids if fake.deals.get(did) is None])
+    t = time.perf_counter()
+    n = revenue.refresh(contrib, rules)
+    print(f"  {args.changes} изменений + 5 удалений: разобрано {n} сделок за {(time.perf_counter() - t) * 1000:.0f} мс")
+    check(store, revenue, contrib, year, "после изменений")
+    t = time.perf_counter()
+    n = revenue.refresh(contrib, rules)
+    print(f"  повторный разбор без изменений: {n} сделок за {(time.perf_counter() - t) * 1000:.0f} мс")
+    check(store, revenue, contrib, year, "повтор")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк и сверка скоринга: колоночный compute_health_scores против прежней
+построчной реализации (iterrows). Выход должен совпадать кадр в кадр.
+
+    python bench/bench_scoring.py                 # 10k и 100k сделок
+    python bench/bench_scoring.py --sizes 1000
+"""
+
+import argparse, math, os, sys, time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scoring import compute_health_scores, to_dt, safe_float, clamp
+from bench.fake_bitrix import make_deals
+
+
+def _days_between(later, earlier):
+    a, b = to_dt(later), to_dt(earlier)
+    if pd.isna(a) or pd.isna(b): return None
+    return max(0, int((a - b) / pd.Timedelta(days=1)))
+
+def compute_health_scores_rowwise(df, open_tasks_map, stuck_days=5, now=None):
+    """Построчная реализация v5.7 (iterrows + to_dt на ячейку) — эталон для сверки."""
+    now = to_dt(pd.Timestamp.utcnow()) if now is None else now
+    rows = []
+    for _, r in df.iterrows():
+        create_dt = to_dt(r.get("DATE_CREATE"))
+        last = to_dt(r.get("LAST_ACTIVITY_TIME")) or to_dt(r.get("DATE_MODIFY")) or create_dt
+        begin_dt = to_dt(r.get("BEGINDATE")) or create_dt
+
+        d_work  = _days_between(now, create_dt) or 0
+        d_noact = _days_between(now, last) or 0
+        d_stage = _days_between(now, begin_dt) or 0
+
+        has_task = len(open_tasks_map.get(int(safe_float(r.get("ID"), 0)), [])) > 0
+
+        flags = {
+            "no_company": int(safe_float(r.get("COMPANY_ID"), 0)) == 0,
+            "no_contact": int(safe_float(r.get("CONTACT_ID"), 0)) == 0,
+            "no_tasks": not has_task,
+            "stuck": d_noact >= stuck_days,
+            "lost": str(r.get("STAGE_ID","")).upper().find("LOSE") >= 0
+        }
+
+        # Здоровье
+        score = 100
+        if flags["no_company"]: score -= 10
+        if flags["no_contact"]: score -= 10
+        if flags["no_tasks"]:   score -= 25
+        if flags["stuck"]:      score -= 25
+        if flags["lost"]:       score = min(score, 15)
+        health = int(clamp(score, 0, 100))
+
+        # Потенциал (устойчиво к NaN/inf)
+        opp  = safe_float(r.get("OPPORTUNITY"), 0.0)
+        prob = clamp(r.get("PROBABILITY"), 0.0, 100.0)
+        if opp <= 0:
+            potential = 0
+        else:
+            try:
+                opp_boost = 30 + min(70, math.log10(max(1.0, opp)) / 5.0 * 70.0)
+            except ValueError:
+                opp_boost = 30.0
+            prob_coef = 0.4 + (prob/100.0)*0.6
+            potential = int(clamp(round(opp_boost * prob_coef), 0, 100))
+
+        rows.append({
+            "ID": int(safe_float(r.get("ID"), 0)),
+            "TITLE": r.get("TITLE",""),
+            "ASSIGNED_BY_ID": int(safe_float(r.get("ASSIGNED_BY_ID"), 0)),
+            "STAGE_ID": r.get("STAGE_ID",""),
+            "CATEGORY_ID": safe_float(r.get("CATEGORY_ID"), np.nan),
+            "OPPORTUNITY": opp,
+            "PROBABILITY": prob,
+            "DATE_CREATE": create_dt,
+            "DATE_MODIFY": to_dt(r.get("DATE_MODIFY")),
+            "LAST_ACTIVITY_TIME": last,
+            "BEGINDATE": begin_dt,
+            "CLOSEDATE": to_dt(r.get("CLOSEDATE")),
+            "SEMANTIC": (r.get("STAGE_SEMANTIC_ID") or "").upper(),
+            "days_in_work": d_work,
+            "days_no_activity": d_noact,
+            "days_on_stage": d_stage,
+            "health": health,
+            "potential": potential,
+            "flag_no_company": flags["no_company"],
+            "flag_no_contact": flags["no_contact"],
+            "flag_no_tasks": flags["no_tasks"],
+            "flag_stuck": flags["stuck"],
+            "flag_lost": flags["lost"],
+        })
+    return pd.DataFrame(rows)
+
+
+def raw_frame(n):
+    """Кадр как в дашборде: числовые колонки уже приведены pd.to_numeric."""
+    df = pd.DataFrame(make_deals(n))
+    for c in ["OPPORTUNITY","PROBABILITY","ASSIGNED_BY_ID","COMPANY_ID","CONTACT_ID","CATEGORY_ID"]:
+        df[c] = pd.to_numeric(df.get(c), errors="coerce")
+    return df
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000")
+    ap.add_argument("--check-rows", type=int, default=20000, help="сверять с построчной версией до N строк")
+    args = ap.parse_args()
+    now = pd.Timestamp("2025-01-01 12:00:00")
+    print(f"{'rows':>8} {'rowwise,s':>10} {'columnar,s':>11} {'speedup':>8}  equal")
+    for n in [int(x) for x in args.sizes.split(",")]:
+        df = raw_frame(n)
+        tasks = {i: [{}] for i in range(1, n + 1, 3)}
+        t = time.perf_counter(); new = compute_health_scores(df, tasks, stuck_days=5, now=now); t_new = time.perf_counter() - t
+        if n <= args.check_rows:
+            t = time.perf_counter(); old = compute_health_scores_rowwise(df, tasks, stuck_days=5, now=now); t_old = time.perf_counter() - t
+            pd.testing.assert_frame_equal(new, old)
+            print(f"{n:>8} {t_old:>10.2f} {t_new:>11.3f} {t_old / t_new:>7.0f}x  yes")
+        else:
+            print(f"{n:>8} {'—':>10} {t_new:>11.3f} {'—':>8}  (не сверялось)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк общего кэша загрузчиков (sharedcache.py) на синтетическом портале:
+N процессов-реплик одновременно грузят сделки, активности, пользователей и справочники —
+каждая сама (как с одним st.cache_data) против общего KVStore. Считаются HTTP-запросы
+к фейку; результаты реплик сверяются между собой. Затем — проверка ttl и nx хранилища.
+
+    python bench/bench_shared_cache.py                  # 4 реплики, 10k сделок
+    python bench/bench_shared_cache.py --replicas 8 --deals 50000
+"""
+
+import argparse, hashlib, multiprocessing as mp, os, pickle, sys, tempfile, time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import loaders, sharedcache
+from bitrix import BitrixClient
+from store import ActivityCache, KVStore
+from pipeline import deal_versions
+from bench.fake_bitrix import FakeBitrix, make_portal, serve
+
+NOW = datetime(2025, 1, 1)
+
+
+def replica(url, cache_url, barrier, out):
+    client = BitrixClient(url, rate=1e6, burst=1e6)
+    cache = sharedcache.SharedCache(sharedcache.connect(cache_url)) if cache_url else None
+    shared = lambda name, load, *args: cache.get_or_load(name, args, 300, load) if cache else load()
+    end = NOW.date() - timedelta(days=1)
+    start = end - timedelta(days=89)
+    barrier.wait()
+    t = time.perf_counter()
+    deals = shared("deals_dual", lambda: loaders.deals_dual(client, None, start, end, limit=None), start, end)
+    versions = deal_versions(deals)
+    acts = shared("activities", lambda: loaders.activities(client, ActivityCache(), versions, True), versions, True)
+    users = shared("users_full", lambda: loaders.users_full(client))
+    deps = shared("departments", lambda: loaders.departments(client))
+    cats = shared("categories", lambda: loaders.categories(client))
+    digest = hashlib.md5(pickle.dumps((deals, sorted(acts.items()), users, deps, cats))).hexdigest()
+    out.put((time.perf_counter() - t, digest, cache.stats if cache else {}))
+
+
+def run(label, fake, url, cache_url, n):
+    ctx = mp.get_context("fork")
+    barrier, out = ctx.Barrier(n), ctx.Queue()
+    http = fake.http
+    procs = [ctx.Process(target=replica, args=(url, cache_url, barrier, out)) for _ in range(n)]
+    for p in procs: p.start()
+    res = [out.get() for _ in procs]
+    for p in procs: p.join()
+    stats = {k: sum(r[2].get(k, 0) for r in res) for k in ("hits", "misses", "waits", "errors")} if cache_url else ""
+    print(f"  {label:<22} запросов к Bitrix {fake.http - http:>5}  самая долгая реплика {max(r[0] for r in res):6.2f} с  {stats}")
+    assert len({r[1] for r in res}) == 1, "реплики получили разные данные"
+    return res[0][1]
+
+
+def check_backend(kv):
+    assert kv.set("a", b"1", ex=0.2) and kv.get("a") == b"1"
+    assert not kv.set("a", b"2", ex=5, nx=True) and kv.get("a") == b"1", "nx перезаписал живой ключ"
+    time.sleep(0.25)
+    assert kv.get("a") is None, "ttl не соблюдён"
+    assert kv.set("a", b"3", ex=5, nx=True) and kv.get("a") == b"3", "nx не занял истёкший ключ"
+    assert kv.delete("a") == 1 and kv.get("a") is None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--deals", type=int, default=10000)
+    ap.add_argument("--replicas", type=int, default=4)
+    args = ap.parse_args()
+    fake = FakeBitrix(**make_portal(args.deals, now=NOW))
+    server, url = serve(fake)
+    path = os.path.join(tempfile.mkdtemp(), "shared.sqlite")
+    print(f"{args.deals} сделок, реплик {args.replicas}, период 90 дней")
+    a = run("кэш процесса", fake, url, "", args.replicas)
+    b = run("общий KVStore", fake, url, f"sqlite:///{path}", args.replicas)
+    c = run("общий, повтор", fake, url, f"sqlite:///{path}", args.replicas)
+    assert a == b == c, "общий кэш вернул не то же, что загрузчики"
+    check_backend(KVStore(path))
+    print("  данные реплик совпадают; ttl/nx хранилища в порядке")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
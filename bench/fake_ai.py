@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Заглушка chat/completions (формат Perplexity/OpenAI) для тестов AI-аналитики:
+отвечает через delay секунд, считает запросы и пиковую параллельность.
+
+    python bench/fake_ai.py --port 8780 --delay 2   # печатает PERPLEXITY_URL для secrets.toml
+"""
+
+import argparse, json, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeAI:
+    def __init__(self, delay=1.0):
+        self.delay = delay
+        self.requests = self.active = self.peak = 0
+        self._lock = threading.Lock()
+
+    def complete(self, payload):
+        with self._lock:
+            self.requests += 1; self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.delay)
+            prompt = payload["messages"][-1]["content"]
+            m = re.search(r'менеджера "([^"]*)"', prompt)
+            text = f"**{m.group(1) if m else 'Менеджер'}**: сильные стороны, зоны роста и чек-лист (заглушка)."
+            return {"model": payload.get("model"), "choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def serve(fake, port=0):
+    """Поднимает сервер в фоновом потоке; возвращает (server, url)."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a): pass
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            body = json.dumps(fake.complete(json.loads(self.rfile.read(n) or b"{}")), ensure_ascii=False).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Заглушка AI chat/completions")
+    ap.add_argument("--port", type=int, default=8780)
+    ap.add_argument("--delay", type=float, default=1.0, help="задержка ответа, сек")
+    args = ap.parse_args()
+    server, url = serve(FakeAI(args.delay), args.port)
+    print(f"PERPLEXITY_URL={url}  (любой PERPLEXITY_API_KEY)", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
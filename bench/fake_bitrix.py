@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+Синтетический портал Bitrix24 и локальный фейковый вебхук для бенчмарков
+(без реального портала).
+— Генераторы: сделки, активности, история стадий, пользователи, отделы (с PARENT),
+  воронки и стадии — согласованные между собой, в любом масштабе (1k/10k/100k сделок).
+— Методы: crm.deal.list, crm.activity.list, crm.stagehistory.list, user.get,
+  department.get, crm.dealcategory.list/stage.list, crm.category.list, crm.status.list, batch.
+— Фильтры filter[OP FIELD] (=, !, >, >=, <, <=, массивы []), select[], offset-
+  и keyset-пагинация (start=-1 + filter[>ID]).
+— Стоимость страницы моделирует MySQL портала: offset просматривает start+50 строк
+  и считает total по всей выборке, keyset — только страницу по индексу ID.
+— Лимиты: leaky bucket портала (rate запросов/сек, ёмкость burst), при переполнении —
+  HTTP 503 QUERY_LIMIT_EXCEEDED, как у Bitrix24.
+
+    python bench/fake_bitrix.py --deals 10000 --port 8765 --rate 2 --burst 50
+"""
+
+import argparse, bisect, json, random, threading, time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+PAGE_SIZE = 50
+BATCH_SIZE = 50
+PORTAL_TZ = timezone(timedelta(hours=3))
+
+CATEGORIES = {0: "Основная воронка продаж", 1: "Физ.Лица", 2: "Не приоритетные сделки"}
+STAGES = [  # (код, название, семантика); WON — своё название в основной воронке
+    ("NEW", "Новая", "P"), ("PREPARATION", "Подготовка документов", "P"), ("EXECUTING", "В работе", "P"),
+    ("WON", "Сделка успешна", "S"), ("LOSE", "Дорого", "F"), ("1", "Недозвон", "F"),
+]
+DEPARTMENTS = [  # (ID, название, PARENT)
+    (1, "БУРМАШ", None), (2, "Отдел продаж", 1), (3, "Продажи — Москва", 2),
+    (4, "Продажи — регионы", 2), (5, "Бухгалтерия", 1), (6, "Маркетинг", 1),
+]
+
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S+03:00")
+
+
+def make_deals(n, seed=1, now=datetime(2025, 1, 1), users=20):
+    """n сделок в формате crm.deal.list (все поля DEAL_FIELDS, строки, с пропусками как в Bitrix)."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(1, n + 1):
+        cat = rnd.choice([0, 0, 1, 2])
+        prefix = f"C{cat}:" if cat else ""
+        created = now - timedelta(days=rnd.randint(0, 365), minutes=rnd.randint(0, 1440))
+        modified = created + timedelta(days=rnd.randint(0, 60))
+        out.append({
+            "ID": str(i), "TITLE": f"Сделка {i}",
+            "STAGE_ID": prefix + rnd.choice(["NEW", "PREPARATION", "EXECUTING", "WON", "LOSE", "1"]),
+            "OPPORTUNITY": rnd.choice(["0.00", f"{rnd.randint(1, 2_000_000)}.00"]),
+            "ASSIGNED_BY_ID": str(rnd.randint(1, users)),
+            "COMPANY_ID": rnd.choice(["0", str(rnd.randint(1, 5000)), None]),
+            "CONTACT_ID": rnd.choice(["0", str(rnd.randint(1, 5000)), None]),
+            "PROBABILITY": rnd.choice([None, "", "10", "50", "90"]),
+            "DATE_CREATE": _iso(created), "DATE_MODIFY": _iso(modified),
+            "LAST_ACTIVITY_TIME": rnd.choice([None, _iso(modified - timedelta(hours=rnd.randint(0, 300)))]),
+            "CATEGORY_ID": str(cat),
+            "BEGINDATE": rnd.choice([None, _iso(created)]),
+            "CLOSEDATE": _iso(created + timedelta(days=rnd.randint(0, 90))),
+            "STAGE_SEMANTIC_ID": rnd.choice(["P", "S", "F"]),
+        })
+    return out
+
+
+def make_activities(deals, seed=2, per_deal=(0, 8)):
+    """Активности crm.activity.list для сделок: повторяющиеся SUBJECT с разными DEADLINE
+    (переносы), часть задач короче 15 минут, пропуски дат как в Bitrix."""
+    rnd = random.Random(seed)
+    out, aid = [], 1
+    for d in deals:
+        base = datetime.strptime(d["DATE_CREATE"][:19], "%Y-%m-%dT%H:%M:%S")
+        for _ in range(rnd.randint(*per_deal)):
+            start = base + timedelta(days=rnd.randint(0, 60), minutes=rnd.randint(0, 600))
+            end = start + timedelta(minutes=rnd.choice([5, 10, 15, 30, 60, 240]))
+            out.append({
+                "ID": str(aid), "OWNER_ID": d["ID"], "OWNER_TYPE_ID": "2",
+                "SUBJECT": rnd.choice(["Звонок", "Встреча", "Отправить КП", "Перезвонить", None]),
+                "COMPLETED": rnd.choice(["Y", "N"]),
+                "DEADLINE": rnd.choice([None, _iso(start + timedelta(days=rnd.randint(0, 5)))]),
+                "START_TIME": rnd.choice([None, _iso(start)]), "END_TIME": _iso(end),
+                "CREATED": _iso(start - timedelta(days=1)), "LAST_UPDATED": _iso(end),
+            })
+            aid += 1
+    return out
+
+
+def stage_list(cat):
+    """Стадии воронки в формате crm.dealcategory.stage.list."""
+    prefix = f"C{cat}:" if cat else ""
+    return [{"STATUS_ID": prefix + code, "NAME": "Успешно реализовано" if (code, cat) == ("WON", 0) else name,
+             "SORT": str((i + 1) * 10), "SEMANTICS": sem, "ENTITY_ID": f"DEAL_STAGE_{cat}" if cat else "DEAL_STAGE"}
+            for i, (code, name, sem) in enumerate(STAGES)]
+
+
+def make_departments():
+    return [{"ID": str(i), "NAME": name, "SORT": str(i * 100), "PARENT": str(parent) if parent else None,
+             "UF_HEAD": str(i)} for i, name, parent in DEPARTMENTS]
+
+
+def make_users(n=20, seed=4):
+    """Пользователи user.get: ~70% в отделах продаж (включая подотделы), часть уволены."""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(1, n + 1):
+        dept = rnd.choice([2, 3, 3, 4, 4]) if rnd.random() < 0.7 else rnd.choice([5, 6])
+        out.append({"ID": str(i), "NAME": f"Менеджер{i}", "LAST_NAME": rnd.choice(["Иванов", "Петрова", "Сидоров", ""]),
+                    "LOGIN": f"user{i}", "ACTIVE": "N" if rnd.random() < 0.1 else "Y", "UF_DEPARTMENT": [dept]})
+    return out
+
+
+def make_stage_history(deals, seed=3):
+    """crm.stagehistory.list: путь каждой сделки по стадиям до текущей; ID растут со временем."""
+    rnd = random.Random(seed)
+    rows = []
+    for d in deals:
+        prefix, _, code = d["STAGE_ID"].rpartition(":")
+        prefix = prefix + ":" if prefix else ""
+        path = ["NEW"] + [c for c in ("PREPARATION", "EXECUTING") if rnd.random() < 0.6]
+        if code not in path:
+            path.append(code)
+        else:
+            path = path[:path.index(code) + 1]
+        t = datetime.strptime(d["DATE_CREATE"][:19], "%Y-%m-%dT%H:%M:%S")
+        for k, c in enumerate(path):
+            rows.append((t, {"TYPE_ID": "1" if k == 0 else "2", "OWNER_ID": d["ID"], "CREATED_TIME": _iso(t),
+                             "CATEGORY_ID": d["CATEGORY_ID"], "STAGE_SEMANTIC_ID": next(s for x, _, s in STAGES if x == c),
+                             "STAGE_ID": prefix + c}))
+            t += timedelta(days=rnd.randint(0, 10), minutes=rnd.randint(1, 600))
+    rows.sort(key=lambda r: r[0])
+    return [{"ID": str(i), **r} for i, (_, r) in enumerate(rows, 1)]
+
+
+def make_portal(n_deals, seed=1, now=datetime(2025, 1, 1), users=20, per_deal=(0, 8)):
+    """Согласованный портал: {deals, activities, history, users, departments}."""
+    deals = make_deals(n_deals, seed=seed, now=now, users=users)
+    return {"deals": deals, "activities": make_activities(deals, seed=seed + 1, per_deal=per_deal),
+            "history": make_stage_history(deals, seed=seed + 2), "users": make_users(users, seed=seed + 3),
+            "departments": make_departments()}
+
+
+# ============ Сервер ============
+def _ts(value):
+    """Дата Bitrix (ISO, с поясом или без — тогда пояс портала) → секунды UTC."""
+    dt = datetime.fromisoformat(str(value))
+    return (dt if dt.tzinfo else dt.replace(tzinfo=PORTAL_TZ)).timestamp()
+
+
+def _parse_filters(q):
+    """filter[OP FIELD] / filter[OP FIELD][] → [(поле, оп, [значения])]."""
+    out = []
+    for key, vals in q.items():
+        if not key.startswith("filter["): continue
+        inner = key[7:key.index("]")]
+        op = next((o for o in (">=", "<=", "!=", ">", "<", "=", "!") if inner.startswith(o)), "=")
+        field = inner[len(op):] if inner.startswith(op) else inner
+        out.append((field, {"!=": "!"}.get(op, op), vals))
+    return out
+
+
+class _Bucket:
+    """Leaky bucket портала: счётчик запросов вытекает со скоростью rate/сек."""
+
+    def __init__(self, rate, burst):
+        self.rate, self.burst = float(rate), float(burst)
+        self.level, self.updated = 0.0, time.monotonic()
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            now = time.monotonic()
+            self.level = max(0.0, self.level - (now - self.updated) * self.rate)
+            self.updated = now
+            if self.level + 1 > self.burst:
+                return False
+            self.level += 1
+            return True
+
+
+class _Table:
+    """Строки списочного метода по возрастанию ID, индексы по полям-владельцам,
+    разобранные значения колонок (даты/числа) — лениво, один раз на поле."""
+
+    def __init__(self, rows, index=(), row_cost=1e-6):
+        self.rows = sorted(rows, key=lambda r: int(r["ID"]))
+        self.ids = [int(r["ID"]) for r in self.rows]
+        self.row_cost = row_cost
+        self.index = {f: {} for f in index}
+        for pos, r in enumerate(self.rows):
+            for f in index:
+                self.index[f].setdefault(str(r.get(f)), []).append(pos)
+        self._cols, self._matches = {}, OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, row):
+        """Добавляет или заменяет строку по ID (изменение портала для тестов событий)."""
+        rows = [r for r in self.rows if int(r["ID"]) != int(row["ID"])] + [row]
+        self.__init__(rows, tuple(self.index), self.row_cost)
+
+    def remove(self, row_id):
+        self.__init__([r for r in self.rows if int(r["ID"]) != int(row_id)], tuple(self.index), self.row_cost)
+
+    def get(self, row_id):
+        pos = bisect.bisect_left(self.ids, int(row_id))
+        return self.rows[pos] if pos < len(self.ids) and self.ids[pos] == int(row_id) else None
+
+    def _col(self, field, kind):
+        key = (field, kind)
+        if key not in self._cols:
+            conv = {"ts": _ts, "int": int, "str": str}[kind]
+            col = []
+            for r in self.rows:
+                v = r.get(field)
+                try:
+                    col.append(None if v in (None, "") else conv(v))
+                except (TypeError, ValueError):
+                    col.append(None)
+            self._cols[key] = col
+        return self._cols[key]
+
+    def _cond(self, field, op, vals):
+        kind = "ts" if ("DATE" in field or "TIME" in field) else "int" if (field == "ID" or field.endswith("_ID")) else "str"
+        conv = {"ts": _ts, "int": int, "str": str}[kind]
+        try:
+            values = {conv(v) for v in vals} if op in ("=", "!") else conv(vals[0])
+        except (TypeError, ValueError):
+            kind, values = "str", set(vals) if op in ("=", "!") else vals[0]
+        col = self._col(field, kind)
+        if op == "=":  return lambda pos: col[pos] in values
+        if op == "!":  return lambda pos: col[pos] not in values
+        cmp = {">": lambda a: a > values, ">=": lambda a: a >= values, "<": lambda a: a < values, "<=": lambda a: a <= values}[op]
+        return lambda pos: col[pos] is not None and cmp(col[pos])
+
+    def _candidates(self, conds):
+        """Позиции-кандидаты по индексу (равенство по индексированному полю) и нижней границе ID."""
+        lo = 0
+        for field, op, vals in conds:
+            if field == "ID" and op in (">", ">="):
+                lo = max(lo, bisect.bisect_right(self.ids, int(vals[0])) if op == ">" else bisect.bisect_left(self.ids, int(vals[0])))
+        for field, op, vals in conds:
+            if op == "=" and field in self.index:
+                return [p for p in sorted(p for v in vals for p in self.index[field].get(str(v), [])) if p >= lo]
+        return range(lo, len(self.rows))
+
+    def _select(self, row, select):
+        if not select or "*" in select:
+            return row
+        return {k: row.get(k) for k in ["ID"] + [f for f in select if f != "ID"]}
+
+    def list(self, q):
+        filters = _parse_filters(q)
+        conds = [self._cond(*f) for f in filters]
+        select = q.get("select[]") or q.get("select")
+        start = int(q.get("start", ["0"])[0])
+        cands = self._candidates(filters)
+        if start == -1:
+            page = []
+            for pos in cands:
+                if all(c(pos) for c in conds):
+                    page.append(self.rows[pos])
+                    if len(page) == PAGE_SIZE: break
+            time.sleep(PAGE_SIZE * self.row_cost)
+            return {"result": [self._select(r, select) for r in page]}
+        key = tuple(sorted((f, o, tuple(v)) for f, o, v in filters))
+        with self._lock:
+            matched = self._matches.get(key)
+        if matched is None:  # страницы одного обхода не пересчитывают выборку заново
+            matched = [pos for pos in cands if all(c(pos) for c in conds)]
+            with self._lock:
+                self._matches[key] = matched
+                while len(self._matches) > 32:
+                    self._matches.popitem(last=False)
+        time.sleep((len(matched) + start + PAGE_SIZE) * self.row_cost)
+        res = {"result": [self._select(self.rows[p], select) for p in matched[start:start + PAGE_SIZE]], "total": len(matched)}
+        if start + PAGE_SIZE < len(matched):
+            res["next"] = start + PAGE_SIZE
+        return res
+
+
+class FakeBitrix:
+    """Портал в памяти. rate=None — без лимитов; http — HTTP-запросы, stats — вызовы
+    по методам (включая команды batch), rejected — отказы QUERY_LIMIT_EXCEEDED."""
+
+    def __init__(self, deals, row_cost=1e-6, activities=(), history=(), users=(), departments=(),
+                 rate=None, burst=50):
+        self.deals = _Table(deals, row_cost=row_cost)
+        self.activities = _Table(activities, index=("OWNER_ID",), row_cost=row_cost)
+        self.history = _Table(history, index=("OWNER_ID",), row_cost=row_cost)
+        self.users = _Table(users)
+        self.departments = _Table(departments)
+        cats = [{"ID": str(c), "NAME": n, "SORT": str((c + 1) * 100)} for c, n in CATEGORIES.items()]
+        self.categories = _Table(cats)
+        self.bucket = _Bucket(rate, burst) if rate else None
+        self.stats, self.http, self.rejected = Counter(), 0, 0
+        self._lock = threading.Lock()
+
+    def dispatch(self, method, q):
+        with self._lock:
+            self.stats[method] += 1
+        if method == "crm.deal.list":
+            return self.deals.list(q)
+        if method == "crm.activity.list":
+            return self.activities.list(q)
+        if method == "crm.stagehistory.list":
+            res = self.history.list(q)
+            res["result"] = {"items": res["result"]}  # новый REST: список в result.items
+            return res
+        if method == "user.get":
+            return self.users.list(q)
+        if method == "department.get":
+            return self.departments.list(q)
+        if method == "crm.dealcategory.list":  # без воронки по умолчанию, как в Bitrix24
+            return self.categories.list({**q, "filter[>ID]": ["0"]})
+        if method == "crm.category.list":
+            res = self.categories.list(q)
+            res["result"] = {"categories": res["result"]}
+            return res
+        if method == "crm.dealcategory.stage.list":
+            return {"result": stage_list(int(q.get("id", ["0"])[0]))}
+        if method == "crm.status.list":
+            return {"result": stage_list(0)}
+        if method == "batch":
+            return self.batch(q)
+        return {"error": "ERROR_METHOD_NOT_FOUND", "error_description": method}
+
+    def batch(self, q):
+        cmds = {k[4:-1]: v[0] for k, v in q.items() if k.startswith("cmd[")}
+        if len(cmds) > BATCH_SIZE:
+            return {"error": "INVALID_REQUEST", "error_description": f"Max batch length exceeded ({BATCH_SIZE})"}
+        res, err, total, nxt = {}, {}, {}, {}
+        for key, cmd in cmds.items():
+            method, _, qs = cmd.partition("?")
+            data = self.dispatch(method, parse_qs(qs, keep_blank_values=True))
+            if "error" in data:
+                err[key] = data
+                continue
+            res[key] = data["result"]
+            if "total" in data: total[key] = data["total"]
+            if "next" in data: nxt[key] = data["next"]
+        # PHP отдаёт пустой ассоциативный массив как []
+        return {"result": {"result": res or [], "result_error": err or [], "result_total": total or [],
+                           "result_next": nxt or [], "result_time": []}}
+
+    def request(self, method, q):
+        """Один HTTP-запрос к вебхуку: (статус, тело). batch — один запрос к лимиту."""
+        with self._lock:
+            self.http += 1
+        if self.bucket and not self.bucket.hit():
+            with self._lock:
+                self.rejected += 1
+            return 503, {"error": "QUERY_LIMIT_EXCEEDED", "error_description": "Too many requests"}
+        return 200, self.dispatch(method, q)
+
+
+def serve(fake, port=0):
+    """Поднимает сервер в фоновом потоке; возвращает (server, webhook_url)."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a): pass
+        def do_GET(self):
+            u = urlparse(self.path)
+            q = parse_qs(u.query, keep_blank_values=True)
+            n = int(self.headers.get("Content-Length") or 0)
+            if n:
+                q.update(parse_qs(self.rfile.read(n).decode(), keep_blank_values=True))
+            status, data = fake.request(u.path.rsplit("/", 1)[-1][:-len(".json")], q)
+            body = json.dumps(data, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        do_POST = do_GET
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/rest/1/bench"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Фейковый вебхук Bitrix24 с синтетическим порталом")
+    ap.add_argument("--deals", type=int, default=1000)
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--rate", type=float, default=0, help="лимит запросов/сек (0 — без лимита; Bitrix24 — 2)")
+    ap.add_argument("--burst", type=int, default=50)
+    ap.add_argument("--row-cost", type=float, default=1e-6)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    portal = make_portal(args.deals, seed=args.seed, now=datetime.now().replace(microsecond=0), users=args.users)
+    server, url = serve(FakeBitrix(**portal, row_cost=args.row_cost, rate=args.rate or None, burst=args.burst), args.port)
+    print(f"BITRIX24_WEBHOOK={url}/  ({args.deals} сделок, {len(portal['activities'])} активностей, "
+          f"{len(portal['history'])} записей истории)", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Клиент Bitrix24 REST (входящий вебхук).
+— Один requests.Session с keep-alive пулом соединений на весь процесс.
+— Параллельная выборка страниц списочных методов (потолок параллельности max_workers).
+— Метод batch: до 50 команд в одном HTTP-запросе, с догрузкой страниц по result_next.
+— Keyset-пагинация (order[ID], filter[>ID], start=-1): без COUNT и без растущего offset.
+— Общий token bucket по правилам лимитов Bitrix24 + повторы с экспоненциальной паузой
+  на 503/429, QUERY_LIMIT_EXCEEDED и сетевых сбоях.
+"""
+
+import random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+
+PAGE_SIZE = 50   # фиксированный размер страницы списочных методов Bitrix24
+BATCH_SIZE = 50  # максимум команд в одном вызове batch
+RETRY_ERRORS = {"QUERY_LIMIT_EXCEEDED", "OPERATION_TIME_LIMIT"}
+RETRY_STATUS = {429, 503}
+
+
+class BitrixError(RuntimeError):
+    def __init__(self, method, code, description=""):
+        super().__init__(f"{method}: {description or code}")
+        self.method, self.code = method, code
+
+    @property
+    def limit(self):
+        return self.code in RETRY_ERRORS
+
+
+class RateLimiter:
+    """Token bucket по модели «leaky bucket» Bitrix24: счётчик запросов портала
+    вытекает со скоростью rate/сек, при переполнении burst портал отвечает 503.
+    Адаптивный: ответ о превышении лимита обнуляет запас и вдвое снижает rate,
+    каждый успешный запрос возвращает скорость к потолку (AIMD)."""
+
+    def __init__(self, rate=2.0, burst=50):
+        self.max_rate = max(0.1, float(rate))
+        self.rate = self.max_rate
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = 0.0
+            self.rate = max(0.1 * self.max_rate, self.rate / 2)
+
+    def reward(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 0.05 * self.max_rate)
+
+
+def _page_items(data):
+    res = data.get("result")
+    return (res.get("items", []) if isinstance(res, dict) and "items" in res else res) or []
+
+
+def _keyset_params(params, last_id):
+    p = {**(params or {}), "order[ID]": "ASC", "start": -1}
+    if last_id is not None:
+        p["filter[>ID]"] = last_id
+    return p
+
+
+def _as_dict(x):
+    # PHP отдаёт пустой ассоциативный массив как []
+    return x if isinstance(x, dict) else {}
+
+
+class BitrixClient:
+    def __init__(self, webhook, max_workers=4, timeout=30, rate=2.0, burst=50, retries=5, backoff=0.5):
+        self.base = (webhook or "").rstrip("/")
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate, burst)
+        self.retries = max(0, int(retries))
+        self.backoff = float(backoff)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self.stats = {"requests": 0, "bytes": 0, "retries": 0, "seconds": 0.0}  # с запуска процесса
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **kw):
+        with self._stats_lock:
+            for k, v in kw.items():
+                self.stats[k] += v
+
+    def counters(self):
+        """Копия счётчиков: запросы, байты ответов, повторы, суммарное время HTTP (сек)."""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def _sleep_backoff(self, attempt):
+        delay = min(30.0, self.backoff * (2 ** attempt))
+        time.sleep(delay + random.uniform(0, self.backoff))
+
+    def _request(self, method, params, timeout, post):
+        url = f"{self.base}/{method}.json"
+        self.limiter.acquire()
+        with self._slots:
+            t = time.perf_counter()
+            if post:
+                r = self.session.post(url, data=(params or {}), timeout=timeout or self.timeout)
+            else:
+                r = self.session.get(url, params=(params or {}), timeout=timeout or self.timeout)
+            self._count(requests=1, bytes=len(r.content), seconds=time.perf_counter() - t)
+        try:
+            data = r.json()
+        except ValueError:
+            data = {}
+        if "error" in data:
+            raise BitrixError(method, data.get("error"), data.get("error_description"))
+        if r.status_code in RETRY_STATUS:
+            raise BitrixError(method, "QUERY_LIMIT_EXCEEDED", f"HTTP {r.status_code}")
+        r.raise_for_status()
+        return data
+
+    def call(self, method, params=None, timeout=None, post=False):
+        """Один REST-вызов через общий лимитер; лимитные и сетевые сбои повторяются
+        с экспоненциальной паузой, после retries попыток ошибка пробрасывается."""
+        for attempt in range(self.retries + 1):
+            try:
+                data = self._request(method, params, timeout, post)
+            except BitrixError as e:
+                if not e.limit or attempt == self.retries:
+                    raise
+                self.limiter.penalize()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            else:
+                self.limiter.reward()
+                return data
+            self._count(retries=1)
+            self._sleep_backoff(attempt)
+
+    def map(self, fn, items):
+        """Параллельный map с потолком max_workers; порядок результатов = порядок items."""
+        items = list(items)
+        if len(items) <= 1 or self.max_workers == 1:
+            return [fn(x) for x in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items)), thread_name_prefix="bx") as ex:
+            return list(ex.map(fn, items))
+
+    def get_all(self, method, params=None, keyset=False, limit=None):
+        """Все страницы списочного метода: первая страница даёт total,
+        остальные offset'ы запрашиваются параллельно. keyset=True — курсор по ID.
+        limit — не запрашивать страницы сверх первых limit строк."""
+        if keyset:
+            return self.get_all_keyset(method, params, limit=limit)
+        params = dict(params or {})
+        first = self.call(method, {**params, "start": 0})
+        out = list(_page_items(first))
+        if not out or "next" not in first or (limit and len(out) >= limit):
+            return out[:limit] if limit else out
+        total = first.get("total")
+        if total is None:
+            start = first["next"]
+            while not limit or len(out) < limit:
+                data = self.call(method, {**params, "start": start})
+                batch = _page_items(data)
+                if not batch: break
+                out.extend(batch)
+                if "next" not in data: break
+                start = data["next"]
+            return out[:limit] if limit else out
+        stop = min(int(total), int(limit)) if limit else int(total)
+        starts = range(int(first["next"]), stop, PAGE_SIZE)
+        for batch in self.map(lambda s: _page_items(self.call(method, {**params, "start": s})), starts):
+            out.extend(batch)
+        return out[:limit] if limit else out
+
+    def get_all_keyset(self, method, params=None, limit=None, after_id=None):
+        """Последовательный обход по ID: каждая страница — filter[>ID]=последний ID,
+        start=-1 отключает подсчёт total, поэтому время страницы не растёт с объёмом.
+        Порядок — по возрастанию ID; при limit обход останавливается на первых limit строках,
+        after_id — продолжить с известного курсора."""
+        out, last_id = [], after_id
+        while True:
+            batch = _page_items(self.call(method, _keyset_params(params, last_id)))
+            out.extend(batch)
+            if limit and len(out) >= limit:
+                return out[:limit]
+            if len(batch) < PAGE_SIZE:
+                return out
+            last_id = int(batch[-1]["ID"])
+
+    def batch(self, commands):
+        """Один вызов batch для ≤BATCH_SIZE команд {key: (method, params)}.
+        Возвращает (results, errors, nexts) — словари по ключам команд."""
+        params = {"halt": 0}
+        for key, (method, p) in commands.items():
+            params[f"cmd[{key}]"] = f"{method}?{urlencode(p, doseq=True)}" if p else method
+        res = _as_dict(self.call("batch", params, post=True).get("result"))
+        return _as_dict(res.get("result")), _as_dict(res.get("result_error")), _as_dict(res.get("result_next"))
+
+    def batch_get_all(self, commands, keyset=False):
+        """Все страницы набора списочных команд {key: (method, params)} через batch.
+        Команды пакуются по BATCH_SIZE, пачки идут параллельно; продолжения (result_next,
+        либо последний ID при keyset=True) собираются в следующие пачки.
+        Команды с лимитной ошибкой повторяются (до retries раз, затем BitrixError),
+        команды с прочими ошибками в результат не попадают."""
+        out = {key: [] for key in commands}
+        failed, tries = set(), {}
+        pending = {key: None if keyset else 0 for key in commands}
+        def _params(key):
+            if keyset:
+                return _keyset_params(commands[key][1], pending[key])
+            return {**(commands[key][1] or {}), "start": pending[key]}
+        while pending:
+            keys = list(pending)
+            chunks = [keys[i:i + BATCH_SIZE] for i in range(0, len(keys), BATCH_SIZE)]
+            nxt, retry = {}, False
+            for results, errors, nexts in self.map(lambda chunk: self.batch({k: (commands[k][0], _params(k)) for k in chunk}), chunks):
+                for key, value in results.items():
+                    if key not in out: continue
+                    batch = _page_items({"result": value})
+                    out[key].extend(batch)
+                    if keyset and len(batch) == PAGE_SIZE and key not in errors:
+                        nxt[key] = int(batch[-1]["ID"])
+                for key, err in errors.items():
+                    code = _as_dict(err).get("error")
+                    if code not in RETRY_ERRORS:
+                        failed.add(key)
+                        continue
+                    tries[key] = tries.get(key, 0) + 1
+                    if tries[key] > self.retries:
+                        raise BitrixError(commands[key][0], code, _as_dict(err).get("error_description"))
+                    nxt[key], retry = pending[key], True
+                if not keyset:
+                    for key, n in nexts.items():
+                        if key not in errors:
+                            nxt[key] = int(n)
+            if retry:
+                self._count(retries=1)
+                self.limiter.penalize()
+                self._sleep_backoff(max(tries.values()) - 1)
+            pending = nxt
+        return {key: items for key, items in out.items() if key not in failed}
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Предагрегированный куб показателей сделок — без Streamlit.
+Разделы «Обзор», «Проблемы», «По менеджерам» и «Градация» — счётчики, суммы и средние
+сделок по менеджеру, воронке, стадии, группе провала и дню. Куб собирается по кадру
+сделок один раз на обновление данных: факт на каждую дату периода (создание, закрытие,
+изменение) — ячейки день × ответственный × измерения, меры — число сделок n и суммы
+(среднее = сумма / n).
+
+Запрос не группирует кадр заново: срез периода — searchsorted по дню, отделы — фильтр
+ячеек по ответственному, итог — np.bincount по номерам групп, посчитанным для куба один
+раз на набор измерений. CubeView отдаёт те же таблицы, что разделы прежде считали
+группировками df_created/df_closed/df_mod.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+
+from scoring import failure_group
+
+HEALTH_BINS = list(range(0, 105, 5))
+GRADES = ["quick", "work", "drop"]
+FLAGS = ["flag_no_tasks", "flag_no_company", "flag_no_contact", "flag_stuck"]
+FLOAT_MEASURES = {"OPPORTUNITY", "health"}  # суммы во float64, как sum/mean по строкам; остальные — int64
+
+# факт → (колонка даты, измерения, меры); ASSIGNED_BY_ID — в каждом факте (фильтр отделов)
+FACTS = {
+    "created":  ("DATE_CREATE", ["cat_norm", "STAGE_ID", "stage_name", "stage_sort", "is_fail"], []),
+    "closed":   ("CLOSEDATE", ["manager", "cat_norm", "is_success"], ["OPPORTUNITY"]),
+    "modified": ("DATE_MODIFY", ["manager", "category", "cat_norm", "stage_name", "stage_sort", "fail_group",
+                                 "fail_from_stage_hist", "is_fail", "grade"], ["OPPORTUNITY", "health", *FLAGS]),
+    "health":   ("DATE_MODIFY", ["health_bin"], []),
+}
+
+
+def grade(df):
+    """Градация сделки: drop — провал, quick — вероятность ≥ 50 и здоровье ≥ 60, иначе work."""
+    quick = (df["PROBABILITY"] >= 50) & (df["health"] >= 60)
+    return pd.Categorical(np.where(df["is_fail"], "drop", np.where(quick, "quick", "work")), categories=GRADES)
+
+def _fact(df, date_col, dims, measures):
+    """Ячейки день × ASSIGNED_BY_ID × dims с мерами n (сделок) и суммами measures, по возрастанию дня.
+    Пустые значения измерений — свои ячейки (dropna=False): срез не теряет сделок."""
+    day = df[date_col].to_numpy().astype("datetime64[D]")
+    keep = ~np.isnat(day)
+    src = df.loc[keep, ["ASSIGNED_BY_ID", *dims]].assign(day=day[keep], n=1)
+    for m in measures:  # узкие целые и bool суммируются в int64, деньги — во float64
+        src[m] = df.loc[keep, m].astype("float64" if m == "OPPORTUNITY" else "int64")
+    return (src.groupby(["day", "ASSIGNED_BY_ID", *dims], observed=True, dropna=False, sort=True)[["n", *measures]]
+            .sum().reset_index())
+
+
+class DealCube:
+    """Куб по кадру сделок (df_all после скоринга). Только читается — общий для сессий."""
+
+    def __init__(self, df):
+        self.rows = len(df)
+        df = df.assign(grade=grade(df), health_bin=pd.cut(df["health"], bins=HEALTH_BINS, right=False))
+        self.cells = {name: _fact(df, *spec) for name, spec in FACTS.items()}
+        fails = self.cells["modified"]  # колонки таблицы провалов — как в разделе «Обзор»
+        fails["Причина"] = fails["stage_name"]
+        fails["Этап (из истории)"] = fails["fail_from_stage_hist"]
+        fails["Группа"] = fails["Причина"].map(failure_group)
+        self.days = {name: c["day"].to_numpy() for name, c in self.cells.items()}
+        self.assigned = {name: c["ASSIGNED_BY_ID"].to_numpy() for name, c in self.cells.items()}
+        self._groups, self._masks, self._lock = {}, {}, threading.Lock()
+
+    @property
+    def size(self):
+        return sum(len(c) for c in self.cells.values())
+
+    def group(self, fact, by):
+        """(ключи групп, номер группы ячейки) — как groupby(by, observed=True) по всем ячейкам факта;
+        ячейки с пустым ключом — -1. Считается один раз на факт и набор измерений."""
+        key = (fact, by)
+        if key not in self._groups:
+            g = self.cells[fact].groupby(list(by), observed=True, sort=True)
+            keys = g.size().reset_index()[list(by)]
+            with self._lock:
+                self._groups[key] = (keys, g.ngroup().fillna(-1).astype("int64").to_numpy())
+        return self._groups[key]
+
+    def mask(self, fact, where):
+        """Ячейки факта по условиям ((колонка, значение | кортеж значений), ...)."""
+        key = (fact, where)
+        if key not in self._masks:
+            cells, m = self.cells[fact], np.ones(len(self.cells[fact]), dtype=bool)
+            for col, value in where:
+                m &= cells[col].isin(value).to_numpy() if isinstance(value, tuple) else (cells[col] == value).to_numpy()
+            with self._lock:
+                self._masks[key] = m
+        return self._masks[key]
+
+    def view(self, start, end, assigned=None):
+        """Срез ячеек с днём в [start, end] (оба дня целиком) и ответственными из assigned."""
+        lo = np.datetime64(pd.Timestamp(start).date(), "D")
+        hi = np.datetime64(pd.Timestamp(end).date(), "D") + 1
+        pos = {}
+        for name, days in self.days.items():
+            p = np.arange(days.searchsorted(lo, "left"), days.searchsorted(hi, "left"))
+            if assigned is not None:
+                p = p[np.isin(self.assigned[name][p], np.asarray(assigned, dtype=self.assigned[name].dtype))]
+            pos[name] = p
+        return CubeView(self, pos)
+
+
+def _bincount(code, weights, k, measure):
+    """Сумма меры по номерам групп. Тип — по мере, а не по срезу: np.bincount пустого
+    среза даёт int64 даже с весами float."""
+    v = np.bincount(code, weights=weights, minlength=k)
+    return v.astype("float64") if measure in FLOAT_MEASURES else v.round().astype("int64")
+
+
+class CubeView:
+    """Срез куба: таблицы разделов. Факты created/closed/modified — ячейки по дате создания,
+    закрытия и изменения (как df_created/df_closed/df_mod), health — гистограмма здоровья."""
+
+    def __init__(self, cube, pos):
+        self.cube, self.pos = cube, pos
+
+    def empty(self, fact):
+        return not len(self.pos[fact])
+
+    def _pos(self, fact, where):
+        pos = self.pos[fact]
+        return pos[self.cube.mask(fact, where)[pos]] if where else pos
+
+    def total(self, fact, measure="n", where=()):
+        return self.cube.cells[fact][measure].to_numpy()[self._pos(fact, where)].sum()
+
+    def rollup(self, fact, by, measures=("n",), where=(), names=None):
+        """Как groupby(by, observed=True)[measures].sum().reset_index() по ячейкам среза;
+        names — новые имена колонок мер."""
+        keys, code = self.cube.group(fact, by)
+        pos = self._pos(fact, where)
+        c = code[pos]
+        pos, c = pos[c >= 0], c[c >= 0]
+        cells, names = self.cube.cells[fact], names or {}
+        n = np.bincount(c, minlength=len(keys))  # ячеек в группе: группа есть в срезе, если > 0
+        out = keys[n > 0].reset_index(drop=True)
+        for m in measures:
+            out[names.get(m, m)] = _bincount(c, cells[m].to_numpy()[pos], len(keys), m)[n > 0]
+        if names:  # заголовки — как после rename
+            out.columns = pd.Index(list(out.columns))
+        return out
+
+    def by_category(self, fact, col, measures=("n",), where=()):
+        """Суммы мер по всем категориям колонки col (в порядке категорий, пустые — 0)."""
+        cells = self.cube.cells[fact]
+        pos = self._pos(fact, where)
+        code = cells[col].cat.codes.to_numpy()[pos]
+        pos, code = pos[code >= 0], code[code >= 0]
+        k = len(cells[col].cat.categories)
+        return [_bincount(code, cells[m].to_numpy()[pos], k, m) for m in measures]
+
+    # ---- Обзор ----
+    def health_dist(self):
+        if self.empty("health"):
+            return pd.DataFrame(columns=["Диапазон","Кол-во"])
+        hist, = self.by_category("health", "health_bin")
+        return pd.DataFrame({"Диапазон": self.cube.cells["health"]["health_bin"].cat.categories.astype(str), "Кол-во": hist})
+
+    def funnel(self, cat):
+        return (self.rollup("created", ("STAGE_ID","stage_name","stage_sort"), where=(("cat_norm", cat), ("is_fail", False)),
+                             names={"n":"Количество"}).sort_values("stage_sort"))
+
+    def fails_by_reason(self):
+        if not self.total("modified", where=(("is_fail", True),)):
+            return pd.DataFrame(columns=["category","Группа","Причина","Этап (из истории)","Количество"])
+        return self.rollup("modified", ("category","Группа","Причина","Этап (из истории)"), where=(("is_fail", True),),
+                           names={"n":"Количество"})
+
+    # ---- Проблемы ----
+    def problems(self):
+        """{колонка флага: число сделок}, is_fail — проигранные."""
+        out = {c: int(self.total("modified", c)) for c in FLAGS}
+        out["is_fail"] = int(self.total("modified", where=(("is_fail", True),)))
+        return out
+
+    # ---- По менеджерам ----
+    def managers(self, cats):
+        """Таблица менеджеров: строки — менеджеры с изменёнными в период сделками. Как прежний
+        merge по менеджеру: у «Выиграно»/«Проиграно» тип float, если хоть у кого-то их нет."""
+        n, health = self.by_category("modified", "manager", ("n", "health"))
+        won, won_sum = self.by_category("closed", "manager", ("n", "OPPORTUNITY"),
+                                        where=(("is_success", True), ("cat_norm", tuple(cats))))
+        lost, = self.by_category("modified", "manager", where=(("is_fail", True),))
+        ix = np.flatnonzero(n)
+        filled = lambda v: v.astype("float64") if (v == 0).any() else v
+        mgr = pd.DataFrame({"manager": pd.Categorical.from_codes(ix, dtype=self.cube.cells["modified"]["manager"].dtype),
+                            "Сделок": n[ix], "СрЗдоровье": health[ix] / n[ix], "Выиграно": filled(won[ix]),
+                            "Выручка, ₽": won_sum[ix], "Проиграно": filled(lost[ix])})
+        mgr["Конверсия в победу, %"] = (mgr["Выиграно"]/mgr["Сделок"]*100).round(1).replace([np.inf,np.nan],0)
+        mgr["СрЗдоровье"] = mgr["СрЗдоровье"].round(1)
+        return mgr
+
+    def stage_counts(self, cat):
+        stages = self.rollup("modified", ("stage_name","stage_sort"), where=(("cat_norm", cat), ("is_fail", False)),
+                             names={"n":"Кол-во"}).sort_values("stage_sort")
+        total = stages["Кол-во"].sum() or 1
+        stages["Доля, %"] = (stages["Кол-во"]/total*100).round(1)
+        return stages
+
+    def fails_by_stage(self, cat, by_history):
+        """Провалы воронки: по этапу из истории стадий или по группе и причине."""
+        where = (("cat_norm", cat), ("is_fail", True))
+        if by_history:
+            return (self.rollup("modified", ("fail_from_stage_hist",), where=where, names={"n":"Кол-во"})
+                    .rename(columns={"fail_from_stage_hist":"Этап (из истории)"}).sort_values("Кол-во", ascending=False))
+        return self.rollup("modified", ("fail_group","stage_name"), where=where, names={"n":"Кол-во"})
+
+    # ---- Градация ----
+    def grades(self):
+        """{quick|work|drop: (сделок, сумма)}."""
+        n, opp = self.by_category("modified", "grade", ("n", "OPPORTUNITY"))
+        return {k: (int(n[i]), opp[i]) for i, k in enumerate(GRADES)}
@@ -9,12 +9,21 @@
 — Без выгрузок/файлов. Авторизация: admin / admin123.
 """
 
-import os, time, math, calendar
+import os, calendar, hashlib, json
 from datetime import datetime, timedelta, date
 import numpy as np
 import pandas as pd
 import streamlit as st
-import requests
+
+import ai, loaders, metrics, sharedcache, snapshot
+from bitrix import BitrixClient
+from store import ActivityCache, AnswerCache, DealStore, HistoryStore, RevenueStore
+from scoring import CAT_MAIN, CAT_PHYS, CAT_LOW, SUCCESS_NAME_BY_CAT, apply_stuck_days
+from pipeline import (deals_frame, deal_versions, raw_version, history_frame, build_deals_frame,
+                      revenue_frame, revenue_rows, revenue_months)
+from periods import DateIndex, MONTH_END, ts_batch
+from org import OrgIndex
+from cube import DealCube
 
 try:
     import plotly.express as px
@@ -51,6 +60,7 @@ st.markdown(THEME_CSS, unsafe_allow_html=True)
 
 # ============ AUTH ============
 AUTH_KEY = "burmash_auth_ok"
+USER_KEY = "burmash_user"  # логин вошедшего: админ-панель замеров
 def require_auth():
     if AUTH_KEY not in st.session_state:
         st.session_state[AUTH_KEY] = False
@@ -63,6 +73,7 @@ def require_auth():
         ok = st.form_submit_button("Войти")
     if ok:
         st.session_state[AUTH_KEY] = (login == "admin" and password == "admin123")
+        st.session_state[USER_KEY] = login if st.session_state[AUTH_KEY] else None
         if not st.session_state[AUTH_KEY]:
             st.error("Неверный логин или пароль")
         st.rerun()
@@ -71,6 +82,7 @@ require_auth()
 with st.sidebar:
     if st.button("Выйти", key="logout_btn"):
         st.session_state[AUTH_KEY] = False
+        st.session_state[USER_KEY] = None
         st.rerun()
 
 # ============ Secrets ============
@@ -79,182 +91,165 @@ def get_secret(name, default=None):
     return os.getenv(name, default)
 BITRIX24_WEBHOOK   = (get_secret("BITRIX24_WEBHOOK", "") or "").strip()
 PERPLEXITY_API_KEY = (get_secret("PERPLEXITY_API_KEY", "") or "").strip()
+PERPLEXITY_URL     = (get_secret("PERPLEXITY_URL", "") or "").strip() or ai.PERPLEXITY_URL  # тесты: bench/fake_ai.py
+AI_MAX_WORKERS     = int(get_secret("AI_MAX_WORKERS", 4) or 4)    # параллельных запросов к AI
+AI_TTL             = int(get_secret("AI_TTL", 86400) or 86400)    # сек. свежести ответа AI на ту же сводку
+
+BITRIX24_MAX_WORKERS = int(get_secret("BITRIX24_MAX_WORKERS", 4) or 4)
+BITRIX24_RATE        = float(get_secret("BITRIX24_RATE", 2) or 2)     # запросов/сек (тариф Enterprise — 5)
+BITRIX24_BURST       = int(get_secret("BITRIX24_BURST", 50) or 50)    # ёмкость «ведра» (Enterprise — 250)
+DEAL_STORE_PATH      = (get_secret("DEAL_STORE_PATH", ".cache/deals.sqlite") or "").strip()  # "" — без локальной базы
+ACTIVITY_TTL         = int(get_secret("ACTIVITY_TTL", 3600) or 3600)  # сек. свежести активностей одной сделки
+SNAPSHOT_DIR         = (get_secret("SNAPSHOT_DIR", "") or "").strip()  # снимки precompute.py; "" — всегда из Bitrix
+SHARED_CACHE_URL     = (get_secret("SHARED_CACHE_URL", "") or "").strip()  # sqlite:///… или redis://…; "" — кэш процесса
+ADMIN_USERS          = {u.strip() for u in str(get_secret("ADMIN_USERS", "admin") or "").split(",") if u.strip()}
+METRICS_PORT         = int(get_secret("METRICS_PORT", 0) or 0)  # /metrics для Prometheus; 0 — только панель
 
 # ============ Bitrix helpers ============
-def _bx_call(method, params=None, timeout=30):
-    url = BITRIX24_WEBHOOK.rstrip("/") + f"/{method}.json"
-    r = requests.get(url, params=(params or {}), timeout=timeout)
-    r.raise_for_status()
-    data = r.json()
-    if "error" in data:
-        raise RuntimeError(f"{method}: {data.get('error_description') or data.get('error')}")
-    return data
-
-def _bx_get(method, params=None, pause=0.35):
-    out, start = [], 0
-    params = dict(params or {})
-    while True:
-        params["start"] = start
-        data = _bx_call(method, params=params)
-        res = data.get("result")
-        batch = (res.get("items", []) if isinstance(res, dict) and "items" in res else res) or []
-        if not batch: break
-        out.extend(batch)
-        if len(batch) < 50 and "next" not in data: break
-        start = data.get("next", start + 50)
-        time.sleep(pause)
-    return out
-
-@st.cache_data(ttl=300)
-def bx_get_deals_by_date(field_from, field_to, limit=3000):
-    params = {"select[]":[
-        "ID","TITLE","STAGE_ID","OPPORTUNITY","ASSIGNED_BY_ID","COMPANY_ID","CONTACT_ID",
-        "PROBABILITY","DATE_CREATE","DATE_MODIFY","LAST_ACTIVITY_TIME","CATEGORY_ID",
-        "BEGINDATE","CLOSEDATE","STAGE_SEMANTIC_ID"
-    ]}
-    if field_from: params[f"filter[>={field_from[0]}]"] = str(field_from[1])
-    if field_to:   params[f"filter[<={field_to[0]}]"]  = str(field_to[1])
-    deals = _bx_get("crm.deal.list", params)
-    return deals[:limit]
+@st.cache_resource
+def bx_client():
+    """Один клиент (keep-alive пул + потолок параллельности) на процесс, общий для всех сессий."""
+    return BitrixClient(BITRIX24_WEBHOOK, max_workers=BITRIX24_MAX_WORKERS, rate=BITRIX24_RATE, burst=BITRIX24_BURST)
+
+@st.cache_resource
+def deal_store():
+    return DealStore(DEAL_STORE_PATH) if DEAL_STORE_PATH else None
+
+@st.cache_resource
+def activity_cache():
+    return ActivityCache(DEAL_STORE_PATH or ":memory:", ttl=ACTIVITY_TTL)
+
+@st.cache_resource
+def history_store():
+    return HistoryStore(DEAL_STORE_PATH or ":memory:")
+
+@st.cache_resource
+def revenue_store():
+    return RevenueStore(DEAL_STORE_PATH) if DEAL_STORE_PATH else None
+
+@st.cache_resource(max_entries=2)
+def load_snapshot(version):
+    """Снимок читается с диска один раз на версию и общий для всех сессий (только чтение)."""
+    return snapshot.read(SNAPSHOT_DIR, version)
+
+@st.cache_resource(max_entries=2)
+def snapshot_org_index(version):
+    meta = load_snapshot(version)[1]
+    return OrgIndex(meta["departments"], meta["users_full"])
+
+@st.cache_resource(max_entries=2)
+def snapshot_revenue(version):
+    """Выручка по месяцам × воронкам × менеджерам за всё окно снимка."""
+    return revenue_months(revenue_rows(load_snapshot(version)[0]))
+
+@st.cache_resource
+def ai_client():
+    return ai.AIClient(PERPLEXITY_API_KEY, url=PERPLEXITY_URL, max_workers=AI_MAX_WORKERS)
+
+@st.cache_resource
+def ai_cache():
+    """Ответы AI — в той же локальной базе (переживают перезапуск) или в памяти процесса."""
+    return AnswerCache(DEAL_STORE_PATH or ":memory:", ttl=AI_TTL)
+
+@st.cache_resource
+def shared_cache():
+    backend = sharedcache.connect(SHARED_CACHE_URL)
+    if backend is None:
+        return None
+    portal = hashlib.md5(BITRIX24_WEBHOOK.encode()).hexdigest()[:8]  # несколько порталов в одном Redis
+    return sharedcache.SharedCache(backend, prefix=f"burmash:{portal}:")
+
+def shared(name, ttl, load, *args):
+    """Второй уровень под st.cache_data: общий для реплик кэш (SHARED_CACHE_URL) с тем же ttl."""
+    cache = shared_cache()
+    if not cache:
+        metrics.mark("miss")
+        return load()
+    loaded = []
+    value = cache.get_or_load(name, args, ttl, lambda: loaded.append(1) or load())
+    metrics.mark("miss" if loaded else "shared")
+    return value
+
+@st.cache_resource
+def metrics_registry():
+    """Итоги замеров процесса; при METRICS_PORT — ещё и /metrics для Prometheus."""
+    registry = metrics.Registry()
+    if METRICS_PORT:
+        try:
+            metrics.serve(registry, METRICS_PORT)
+        except OSError:  # порт занят другой репликой на этой машине
+            pass
+    return registry
 
 @st.cache_data(ttl=300)
-def bx_get_deals_dual(start, end, limit=3000):
-    created = bx_get_deals_by_date(("DATE_CREATE", start), ("DATE_CREATE", end), limit=limit)
-    closed  = bx_get_deals_by_date(("CLOSEDATE",  start), ("CLOSEDATE",  end), limit=limit)
-    by_id = {}
-    for r in created + closed:
-        by_id[int(r["ID"])] = r
-    out = [by_id[k] for k in sorted(by_id.keys())][:limit]
-    return out
+def bx_get_deals_dual(start, end, limit=3000, assigned=None, rev=None):
+    """assigned — кортеж ASSIGNED_BY_ID выбранных отделов (часть ключа кэша) или None.
+    rev — DealStore.revision(): события Bitrix (events.py) меняют её, и кэш сбрасывается сразу."""
+    return shared("deals_dual", 300, lambda: loaders.deals_dual(bx_client(), deal_store(), start, end, limit=limit, assigned=assigned),
+                  start, end, limit, assigned, rev)
 
 @st.cache_data(ttl=600)
 def bx_get_categories():
-    try:
-        cats = _bx_get("crm.dealcategory.list")
-        return {int(c["ID"]): c.get("NAME","Воронка") for c in cats}
-    except Exception:
-        try:
-            cats = _bx_get("crm.category.list")
-            return {int(c["ID"]): c.get("NAME","Воронка") for c in cats}
-        except Exception:
-            return {}
+    return shared("categories", 600, lambda: loaders.categories(bx_client()))
 
 @st.cache_data(ttl=600)
 def bx_get_stage_map_by_category(category_ids):
-    sort_map, name_map = {}, {}
-    if not category_ids:
-        return sort_map, name_map
-    for cid in sorted(set(int(x) for x in category_ids if pd.notna(x))):
-        try:
-            stages = _bx_get("crm.dealcategory.stage.list", {"id": cid})
-            for s in stages:
-                sid = s.get("STATUS_ID") or s.get("ID")
-                if not sid: continue
-                sort_map[sid] = int(s.get("SORT", 5000))
-                name_map[sid] = s.get("NAME") or sid
-        except Exception:
-            continue
-    if not name_map:
-        try:
-            base = _bx_get("crm.status.list", {"filter[ENTITY_ID]":"DEAL_STAGE"})
-            for s in base:
-                sid = s.get("STATUS_ID")
-                if not sid: continue
-                sort_map[sid] = int(s.get("SORT", 5000))
-                name_map[sid] = s.get("NAME") or sid
-        except Exception:
-            pass
-    return sort_map, name_map
+    return shared("stage_map", 600, lambda: loaders.stage_map_by_category(bx_client(), category_ids), category_ids)
 
 @st.cache_data(ttl=300)
 def bx_get_departments():
-    try:
-        return _bx_get("department.get", {})
-    except:
-        return []
+    return shared("departments", 300, lambda: loaders.departments(bx_client()))
 
 @st.cache_data(ttl=300)
 def bx_get_users_full():
-    users = _bx_get("user.get", {})
-    out = {}
-    for u in users:
-        depts = u.get("UF_DEPARTMENT") or []
-        if isinstance(depts, str):
-            depts = [int(x) for x in depts.split(",") if x]
-        out[int(u["ID"])] = {
-            "name": ((u.get("NAME","")+" "+u.get("LAST_NAME","")).strip() or u.get("LOGIN","")).strip(),
-            "depts": list(map(int, depts)) if depts else [],
-            "active": (u.get("ACTIVE","Y")=="Y")
-        }
-    return out
+    return shared("users_full", 300, lambda: loaders.users_full(bx_client()))
+
+@st.cache_data(ttl=300)
+def bx_get_org_index():
+    """Отдел → сотрудники отдела и подотделов; строится раз на обновление справочников."""
+    return OrgIndex(bx_get_departments(), bx_get_users_full())
 
 @st.cache_data(ttl=600)
-def bx_get_activities(deal_ids, include_completed=True):
-    out = {}
-    if not deal_ids: return out
-    states = ["N","Y"] if include_completed else ["N"]
-    for state in states:
-        for chunk in np.array_split(list(map(int, deal_ids)), max(1, len(deal_ids)//40 + 1)):
-            params = {
-                "filter[OWNER_TYPE_ID]":2, "filter[OWNER_ID]":",".join(map(str,chunk)),
-                "filter[COMPLETED]": state
-            }
-            try:
-                acts = _bx_get("crm.activity.list", params)
-            except Exception:
-                acts = []
-            for a in acts:
-                out.setdefault(int(a["OWNER_ID"]), []).append(a)
-    return out
+def bx_get_activities(deal_versions, include_completed=True, rev=None):
+    """deal_versions: {ID: версия сделки}. Активности кэшируются по каждой сделке отдельно,
+    в Bitrix уходят только новые, изменённые или устаревшие (ACTIVITY_TTL) сделки."""
+    return shared("activities", 600, lambda: loaders.activities(bx_client(), activity_cache(), deal_versions, include_completed),
+                  deal_versions, include_completed, rev)
 
 @st.cache_data(ttl=300)
-def bx_get_stage_history_lite(deal_ids, max_deals=300):
-    if not deal_ids: return {}
-    hist = {}
-    ids = list(map(int, deal_ids))[:max_deals]
-    try:
-        for did in ids:
-            items = _bx_get("crm.stagehistory.deal.list", {"filter[OWNER_ID]": did})
-            if items:
-                hist[did] = items
-    except Exception:
-        pass
-    try:
-        remain = [i for i in ids if i not in hist]
-        for did in remain:
-            items = _bx_get("crm.stagehistory.list", {"filter[OWNER_TYPE_ID]":2, "filter[OWNER_ID]": did})
-            if items:
-                hist[did] = items
-    except Exception:
-        pass
-    return hist
-
-# ============ Константы ============
-CAT_MAIN   = "основная воронка продаж"
-CAT_PHYS   = "физ.лица"
-CAT_LOW    = "не приоритетные сделки"
-SUCCESS_NAME_BY_CAT = {
-    CAT_MAIN: "Успешно реализовано",
-    CAT_PHYS: "Сделка успешна",
-    CAT_LOW:  "Сделка успешна",
-}
-FAIL_GROUP1 = {
-    "Недозвон","Не абонент","СПАМ","Нецелевой","Дорого","Организация не действует","Был конфликт",
-    "Не одобрили отсрочку платежа","Не устроили сроки","Сделка отменена клиентом","Удалено из неразобр. Авито"
-}
-FAIL_GROUP2 = {
-    "Выбрали конкурентов","Дорого","Был конфликт","Не одобрили отсрочку платежа","Не устроили сроки","Сделка отменена клиентом"
-}
+def bx_get_stage_history(deal_ids, since):
+    return shared("stage_history", 300, lambda: loaders.stage_history(bx_client(), history_store(), deal_ids, since),
+                  deal_ids, since)
 
-# ============ Даты/периоды ============
-def to_dt(x):
-    try:
-        ts = pd.to_datetime(x, utc=True, errors="coerce")
-        if pd.isna(ts): return pd.NaT
-        return ts.tz_convert(None)
-    except:
-        return pd.NaT
+@st.cache_data(ttl=300)
+def store_revenue(year, rev):
+    """Выручка года по месяцам × воронкам × менеджерам из локальной базы: разбираются только
+    сделки, изменённые после прошлого разбора. rev — DealStore.revision() (ключ кэша)."""
+    categories = bx_get_categories()
+    cat_ids = [cid for cid, name in categories.items() if str(name or "").strip().casefold() in SUCCESS_NAME_BY_CAT]
+    _, name_map = bx_get_stage_map_by_category(cat_ids)
+    rules = json.dumps([categories, name_map], sort_keys=True, ensure_ascii=False)
+    deal_store().sync(bx_client())  # в режиме снимка база сама не синхронизируется
+    revenue_store().refresh(lambda deals: revenue_rows(revenue_frame(deals, categories, name_map)), rules)
+    return revenue_store().months(year)
+
+# ============ Производный кадр ============
+STUCK_DAYS_BASE = 5  # порог базового кадра в кэше; другой порог — apply_stuck_days по нему
+
+@st.cache_data(ttl=600, max_entries=8)
+def scored_base(version, _df_raw, _activities, _users_map, _categories, _sort_map, _name_map, _history_raw):
+    """Скоринг, стадии, античит, этап провала — один раз на версию исходных данных (raw_version),
+    а не на каждое действие пользователя. Аргументы с «_» не хэшируются: их покрывает version."""
+    return build_deals_frame(_df_raw, _activities, _users_map, _categories, _sort_map, _name_map,
+                             history=history_frame(_history_raw), stuck_days=STUCK_DAYS_BASE)
+
+@st.cache_resource(max_entries=8)
+def deals_cube(key, _frame):
+    """Куб показателей разделов — один раз на данные периода (key), общий для сессий;
+    смена отделов, агрегации и раздела отвечает срезом куба. _frame() — кадр для сборки."""
+    return DealCube(_frame())
 
+# ============ Даты/периоды ============
 def period_range(mode, start_date=None, end_date=None, year=None, quarter=None, month=None, iso_week=None):
     today = date.today()
     if mode == "НИТ":
@@ -279,188 +274,6 @@ def period_range(mode, start_date=None, end_date=None, year=None, quarter=None,
         start = today - timedelta(days=30); end = today
     return start, end
 
-def previous_period(start, end):
-    length = (end - start).days + 1
-    prev_end = start - timedelta(days=1)
-    prev_start = prev_end - timedelta(days=length-1)
-    return prev_start, prev_end
-
-def period_freq(mode):
-    if mode in ("НИТ","Месяц","Неделя","Диапазон дат"): return "D"
-    if mode == "Год": return "M"
-    if mode == "Квартал": return "W-MON"
-    return "D"
-
-def freq_from_label(label):
-    if label.startswith("Авто"): return None
-    return {"Дни":"D","Недели":"W-MON","Месяцы":"M"}[label]
-
-def ts_with_prev(df, date_col, value_col, start, end, mode, agg="sum", freq_override=None):
-    if df.empty:
-        return pd.DataFrame(columns=["period","value","prev_value"])
-    m = (df[date_col].dt.date.between(start, end))
-    cur = df.loc[m].copy()
-    freq = freq_override or period_freq(mode)
-    cur = cur.set_index(date_col).resample(freq)[value_col].agg(agg).rename("value")
-    pstart, pend = previous_period(start, end)
-    m2 = df[date_col].dt.date.between(pstart, pend)
-    prev = df.loc[m2].copy().set_index(date_col).resample(freq)[value_col].agg(agg).rename("prev_value")
-    out = pd.concat([cur, prev], axis=1).fillna(0).reset_index().rename(columns={date_col:"period"})
-    return out
-
-# ============ Безопасные численные преобразования ============
-def safe_float(x, default=0.0):
-    try:
-        v = float(x)
-        if np.isnan(v) or np.isinf(v):
-            return default
-        return v
-    except Exception:
-        return default
-
-def clamp(v, lo, hi):
-    try:
-        v = float(v)
-        if np.isnan(v) or np.isinf(v):
-            return lo
-    except Exception:
-        return lo
-    return max(lo, min(hi, v))
-
-# ============ Скоринг/метки ============
-def days_between(later, earlier):
-    a, b = to_dt(later), to_dt(earlier)
-    if pd.isna(a) or pd.isna(b): return None
-    return max(0, int((a - b) / pd.Timedelta(days=1)))
-
-def compute_health_scores(df, open_tasks_map, stuck_days=5):
-    now = to_dt(pd.Timestamp.utcnow())
-    rows = []
-    for _, r in df.iterrows():
-        create_dt = to_dt(r.get("DATE_CREATE"))
-        last = to_dt(r.get("LAST_ACTIVITY_TIME")) or to_dt(r.get("DATE_MODIFY")) or create_dt
-        begin_dt = to_dt(r.get("BEGINDATE")) or create_dt
-
-        d_work  = days_between(now, create_dt) or 0
-        d_noact = days_between(now, last) or 0
-        d_stage = days_between(now, begin_dt) or 0
-
-        has_task = len(open_tasks_map.get(int(safe_float(r.get("ID"), 0)), [])) > 0
-
-        flags = {
-            "no_company": int(safe_float(r.get("COMPANY_ID"), 0)) == 0,
-            "no_contact": int(safe_float(r.get("CONTACT_ID"), 0)) == 0,
-            "no_tasks": not has_task,
-            "stuck": d_noact >= stuck_days,
-            "lost": str(r.get("STAGE_ID","")).upper().find("LOSE") >= 0
-        }
-
-        # Здоровье
-        score = 100
-        if flags["no_company"]: score -= 10
-        if flags["no_contact"]: score -= 10
-        if flags["no_tasks"]:   score -= 25
-        if flags["stuck"]:      score -= 25
-        if flags["lost"]:       score = min(score, 15)
-        health = int(clamp(score, 0, 100))
-
-        # Потенциал (устойчиво к NaN/inf)
-        opp  = safe_float(r.get("OPPORTUNITY"), 0.0)
-        prob = clamp(r.get("PROBABILITY"), 0.0, 100.0)
-        if opp <= 0:
-            potential = 0
-        else:
-            try:
-                opp_boost = 30 + min(70, math.log10(max(1.0, opp)) / 5.0 * 70.0)
-            except ValueError:
-                opp_boost = 30.0
-            prob_coef = 0.4 + (prob/100.0)*0.6
-            potential = int(clamp(round(opp_boost * prob_coef), 0, 100))
-
-        rows.append({
-            "ID": int(safe_float(r.get("ID"), 0)),
-            "TITLE": r.get("TITLE",""),
-            "ASSIGNED_BY_ID": int(safe_float(r.get("ASSIGNED_BY_ID"), 0)),
-            "STAGE_ID": r.get("STAGE_ID",""),
-            "CATEGORY_ID": safe_float(r.get("CATEGORY_ID"), np.nan),
-            "OPPORTUNITY": opp,
-            "PROBABILITY": prob,
-            "DATE_CREATE": create_dt,
-            "DATE_MODIFY": to_dt(r.get("DATE_MODIFY")),
-            "LAST_ACTIVITY_TIME": last,
-            "BEGINDATE": begin_dt,
-            "CLOSEDATE": to_dt(r.get("CLOSEDATE")),
-            "SEMANTIC": (r.get("STAGE_SEMANTIC_ID") or "").upper(),
-            "days_in_work": d_work,
-            "days_no_activity": d_noact,
-            "days_on_stage": d_stage,
-            "health": health,
-            "potential": potential,
-            "flag_no_company": flags["no_company"],
-            "flag_no_contact": flags["no_contact"],
-            "flag_no_tasks": flags["no_tasks"],
-            "flag_stuck": flags["stuck"],
-            "flag_lost": flags["lost"],
-        })
-    return pd.DataFrame(rows)
-
-def is_failure_reason(stage_name):
-    name = str(stage_name or "")
-    return (name in FAIL_GROUP1) or (name in FAIL_GROUP2)
-def failure_group(stage_name):
-    name = str(stage_name or "")
-    if name in FAIL_GROUP1: return "Группа 1 (ранние этапы)"
-    if name in FAIL_GROUP2: return "Группа 2 (поздние этапы)"
-    return "Прочее"
-
-# --- FIXED: устойчивый подсчёт переносов дедлайнов и «микро-задач»
-def cheat_flags_for_deal(acts):
-    """Эвристики обхода системы с защитой типов/TZ:
-    reschedules — переносы дедлайнов; micro_tasks — задачи ≤15 минут.
-    """
-    if not acts:
-        return {"reschedules": 0, "micro_tasks": 0}
-
-    df = pd.DataFrame(acts)
-
-    def _to_naive(series):
-        s = pd.to_datetime(series, errors="coerce", utc=True)
-        try:
-            s = s.dt.tz_convert(None)
-        except Exception:
-            try:
-                s = s.dt.tz_localize(None)
-            except Exception:
-                pass
-        return s
-
-    for col in ["CREATED","LAST_UPDATED","DEADLINE","START_TIME","END_TIME"]:
-        if col in df.columns:
-            df[col] = _to_naive(df[col])
-
-    # Переносы дедлайна (по SUBJECT → уникальные дни DEADLINE)
-    reschedules = 0
-    if "DEADLINE" in df.columns:
-        tmp = df.dropna(subset=["DEADLINE"]).copy()
-        subj = tmp["SUBJECT"] if "SUBJECT" in tmp.columns else pd.Series([""] * len(tmp))
-        tmp["_deadline_day"] = tmp["DEADLINE"].dt.floor("D")
-        grp = pd.DataFrame({"SUBJECT": subj, "_deadline_day": tmp["_deadline_day"]})
-        for _, g in grp.groupby("SUBJECT"):
-            uniq = g["_deadline_day"].nunique()
-            if uniq and uniq > 1:
-                reschedules += int(uniq - 1)
-
-    # Микро-задачи (<= 15 минут)
-    micro = 0
-    if "START_TIME" in df.columns and "END_TIME" in df.columns:
-        st_ = df["START_TIME"]; en_ = df["END_TIME"]
-        mask = st_.notna() & en_.notna()
-        if mask.any():
-            dur_min = (en_[mask] - st_[mask]).dt.total_seconds() / 60.0
-            micro = int((dur_min <= 15).sum())
-
-    return {"reschedules": int(reschedules), "micro_tasks": int(micro)}
-
 # ============ Фильтры с сохранением ============
 def ss_get(k, default):
     if k not in st.session_state: st.session_state[k] = default
@@ -505,14 +318,13 @@ agg_default = ss_get("flt_agg_label", "Авто (от режима)")
 st.sidebar.selectbox("Ось времени (агрегация)", ["Авто (от режима)","Дни","Недели","Месяцы"],
                      index=["Авто (от режима)","Дни","Недели","Месяцы"].index(agg_default),
                      key="flt_agg_label")
-agg_freq = {"Авто (от режима)":None,"Дни":"D","Недели":"W-MON","Месяцы":"M"}[st.session_state["flt_agg_label"]]
+agg_freq = {"Авто (от режима)":None,"Дни":"D","Недели":"W-MON","Месяцы":MONTH_END}[st.session_state["flt_agg_label"]]
 
 st.sidebar.slider("Нет активности ≥ (дней)", 2, 21, 5, key="flt_stuck_days")
 st.sidebar.slider("Лимит сделок (API)", 50, 3000, 1500, step=50, key="flt_limit")
 
 st.sidebar.title("История стадий (опционально)")
 st.sidebar.checkbox("Использовать историю стадий (если доступна)", value=True, key="flt_use_history")
-st.sidebar.slider("Макс. сделок для истории", 50, 800, 300, step=50, key="flt_history_limit")
 
 def reset_filters():
     for k in list(st.session_state.keys()):
@@ -527,7 +339,6 @@ agg_label = st.session_state["flt_agg_label"]
 stuck_days = st.session_state["flt_stuck_days"]
 limit = st.session_state["flt_limit"]
 use_history = st.session_state["flt_use_history"]
-history_limit = st.session_state["flt_history_limit"]
 
 # Период
 if mode == "НИТ":
@@ -551,86 +362,36 @@ else:  # Диапазон дат
 
 start, end = period_range(mode, start_date=start_input, end_date=end_input, year=year, quarter=quarter, month=month, iso_week=iso_week)
 
-# ============ Загрузка данных ============
-with st.spinner("Загружаю данные…"):
-    if not BITRIX24_WEBHOOK:
-        st.error("Не указан BITRIX24_WEBHOOK в Secrets."); st.stop()
-
-    deals_raw = bx_get_deals_dual(start, end, limit=limit)
-    if not deals_raw:
-        st.error("Сделок не найдено за выбранный период."); st.stop()
-    df_raw = pd.DataFrame(deals_raw)
-
-    for c in ["OPPORTUNITY","PROBABILITY","ASSIGNED_BY_ID","COMPANY_ID","CONTACT_ID","CATEGORY_ID"]:
-        df_raw[c] = pd.to_numeric(df_raw.get(c), errors="coerce")
-
-    users_full   = bx_get_users_full()
-    users_map    = {uid: users_full[uid]["name"] for uid in users_full}
-    categories   = bx_get_categories()
-    activities   = bx_get_activities(df_raw["ID"].astype(int).tolist(), include_completed=True)
-
-# Скоринг
-df_all = compute_health_scores(df_raw, {k:v for k,v in activities.items() if v}, stuck_days=stuck_days)
-
-# Карта стадий
-cat_ids   = df_all["CATEGORY_ID"].dropna().astype(int).unique().tolist()
-sort_map, name_map = bx_get_stage_map_by_category(cat_ids)
-FALLBACK_ORDER = ["NEW","NEW_LEAD","PREPARATION","PREPAYMENT_INVOICE","EXECUTING","FINAL_INVOICE","WON","LOSE"]
-def fallback_sort(sid):
-    sid = str(sid or ""); sid_short = sid.split(":")[1] if ":" in sid else sid
-    return (FALLBACK_ORDER.index(sid_short)*100 if sid_short in FALLBACK_ORDER else 10000 + hash(sid_short)%1000)
-
-df_all["stage_sort"] = df_all["STAGE_ID"].map(lambda s: sort_map.get(str(s), fallback_sort(s)))
-df_all["stage_name"] = df_all["STAGE_ID"].map(lambda s: name_map.get(str(s), str(s)))
-df_all["manager"]    = df_all["ASSIGNED_BY_ID"].map(users_map).fillna("Неизвестно")
-df_all["category"]   = df_all["CATEGORY_ID"].map(lambda x: categories.get(int(x or 0), "Воронка") if pd.notna(x) else "Воронка")
-df_all["cat_norm"]   = df_all["category"].map(lambda x: str(x or "").strip().casefold())
-
-# Успех/провал
-df_all["is_success"] = df_all.apply(lambda r: (SUCCESS_NAME_BY_CAT.get(r["cat_norm"]) == r["stage_name"]), axis=1)
-df_all["is_fail"]    = df_all["stage_name"].map(is_failure_reason)
-df_all["fail_group"] = df_all["stage_name"].map(failure_group)
-
-# Античит (фикс: безопасный дефолт [])
-df_all["reschedules"] = df_all["ID"].map(lambda i: cheat_flags_for_deal(activities.get(int(i), [])).get("reschedules", 0))
-df_all["micro_tasks"] = df_all["ID"].map(lambda i: cheat_flags_for_deal(activities.get(int(i), [])).get("micro_tasks", 0))
-df_all["cheat_flag"]  = (df_all["reschedules"]>=3) | (df_all["micro_tasks"]>=5)
-
-# История стадий
-history_info = {}
-if use_history:
+# ============ Источник данных: снимок или Bitrix ============
+def current_snapshot():
+    """(версия, кадр, метаданные) последнего снимка precompute.py, если период в его окне, иначе None."""
+    version = snapshot.latest(SNAPSHOT_DIR)
+    if not version:
+        return None
     try:
-        history_raw = bx_get_stage_history_lite(df_all["ID"].astype(int).tolist(), max_deals=history_limit)
-        for did, items in history_raw.items():
-            h = pd.DataFrame(items)
-            if h.empty: 
-                continue
-            if "STAGE_ID" not in h.columns and "STATUS_ID" in h.columns:
-                h["STAGE_ID"] = h["STATUS_ID"]
-            time_cols = []
-            for c in ["CREATED_TIME","CREATED","CHANGED_TIME","DATE_CREATE"]:
-                if c in h.columns:
-                    h[c] = pd.to_datetime(h[c], errors="coerce"); time_cols.append(c)
-            if not time_cols:
-                continue
-            tcol = time_cols[0]
-            h = h.dropna(subset=[tcol]).sort_values(tcol)
-            history_info[did] = h[["STAGE_ID", tcol]].rename(columns={tcol:"TS"})
-    except Exception:
-        history_info = {}
-if history_info:
-    fail_from_stage = {}
-    for did, hist in history_info.items():
-        if len(hist) >= 2:
-            prev = hist.iloc[-2]["STAGE_ID"]
-            fail_from_stage[did] = name_map.get(str(prev), str(prev))
-    df_all["fail_from_stage_hist"] = df_all["ID"].map(fail_from_stage)
+        snap_df, meta = load_snapshot(version)
+    except Exception as e:
+        st.warning(f"Снимок {version} не прочитан, загрузка из Bitrix: {e}")
+        return None
+    return (version, snap_df, meta) if snapshot.covers(meta, start, end) else None
+
+# Замеры прогона: этапы загрузки, расчёта и отрисовки (админ-панель внизу сайдбара)
+rec = metrics.Recorder(bx_client(), metrics_registry()).activate()
+
+with rec.span("snapshot", "snapshot"):
+    snap = current_snapshot() if SNAPSHOT_DIR else None
+if snap is None and not BITRIX24_WEBHOOK:
+    st.error("Не указан BITRIX24_WEBHOOK в Secrets."); st.stop()
+if snap is not None:
+    org, departments = snapshot_org_index(snap[0]), snap[2]["departments"]
 else:
-    df_all["fail_from_stage_hist"] = np.nan
+    with rec.span("org_index", "bitrix"):
+        org = bx_get_org_index()
+    with rec.span("departments", "bitrix"):
+        departments = bx_get_departments()
 
 # ============ Фильтр по отделам ============
 st.sidebar.title("Отделы / сотрудники")
-departments = bx_get_departments()
 sales_depts = [d for d in departments if "продаж" in (d.get("NAME","").lower())]
 sales_dept_ids = {int(d["ID"]) for d in sales_depts}
 ss_get("flt_sales_only", True if sales_dept_ids else False)
@@ -643,20 +404,144 @@ st.sidebar.checkbox("Только отдел продаж", key="flt_sales_only"
 st.sidebar.multiselect("Выбор отделов", options=dept_options, key="flt_depts",
                        default=default_depts, format_func=lambda t: t[1] if isinstance(t, tuple) else str(t))
 selected_dept_ids = {t[0] for t in st.session_state["flt_depts"]} if st.session_state["flt_depts"] else (sales_dept_ids if st.session_state["flt_sales_only"] else set())
+# Ответственные выбранных отделов (с подотделами) уходят фильтром в crm.deal.list / базу / снимок:
+# загружаются только нужные сделки, активности и история — только по ним
+assigned = None
 if selected_dept_ids:
-    users_full_all = bx_get_users_full()
-    keep_users = [uid for uid, info in users_full_all.items() if set(info["depts"]) & selected_dept_ids]
-    if keep_users:
-        df_all = df_all[df_all["ASSIGNED_BY_ID"].isin(keep_users)]
+    keep_users = org.users_in(selected_dept_ids)
+    if len(keep_users):
+        assigned = tuple(int(u) for u in keep_users)
 
-# ============ Поднаборы по периоду ============
-m_created = df_all["DATE_CREATE"].dt.date.between(start, end)
-m_closed  = df_all["CLOSEDATE"].dt.date.between(start, end)
-m_modify  = df_all["DATE_MODIFY"].dt.date.between(start, end)
+# ============ Загрузка данных ============
+def load_live():
+    """Загрузка из Bitrix и сборка кадра в сессии: (df_all, has_history, ключ данных)."""
+    rev = deal_store().revision() if deal_store() else None
+    with st.spinner("Загружаю данные…"):
+        with rec.span("deals_dual", "bitrix"):
+            deals_raw = bx_get_deals_dual(start, end, limit=limit, assigned=assigned, rev=rev)
+        if not deals_raw:
+            st.error("Сделок не найдено за выбранный период."); st.stop()
+        with rec.span("deals_frame"):
+            df_raw = deals_frame(deals_raw)
+
+        with rec.span("users_full", "bitrix"):
+            users_full = bx_get_users_full()
+        users_map    = {uid: users_full[uid]["name"] for uid in users_full}
+        with rec.span("categories", "bitrix"):
+            categories = bx_get_categories()
+        try:
+            with rec.span("activities", "bitrix"):
+                activities = bx_get_activities(deal_versions(deals_raw), include_completed=True, rev=rev)
+        except Exception as e:
+            st.warning(f"Активности не загружены (задачи/античит неполные): {e}")
+            activities = {}
+    ac = activity_cache()
+    st.sidebar.caption(f"Кэш активностей: {ac.hit_ratio:.0%} попаданий по сделкам "
+                       f"(последний запрос: {ac.last[0]} из кэша, {ac.last[1]} из Bitrix)")
+
+    # Карта стадий
+    cat_ids = df_raw["CATEGORY_ID"].dropna().astype(int).unique().tolist()
+    with rec.span("stage_map", "bitrix"):
+        sort_map, name_map = bx_get_stage_map_by_category(cat_ids)
+
+    # История стадий
+    history_raw = {}
+    if use_history:
+        try:
+            with rec.span("stage_history", "bitrix"):
+                history_raw = bx_get_stage_history([int(d["ID"]) for d in deals_raw], start - timedelta(days=loaders.HISTORY_LOOKBACK_DAYS))
+        except Exception as e:
+            st.warning(f"История стадий не загружена: {e}")
+            history_raw = {}
+
+    # Скоринг, стадии, античит, этап провала — из кэша по версии данных; слайдер
+    # «Нет активности» пересчитывает только flag_stuck/health
+    with rec.span("scored_base"):
+        version = raw_version(deals_raw, activities, history_raw, users_map, categories, sort_map, name_map)
+        df_all = scored_base(version, df_raw, activities, users_map, categories, sort_map, name_map, history_raw)
+    if stuck_days != STUCK_DAYS_BASE:
+        with rec.span("apply_stuck_days"):
+            df_all = apply_stuck_days(df_all, stuck_days)
+    return df_all, bool(history_raw), ("live", version, stuck_days)
+
+def snapshot_session(df, meta):
+    """Срез снимка с настройками сессии: порог «нет активности», история стадий."""
+    if stuck_days != meta["stuck_days"]:
+        with metrics.span("apply_stuck_days"):
+            df = apply_stuck_days(df, stuck_days)
+    if not (meta["has_history"] and use_history):
+        df = df.assign(fail_from_stage_hist=pd.Series(np.nan, index=df.index, dtype="category"))
+    return df
+
+def load_from_snapshot(version, snap_df, meta):
+    """Срез периода (и выбранных отделов) из снимка: (df_all, has_history, ключ данных).
+    Ключ — без отделов: куб периода общий для любого фильтра отделов."""
+    with rec.span("period_slice"):
+        df_all = snapshot.period_slice(snap_df, start, end, limit, assigned=assigned)
+    if df_all.empty:
+        st.error("Сделок не найдено за выбранный период."); st.stop()
+    df_all = snapshot_session(df_all, meta)
+    has_history = meta["has_history"] and use_history
+    age = datetime.now() - datetime.fromisoformat(meta["built_at"])
+    st.sidebar.caption(f"Снимок {version}: собран {int(age.total_seconds() // 60)} мин назад, "
+                       f"окно {meta['window'][0]} → {meta['window'][1]}")
+    return df_all, has_history, ("snapshot", version, start, end, limit, stuck_days, has_history)
+
+df_all, has_history, data_key = load_from_snapshot(*snap) if snap is not None else load_live()
+
+# ============ Маски периода ============
+# Отсортированный индекс на колонку дат: срез периода — searchsorted, а не .dt.date на строку.
+# Строки по маске не копируются заранее: счётчики — из куба, ряды — ts_batch по маскам,
+# сами сделки — mod_rows() только в разделах со списками.
+with rec.span("date_index"):
+    date_ix = {c: DateIndex(df_all[c]) for c in ("DATE_CREATE", "CLOSEDATE", "DATE_MODIFY")}
+m_created = date_ix["DATE_CREATE"].mask(start, end)
+m_closed  = date_ix["CLOSEDATE"].mask(start, end)
+m_modify  = date_ix["DATE_MODIFY"].mask(start, end)   # «Здоровье/проблемы/градация/AI» — по активности
+
+def mod_rows(cols=None):
+    """Сделки с DATE_MODIFY в период; cols — только нужные разделу колонки."""
+    return df_all[m_modify] if cols is None else df_all.loc[m_modify, cols]
+
+# ============ Куб показателей ============
+# Счётчики и суммы разделов — из куба (cube.py), собранного один раз на данные периода;
+# строки сделок нужны только спискам (mod_rows).
+def load_cube():
+    """Live: куб по df_all (отделы уже в загрузке). Снимок: куб периода по всем отделам,
+    отделы — фильтр ячеек; если лимит обрезал период, отделы меняют состав сделок —
+    тогда куб по df_all выбранных отделов."""
+    if snap is None:
+        return deals_cube(data_key, lambda: df_all)
+    cube = deals_cube(data_key, lambda: snapshot_session(snapshot.period_slice(snap[1], start, end, limit), snap[2]))
+    if assigned is not None and limit and cube.rows >= limit:
+        cube = deals_cube(data_key + (assigned,), lambda: df_all)
+    return cube
+
+with rec.span("cube"):
+    view = load_cube().view(start, end, assigned)
+
+# ============ Временные ряды (текущий / пред. период) ============
+# Ряды раздела — один проход по df_all на колонку дат (ts_batch), только для открытого раздела.
+# Ряд строится по строкам своей маски периода (m_created, m_closed, m_modify).
+TARGET_CATS = [CAT_MAIN, CAT_PHYS, CAT_LOW]
+PROBLEM_COLS = [("Без задач","flag_no_tasks"),("Без компании","flag_no_company"),
+                ("Без контакта","flag_no_contact"),("Застряли","flag_stuck"),("Проиграны","is_fail")]
+m_succ_closed = m_closed & df_all["is_success"].to_numpy() & df_all["cat_norm"].isin(TARGET_CATS).to_numpy()
+ts_specs = {
+    "deals":     {"date": "DATE_CREATE", "value": "ID", "agg": "count", "rows": m_created},
+    # выручка — по дате закрытия (в маске m_closed CLOSEDATE всегда заполнена)
+    "rev_total": {"date": "CLOSEDATE", "value": "OPPORTUNITY", "agg": "sum", "rows": m_succ_closed},
+    "rev_cat":   {"date": "CLOSEDATE", "value": "OPPORTUNITY", "agg": "sum", "rows": m_succ_closed,
+                  "by": "cat_norm", "groups": TARGET_CATS},
+    "health":    {"date": "DATE_MODIFY", "value": "health", "agg": "mean", "rows": m_modify},
+    "potential": {"date": "DATE_MODIFY", "value": "potential", "agg": "mean", "rows": m_modify},
+}
+for _, col in PROBLEM_COLS:
+    ts_specs[col] = {"date": "DATE_MODIFY", "value": col, "agg": "sum", "rows": m_modify}
 
-df_created = df_all[m_created].copy()   # «Сделки (шт.)» — по дате создания
-df_closed  = df_all[m_closed].copy()    # «Выручка (₽)» — по дате закрытия
-df_mod     = df_all[m_modify].copy()    # «Здоровье/проблемы/градация/AI» — по активности
+def section_series(names):
+    with metrics.span("ts_batch"):
+        return ts_batch(df_all, {n: ts_specs[n] for n in names}, start, end, mode, freq_override=agg_freq, index=date_ix)
 
 # Шапка
 def fmt_currency(x):
@@ -666,38 +551,23 @@ def fmt_currency(x):
 st.markdown("<div class='headerbar'><div class='pill'>БУРМАШ · Контроль отдела продаж</div></div>", unsafe_allow_html=True)
 st.caption(f"Период: {start} → {end}. Динамика — к предыдущему периоду той же длины. Агрегация: {agg_label}. История стадий: {'вкл' if use_history else 'выкл'}.")
 
-# ============ Вкладки ============
-tab_over, tab_prob, tab_mgr, tab_grad, tab_time, tab_ai, tab_plan = st.tabs([
-    "📊 Обзор", "⚠️ Проблемы", "👥 По менеджерам", "🗂 Градация", "⏱ Время на этапах", "🤖 AI-аналитика", "📅 План/факт"
-])
+# ============ Разделы ============
+# st.tabs выполняет тела всех вкладок на каждом перезапуске; здесь считается только
+# открытый раздел, а виджеты внутри раздела (план года) перезапускают лишь свой фрагмент.
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
 
 # =========================
 # ОБЗОР
 # =========================
-with tab_over:
+def section_overview():
     st.subheader("Суммарные показатели")
 
-    ts_deals = ts_with_prev(df_created.assign(dc=pd.to_datetime(df_created["DATE_CREATE"])), "dc", "ID",
-                            start, end, mode, agg="count", freq_override=agg_freq)
-
-    target_cats = {CAT_MAIN, CAT_PHYS, CAT_LOW}
-    df_succ_closed = df_closed[(df_closed["is_success"]) & (df_closed["cat_norm"].isin(target_cats))].copy()
-    df_succ_closed["rev_date"] = df_succ_closed["CLOSEDATE"].fillna(df_succ_closed["DATE_MODIFY"])
-    ts_rev_total = ts_with_prev(df_succ_closed.assign(rd=pd.to_datetime(df_succ_closed["rev_date"])), "rd", "OPPORTUNITY",
-                                start, end, mode, agg="sum", freq_override=agg_freq)
-
-    per_cat = []
-    for cat in [CAT_MAIN, CAT_PHYS, CAT_LOW]:
-        part = df_succ_closed[df_succ_closed["cat_norm"]==cat].copy()
-        ts = ts_with_prev(part.assign(rd=pd.to_datetime(part["rev_date"])), "rd", "OPPORTUNITY",
-                          start, end, mode, agg="sum", freq_override=agg_freq)
-        ts["cat"] = cat; per_cat.append(ts)
-    ts_rev_by_cat = pd.concat(per_cat, ignore_index=True) if per_cat else pd.DataFrame(columns=["period","value","prev_value","cat"])
-
-    ts_health = ts_with_prev(df_mod.assign(dm=pd.to_datetime(df_mod["DATE_MODIFY"])), "dm", "health",
-                             start, end, mode, agg="mean", freq_override=agg_freq)
-    ts_poten  = ts_with_prev(df_mod.assign(dm=pd.to_datetime(df_mod["DATE_MODIFY"])), "dm", "potential",
-                             start, end, mode, agg="mean", freq_override=agg_freq)
+    series = section_series(["deals", "rev_total", "rev_cat", "health", "potential"])
+    ts_deals = series["deals"]
+    ts_rev_total = series["rev_total"]
+    ts_rev_by_cat = series["rev_cat"].rename(columns={"cat_norm":"cat"})
+    ts_health = series["health"]
+    ts_poten  = series["potential"]
 
     def delta_str(cur_prev_df, agg="sum"):
         if cur_prev_df.empty: return "0", "0%"
@@ -745,12 +615,7 @@ with tab_over:
 
     # Распределение здоровья
     st.subheader("Распределение здоровья (шаг 5%)")
-    bins = list(range(0, 105, 5))
-    if not df_mod.empty:
-        hist = pd.cut(df_mod["health"], bins=bins, right=False).value_counts().sort_index()
-        dist = pd.DataFrame({"Диапазон": hist.index.astype(str), "Кол-во": hist.values})
-    else:
-        dist = pd.DataFrame(columns=["Диапазон","Кол-во"])
+    dist = view.health_dist()
     if px and not dist.empty:
         fig_funnel = px.funnel(dist, y="Диапазон", x="Кол-во", color_discrete_sequence=["#ff7a00"])
         st.plotly_chart(fig_funnel, use_container_width=True, key="ov_health_funnel")
@@ -759,9 +624,7 @@ with tab_over:
     # Воронки по этапам (без провалов)
     st.subheader("Воронки по этапам (без провалов) + «Провал» по причинам")
     for cat, title in [(CAT_MAIN, "Основная воронка продаж"), (CAT_PHYS, "Физ.Лица"), (CAT_LOW, "Не приоритетные сделки")]:
-        sub = df_created[(df_created["cat_norm"]==cat) & (~df_created["is_fail"])]
-        stage = (sub.groupby(["STAGE_ID","stage_name","stage_sort"])["ID"].count()
-                 .reset_index().rename(columns={"ID":"Количество"}).sort_values("stage_sort"))
+        stage = view.funnel(cat)
         with st.expander(f"Воронка: {title}"):
             if px and not stage.empty:
                 fig_v = px.funnel(stage, y="stage_name", x="Количество", color_discrete_sequence=["#111111" if cat==CAT_MAIN else "#ff7a00"])
@@ -769,15 +632,7 @@ with tab_over:
             st.dataframe(stage[["stage_name","Количество"]].rename(columns={"stage_name":"Этап"}), use_container_width=True)
 
     # Провалы
-    fails = df_mod[df_mod["is_fail"]].copy()
-    if not fails.empty:
-        fails["Причина"] = fails["stage_name"]
-        fails["Этап (из истории)"] = fails["fail_from_stage_hist"]
-        fails["Группа"] = fails["Причина"].map(failure_group)
-        fail_by_reason = (fails.groupby(["category","Группа","Причина","Этап (из истории)"])["ID"].count()
-                          .reset_index().rename(columns={"ID":"Количество"}))
-    else:
-        fail_by_reason = pd.DataFrame(columns=["category","Группа","Причина","Этап (из истории)","Количество"])
+    fail_by_reason = view.fails_by_reason()
     with st.expander("Провал: причины по группам (история стадий, если доступна)"):
         if px and not fail_by_reason.empty:
             fig_fail = px.bar(fail_by_reason, x="Количество", y="Причина", color="Группа",
@@ -789,15 +644,10 @@ with tab_over:
 # =========================
 # ПРОБЛЕМЫ
 # =========================
-with tab_prob:
+def section_problems():
     st.subheader("Метрики проблем (DATE_MODIFY в период)")
-    problems = {
-        "Без задач": int(df_mod["flag_no_tasks"].sum()),
-        "Без компании": int(df_mod["flag_no_company"].sum()),
-        "Без контакта": int(df_mod["flag_no_contact"].sum()),
-        "Застряли": int(df_mod["flag_stuck"].sum()),
-        "Проиграны": int(df_mod["is_fail"].sum()),
-    }
+    counts = view.problems()
+    problems = {name: counts[col] for name, col in PROBLEM_COLS}
     a,b,c,d,e = st.columns(5)
     a.metric("Без задач", problems["Без задач"])
     b.metric("Без компании", problems["Без компании"])
@@ -806,16 +656,9 @@ with tab_prob:
     e.metric("Проиграны", problems["Проиграны"])
 
     st.subheader("Распределение проблем по времени")
-    if px and not df_mod.empty:
-        def build_problem_ts(mask_col):
-            tmp = df_mod.assign(dm=pd.to_datetime(df_mod["DATE_MODIFY"]))
-            tmp[mask_col] = tmp[mask_col].astype(int)
-            return ts_with_prev(tmp, "dm", mask_col, start, end, mode, agg="sum", freq_override=agg_freq)
-        lines = []
-        for name, col in [("Без задач","flag_no_tasks"),("Без компании","flag_no_company"),
-                          ("Без контакта","flag_no_contact"),("Застряли","flag_stuck"),("Проиграны","is_fail")]:
-            t = build_problem_ts(col); t["type"]=name; lines.append(t)
-        prob_ts = pd.concat(lines, ignore_index=True)
+    if px and m_modify.any():
+        series = section_series([col for _, col in PROBLEM_COLS])
+        prob_ts = pd.concat([series[col].assign(type=name) for name, col in PROBLEM_COLS], ignore_index=True)
         fig = px.line(prob_ts, x="period", y="value", color="type", labels={"value":"Кол-во","period":"Период","type":"Проблема"})
         base_prev = (prob_ts.groupby("period")["prev_value"].sum().reset_index())
         fig.add_scatter(x=base_prev["period"], y=base_prev["prev_value"], name="Пред. период (сумма)", line=dict(dash="dash"))
@@ -823,30 +666,23 @@ with tab_prob:
 
     st.subheader("Списки по видам проблем (DATE_MODIFY в период)")
     cols = st.columns(5)
-    masks = [("Без задач", df_mod["flag_no_tasks"]),("Без контакта", df_mod["flag_no_contact"]),
-             ("Без компании", df_mod["flag_no_company"]),("Застряли", df_mod["flag_stuck"]),("Проиграны", df_mod["is_fail"])]
+    list_cols = ["ID","TITLE","manager","stage_name","OPPORTUNITY","health","days_no_activity"]
+    rows = mod_rows(list_cols + [col for _, col in PROBLEM_COLS])
+    masks = [("Без задач", rows["flag_no_tasks"]),("Без контакта", rows["flag_no_contact"]),
+             ("Без компании", rows["flag_no_company"]),("Застряли", rows["flag_stuck"]),("Проиграны", rows["is_fail"])]
     for (title, mask), box in zip(masks, cols):
         with box:
             st.markdown(f"<div class='card'><div class='title'>{title}</div>", unsafe_allow_html=True)
-            st.dataframe(df_mod[mask][["ID","TITLE","manager","stage_name","OPPORTUNITY","health","days_no_activity"]],
+            st.dataframe(rows.loc[mask, list_cols],
                          use_container_width=True, height=260)
             st.markdown("</div>", unsafe_allow_html=True)
 
 # =========================
 # ПО МЕНЕДЖЕРАМ
 # =========================
-with tab_mgr:
+def section_managers():
     st.subheader("Аналитика по менеджерам (DATE_MODIFY / CLOSEDATE в период)")
-    succ = df_closed[(df_closed["is_success"]) & (df_closed["cat_norm"].isin({CAT_MAIN,CAT_PHYS,CAT_LOW}))].copy()
-    succ["rev_date"] = succ["CLOSEDATE"].fillna(succ["DATE_MODIFY"])
-    won_cnt = succ.groupby("manager")["ID"].count().rename("Выиграно").reset_index()
-    won_sum = succ.groupby("manager")["OPPORTUNITY"].sum().rename("Выручка, ₽").reset_index()
-    lost_cnt = df_mod[df_mod["is_fail"]].groupby("manager")["ID"].count().rename("Проиграно").reset_index()
-    base = df_mod.groupby("manager").agg(Сделок=("ID","count"), СрЗдоровье=("health","mean")).reset_index()
-    mgr = base.merge(won_cnt, on="manager", how="left").merge(won_sum, on="manager", how="left").merge(lost_cnt, on="manager", how="left")
-    mgr[["Выиграно","Выручка, ₽","Проиграно"]] = mgr[["Выиграно","Выручка, ₽","Проиграно"]].fillna(0)
-    mgr["Конверсия в победу, %"] = (mgr["Выиграно"]/mgr["Сделок"]*100).round(1).replace([np.inf,np.nan],0)
-    mgr["СрЗдоровье"] = mgr["СрЗдоровье"].round(1)
+    mgr = view.managers(TARGET_CATS)
     st.dataframe(mgr.rename(columns={"manager":"Менеджер"}), use_container_width=True)
 
     if px and not mgr.empty:
@@ -859,27 +695,23 @@ with tab_mgr:
 
     st.subheader("Конверсия по этапам (читабельно)")
     for cat, title in [(CAT_MAIN,"Основная воронка продаж"), (CAT_PHYS,"Физ.Лица"), (CAT_LOW,"Не приоритетные сделки")]:
-        sub = df_mod[df_mod["cat_norm"]==cat]
         st.markdown(f"**{title}**")
         left, right = st.columns(2)
         with left:
-            stages = sub[~sub["is_fail"]].groupby(["stage_name","stage_sort"]).size().reset_index(name="Кол-во").sort_values("stage_sort")
-            total = stages["Кол-во"].sum() or 1
-            stages["Доля, %"] = (stages["Кол-во"]/total*100).round(1)
+            stages = view.stage_counts(cat)
             st.dataframe(stages[["stage_name","Кол-во","Доля, %"]].rename(columns={"stage_name":"Этап"}), use_container_width=True)
             if px and not stages.empty:
                 fig = px.funnel(stages, y="stage_name", x="Кол-во", color_discrete_sequence=["#ff7a00"])
                 st.plotly_chart(fig, use_container_width=True, key=f"mgr_conv_funnel_{cat}")
         with right:
-            if history_info and "fail_from_stage_hist" in df_all.columns:
-                fails_by = sub[sub["is_fail"]].groupby("fail_from_stage_hist").size().reset_index(name="Кол-во")
-                fails_by = fails_by.rename(columns={"fail_from_stage_hist":"Этап (из истории)"}).sort_values("Кол-во", ascending=False)
+            if has_history and "fail_from_stage_hist" in df_all.columns:
+                fails_by = view.fails_by_stage(cat, by_history=True)
                 st.dataframe(fails_by, use_container_width=True)
                 if px and not fails_by.empty:
                     figb = px.bar(fails_by, x="Кол-во", y="Этап (из истории)", orientation="h")
                     st.plotly_chart(figb, use_container_width=True, key=f"mgr_conv_failhist_{cat}")
             else:
-                fails = sub[sub["is_fail"]].groupby(["fail_group","stage_name"]).size().reset_index(name="Кол-во")
+                fails = view.fails_by_stage(cat, by_history=False)
                 if fails.empty:
                     st.info("Провалов нет.")
                 else:
@@ -892,85 +724,78 @@ with tab_mgr:
 # =========================
 # ГРАДАЦИЯ / ВРЕМЯ / AI
 # =========================
-with tab_grad:
+def section_grading():
     st.subheader("Градация сделок (DATE_MODIFY в период)")
-    quick = df_mod[(~df_mod["is_fail"]) & (df_mod["PROBABILITY"]>=50) & (df_mod["health"]>=60)].copy()
-    work  = df_mod[(~df_mod["is_fail"]) & (~df_mod.index.isin(quick.index))].copy()
-    drop  = df_mod[df_mod["is_fail"]]
+    rows  = mod_rows(["ID","TITLE","manager","stage_name","OPPORTUNITY","health","PROBABILITY","is_fail"])
+    quick = rows[(~rows["is_fail"]) & (rows["PROBABILITY"]>=50) & (rows["health"]>=60)]
+    work  = rows[(~rows["is_fail"]) & (~rows.index.isin(quick.index))]
+    drop  = rows[rows["is_fail"]]
+    grades = view.grades()
     c1,c2,c3 = st.columns(3)
-    c1.metric("🟢 Quick Wins", len(quick), fmt_currency(quick["OPPORTUNITY"].sum())+" ₽")
-    c2.metric("🟡 Проработка", len(work), fmt_currency(work["OPPORTUNITY"].sum())+" ₽")
-    c3.metric("🔴 Stop List", len(drop), fmt_currency(drop["OPPORTUNITY"].sum())+" ₽")
+    c1.metric("🟢 Quick Wins", grades["quick"][0], fmt_currency(grades["quick"][1])+" ₽")
+    c2.metric("🟡 Проработка", grades["work"][0], fmt_currency(grades["work"][1])+" ₽")
+    c3.metric("🔴 Stop List", grades["drop"][0], fmt_currency(grades["drop"][1])+" ₽")
     with st.expander("Списки"):
         st.dataframe(quick[["ID","TITLE","manager","OPPORTUNITY","health","PROBABILITY"]].rename(columns={"OPPORTUNITY":"Сумма"}), use_container_width=True)
         st.dataframe(work[["ID","TITLE","manager","OPPORTUNITY","health","PROBABILITY"]].rename(columns={"OPPORTUNITY":"Сумма"}), use_container_width=True)
         st.dataframe(drop[["ID","TITLE","manager","stage_name","OPPORTUNITY"]].rename(columns={"OPPORTUNITY":"Сумма"}), use_container_width=True)
 
-with tab_time:
+def section_stage_time():
     st.subheader("Время на этапах (DATE_MODIFY в период)")
-    if not df_mod.empty:
-        stage_time = df_mod.groupby("stage_name").agg(СрДней=("days_on_stage","mean"), Мин=("days_on_stage","min"), Макс=("days_on_stage","max")).round(1).reset_index()
+    rows = mod_rows(["stage_name","days_on_stage"])
+    if not rows.empty:
+        stage_time = rows.groupby("stage_name", observed=True).agg(СрДней=("days_on_stage","mean"), Мин=("days_on_stage","min"), Макс=("days_on_stage","max")).round(1).reset_index()
     else:
         stage_time = pd.DataFrame(columns=["Этап","СрДней","Мин","Макс"])
     st.dataframe(stage_time.rename(columns={"stage_name":"Этап"}), use_container_width=True)
 
-with tab_ai:
+def section_ai():
     st.subheader("🤖 AI-аналитика (DATE_MODIFY в период)")
     st.caption("Рекомендации как держать здоровье ≥70% + поиск «обходов» (переносы дедлайнов, микро-задачи).")
-    def ai_block(mgr_name, g):
-        summary = {
-            "deals": int(len(g)),
-            "avg_health": float(pd.to_numeric(g["health"], errors="coerce").mean() or 0),
-            "avg_potential": float(pd.to_numeric(g["potential"], errors="coerce").mean() or 0),
-            "no_tasks": int(g["flag_no_tasks"].sum()),
-            "stuck": int(g["flag_stuck"].sum()),
-            "fails": int(g["is_fail"].sum()),
-            "reschedules": int(g["reschedules"].sum()),
-            "micro_tasks": int(g["micro_tasks"].sum()),
-        }
-        if not PERPLEXITY_API_KEY:
-            return f"AI недоступен. Сводка: {summary}\n\nРекомендации:\n• Конкретные задачи (цель/результат/дедлайн).\n• Не переносить дедлайны более 1 раза.\n• Контакт-ритм: 1 раз в 3–5 дней на активных стадиях.\n• Фиксировать исходы контактов (звонок/письмо/встреча) в активности."
-        prompt = f"""
-Ты эксперт по CRM. Проанализируй работу менеджера "{mgr_name}".
-Данные: {summary}.
-1) Сильные стороны.
-2) Проблемные зоны.
-3) Чек-лист, чтобы здоровье сделок ≥70% и не падало (задачи, сроки, контакт-ритм, фиксация договорённостей).
-4) Признаки «обхода системы» (переносы дедлайнов, микро-задачи) и что делать руководителю.
-Пиши кратко, деловым стилем.
-"""
-        try:
-            resp = requests.post("https://api.perplexity.ai/chat/completions",
-                                 headers={"Authorization": f"Bearer {PERPLEXITY_API_KEY}"},
-                                 json={"model":"sonar-pro","messages":[{"role":"user","content":prompt}],
-                                       "temperature":0.3,"max_tokens":800},
-                                 timeout=30)
-            return resp.json()["choices"][0]["message"]["content"]
-        except Exception as e:
-            return f"AI ошибка: {e}"
-    for mgr_name, g in df_mod.groupby("manager"):
+    # Сначала все блоки с заглушками, затем ответы — по мере готовности (кэш, потом пул запросов)
+    slots, prompts = {}, {}
+    for mgr_name, g in mod_rows().groupby("manager", observed=True):
+        summary = ai.manager_summary(g)
         with st.expander(f"👤 {mgr_name} ({len(g)} сделок)"):
-            st.markdown(ai_block(mgr_name, g))
+            slots[mgr_name] = st.empty()
+        if PERPLEXITY_API_KEY:
+            prompts[mgr_name] = ai.manager_prompt(mgr_name, summary)
+            slots[mgr_name].caption("⏳ Анализ…")
+        else:
+            slots[mgr_name].markdown(ai.offline_advice(summary))
+    for mgr_name, text, _ in ai.analyze(prompts, ai_client(), ai_cache()):
+        slots[mgr_name].markdown(text)
 
 # =========================
 # ПЛАН/ФАКТ
 # =========================
-with tab_plan:
+def year_revenue(year):
+    """Факт года по месяцам × воронкам × менеджерам — не зависит от выбранного периода:
+    из снимка (если его окно начинается не позже 1 января) или из локальной базы сделок.
+    Без базы и снимка — только по загруженному периоду, как прежде."""
+    if snap is not None and snapshot.covers(snap[2], date(year, 1, 1), date(year, 1, 1)):
+        rows = snapshot_revenue(snap[0])
+    elif revenue_store() is not None and BITRIX24_WEBHOOK:
+        rows = store_revenue(year, deal_store().revision())
+    else:
+        st.caption("Факт — только по сделкам загруженного периода (нет локальной базы DEAL_STORE_PATH).")
+        rows = revenue_months(revenue_rows(df_all))
+    rows = rows[rows["year"] == year]
+    if assigned is not None:
+        rows = rows[rows["ASSIGNED_BY_ID"].isin(assigned)]
+    return rows
+
+@fragment
+def section_plan():
     st.subheader("Годовой план по выручке — План/Факт/Прогноз")
     st.number_input("Целевой план на год, ₽", min_value=0, step=100_000, format="%d", key="flt_year_plan")
     year_plan = st.session_state["flt_year_plan"] if st.session_state["flt_year_plan"] else 10_000_000
     this_year = datetime.now().year
 
-    succ_y = df_all[(df_all["is_success"]) & (df_all["cat_norm"].isin({CAT_MAIN,CAT_PHYS,CAT_LOW}))].copy()
-    succ_y["rev_date"] = succ_y["CLOSEDATE"].fillna(succ_y["DATE_MODIFY"])
-    succ_y["year"] = pd.to_datetime(succ_y["rev_date"]).dt.year
-    succ_y = succ_y[succ_y["year"]==this_year].copy()
-    succ_y["month"] = pd.to_datetime(succ_y["rev_date"]).dt.month
-    succ_y["quarter"] = ((succ_y["month"]-1)//3 + 1)
-
-    fact_year = float(succ_y["OPPORTUNITY"].sum())
-    fact_by_q = succ_y.groupby("quarter")["OPPORTUNITY"].sum().reindex([1,2,3,4], fill_value=0)
-    fact_by_m = succ_y.groupby("month")["OPPORTUNITY"].sum().reindex(range(1,13), fill_value=0)
+    fact = year_revenue(this_year)
+    fact_year = float(fact["amount"].sum())
+    fact_by_q = fact.groupby((fact["month"]-1)//3 + 1)["amount"].sum().reindex([1,2,3,4], fill_value=0)
+    fact_by_m = fact.groupby("month")["amount"].sum().reindex(range(1,13), fill_value=0)
 
     today = date.today()
     months_passed = today.month
@@ -1010,6 +835,29 @@ with tab_plan:
         fig_plan.add_scatter(x=m_df["Месяц"], y=m_df["План, ₽"], name="План", line=dict(dash="dash"))
         st.plotly_chart(fig_plan, use_container_width=True, key="plan_fact_months")
 
+SECTIONS = {
+    "📊 Обзор": section_overview, "⚠️ Проблемы": section_problems, "👥 По менеджерам": section_managers,
+    "🗂 Градация": section_grading, "⏱ Время на этапах": section_stage_time, "🤖 AI-аналитика": section_ai,
+    "📅 План/факт": section_plan,
+}
+section = st.radio("Раздел", list(SECTIONS), horizontal=True, key="ui_section", label_visibility="collapsed")
+with rec.span(section, "render"):
+    SECTIONS[section]()
+
 st.markdown("---")
 st.caption("БУРМАШ · CRM Дэшборд v5.7 — устойчивые активности и фильтры")
 
+# ============ Замеры (только админ) ============
+rec.finish()
+if st.session_state.get(USER_KEY) in ADMIN_USERS:
+    with st.sidebar.expander("⏱ Производительность"):
+        st.dataframe(pd.DataFrame(rec.table()), use_container_width=True, hide_index=True)
+        registry = metrics_registry()
+        c1, c2 = st.columns(2)
+        c1.download_button("JSON", json.dumps(registry.to_json(), ensure_ascii=False, default=str),
+                           file_name="burmash_metrics.json", mime="application/json", key="metrics_json")
+        c2.download_button("Prometheus", registry.prometheus(), file_name="burmash_metrics.prom",
+                           mime="text/plain", key="metrics_prom")
+        if METRICS_PORT:
+            st.caption(f"Prometheus: http://<хост>:{METRICS_PORT}/metrics")
+
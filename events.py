@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Приёмник исходящих событий Bitrix24 (исходящий вебхук) — без Streamlit.
+Bitrix присылает POST (form-encoded): event=ONCRMDEALUPDATE, data[FIELDS][ID]=…,
+auth[application_token]=…. Приёмник сразу отвечает 200, события копятся delay
+секунд и разбираются пачкой: затронутые сделки догружаются одним crm.deal.list
+по filter[ID][] и записываются в локальную базу (DealStore), кэш активностей
+затронутых сделок сбрасывается. Дашборд видит изменения по DealStore.revision
+в ключе кэша — через секунды, без перезагрузки периода.
+
+    python events.py --port 8790 --record .cache/events.jsonl   # приём (+ запись событий)
+    python events.py --replay .cache/events.jsonl               # повтор записанных событий
+
+Настройки — из окружения, как у дашборда: BITRIX24_WEBHOOK, DEAL_STORE_PATH,
+BITRIX24_EVENT_TOKEN (application_token обработчика; пусто — без проверки).
+"""
+
+import argparse, json, os, sys, threading, time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode
+
+from bitrix import BitrixClient
+from store import DEAL_FIELDS, ActivityCache, DealStore
+
+DEAL_EVENTS = {"ONCRMDEALADD", "ONCRMDEALUPDATE"}
+DEAL_DELETE_EVENTS = {"ONCRMDEALDELETE"}
+ACTIVITY_EVENTS = {"ONCRMACTIVITYADD", "ONCRMACTIVITYUPDATE", "ONCRMACTIVITYDELETE"}
+PAGE = 50  # ID в одном filter[ID][] — одна страница crm.*.list
+RETRY_MAX = 60  # пауза до повтора разбора после ошибки удваивается до RETRY_MAX секунд
+
+
+def parse_event(body):
+    """Тело POST исходящего вебхука → {"event", "id", "token", "ts"} (id — int или None)."""
+    q = parse_qs(body.decode() if isinstance(body, bytes) else body, keep_blank_values=True)
+    first = lambda k: (q.get(k) or [""])[0]
+    eid = first("data[FIELDS][ID]")
+    return {"event": first("event").upper(), "id": int(eid) if eid.isdigit() else None,
+            "token": first("auth[application_token]"), "ts": first("ts")}
+
+def event_body(event, entity_id, token="", ts=None):
+    """Тело события в формате Bitrix24 — для записи тестовых событий и бенчмарков."""
+    return urlencode({"event": event, "data[FIELDS][ID]": entity_id, "ts": ts or int(time.time()),
+                      "auth[application_token]": token})
+
+
+class EventSink:
+    """Очередь событий и их разбор пачками. flush() — синхронно (повтор, тесты),
+    start() — фоновый поток, который разбирает накопленное каждые delay секунд;
+    после ошибки разбора — повтор через retry секунд (далее вдвое дольше), даже
+    если новых событий нет."""
+
+    def __init__(self, client, store, activities, token="", delay=0.5, retry=1.0):
+        self.client, self.store, self.activities = client, store, activities
+        self.token, self.delay, self.retry = token, delay, retry
+        self.pending = []
+        self.stats = {"received": 0, "rejected": 0, "ignored": 0, "applied": 0, "deals": 0, "deleted": 0, "activities": 0, "flushes": 0}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def submit(self, ev):
+        """Принимает разобранное событие; False — чужой application_token.
+        Прочие события (контакты, компании…) и события без ID пропускаются."""
+        with self._lock:
+            if self.token and ev["token"] != self.token:
+                self.stats["rejected"] += 1
+                return False
+            if ev["event"] not in DEAL_EVENTS | DEAL_DELETE_EVENTS | ACTIVITY_EVENTS or ev["id"] is None:
+                self.stats["ignored"] += 1
+                return True
+            self.pending.append(ev)
+            self.stats["received"] += 1
+        self._wake.set()
+        return True
+
+    def _list(self, method, ids, select):
+        out = []
+        ids = sorted(ids)
+        for i in range(0, len(ids), PAGE):
+            out += self.client.get_all(method, {"select[]": select, "filter[ID][]": ids[i:i + PAGE]})
+        return out
+
+    def flush(self):
+        """Разбирает накопленные события: сделки — upsert/удаление в базе, активности —
+        сброс кэша по сделке-владельцу и обновление самой сделки (LAST_ACTIVITY_TIME)."""
+        with self._lock:
+            events, self.pending = self.pending, []
+        if not events:
+            return 0
+        try:
+            self._apply(events)
+        except Exception:
+            with self._lock:  # вернуть в очередь — следующий разбор повторит
+                self.pending[:0] = events
+            raise
+        return len(events)
+
+    def _apply(self, events):
+        deals, deleted, acts, acts_deleted = set(), set(), set(), set()
+        for ev in events:
+            if ev["event"] in DEAL_EVENTS: deals.add(ev["id"])
+            elif ev["event"] in DEAL_DELETE_EVENTS: deleted.add(ev["id"])
+            elif ev["event"] == "ONCRMACTIVITYDELETE": acts_deleted.add(ev["id"])
+            else: acts.add(ev["id"])
+        # владельцы активностей: живые — из Bitrix, удалённые — по кэшу
+        owners = {int(a["OWNER_ID"]) for a in self._list("crm.activity.list", acts, ["ID", "OWNER_ID", "OWNER_TYPE_ID"])
+                  if str(a.get("OWNER_TYPE_ID")) == "2"} if acts else set()
+        owners |= self.activities.owners_of(acts_deleted) if acts_deleted else set()
+        self.activities.invalidate(owners)
+        deals = (deals | owners) - deleted
+        fetched = self._list("crm.deal.list", deals, DEAL_FIELDS) if deals else []
+        deleted |= deals - {int(d["ID"]) for d in fetched}  # обновление пришло, а сделки уже нет
+        self.store.upsert(fetched)
+        self.store.delete(deleted)
+        if owners:  # перенос срока задачи может не менять строку сделки — ревизия нужна всё равно
+            self.store.touch()
+        with self._lock:
+            self.stats["deals"] += len(fetched)
+            self.stats["deleted"] += len(deleted)
+            self.stats["activities"] += len(owners)
+            self.stats["applied"] += len(events)
+            self.stats["flushes"] += 1
+
+    def start(self):
+        def loop():
+            backoff = None  # после ошибки — пауза до повтора: события остались в очереди
+            while True:
+                self._wake.wait(backoff)
+                time.sleep(self.delay)  # события одного изменения приходят пачкой
+                self._wake.clear()
+                try:
+                    self.flush()
+                    backoff = None
+                except Exception as e:
+                    backoff = min(backoff * 2, RETRY_MAX) if backoff else self.retry
+                    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} ошибка разбора событий: {e}; повтор через {backoff:g} с",
+                          file=sys.stderr, flush=True)
+        threading.Thread(target=loop, daemon=True).start()
+        return self
+
+
+def serve(sink, port=0, record=None):
+    """Поднимает приёмник в фоновом потоке; record — файл JSONL для записи тел событий.
+    Возвращает (server, url обработчика для настроек исходящего вебхука)."""
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a): pass
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(n).decode()
+            if record:
+                with lock, open(record, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"at": time.time(), "body": body}, ensure_ascii=False) + "\n")
+            ok = sink.submit(parse_event(body))
+            self.send_response(200 if ok else 403)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+def prune_loop(store, client, every):
+    """Раз в every секунд — обход ID сделок: удаляет из базы сделки, удалённые в Bitrix,
+    если их событие ONCRMDEALDELETE не дошло."""
+    while True:
+        time.sleep(every)
+        try:
+            n = store.prune(client)
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} обход ID сделок: удалено {n}", flush=True)
+        except Exception as e:
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} ошибка обхода ID сделок: {e}", file=sys.stderr, flush=True)
+
+def replay(path, sink):
+    """Повтор записанных событий (JSONL от serve(record=...)) одной пачкой."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                sink.submit(parse_event(json.loads(line)["body"]))
+    return sink.flush()
+
+
+def main():
+    env = os.environ.get
+    ap = argparse.ArgumentParser(description="Приёмник исходящих событий Bitrix24")
+    ap.add_argument("--webhook", default=(env("BITRIX24_WEBHOOK") or "").strip())
+    ap.add_argument("--store", default=env("DEAL_STORE_PATH", ".cache/deals.sqlite"), help="локальная база дашборда")
+    ap.add_argument("--token", default=env("BITRIX24_EVENT_TOKEN", ""), help="application_token обработчика")
+    ap.add_argument("--port", type=int, default=8790)
+    ap.add_argument("--delay", type=float, default=0.5, help="сек. накопления событий перед разбором")
+    ap.add_argument("--record", default="", help="записывать тела событий в JSONL")
+    ap.add_argument("--replay", default="", help="повторить записанные события и выйти")
+    ap.add_argument("--prune-every", type=int, default=24 * 3600,
+                    help="сек. между обходами ID сделок (удалённые в Bitrix; 0 — без обхода)")
+    args = ap.parse_args()
+    if not args.webhook or not args.store:
+        sys.exit("Нужны BITRIX24_WEBHOOK и DEAL_STORE_PATH (файл базы дашборда)")
+    client = BitrixClient(args.webhook, rate=float(env("BITRIX24_RATE") or 2), burst=int(env("BITRIX24_BURST") or 50))
+    sink = EventSink(client, DealStore(args.store), ActivityCache(args.store), token=args.token, delay=args.delay)
+    if args.replay:
+        n = replay(args.replay, sink)
+        print(f"повторено событий: {n}, {sink.stats}")
+        return
+    server, url = serve(sink.start(), args.port, record=args.record or None)
+    if args.prune_every:
+        threading.Thread(target=prune_loop, args=(sink.store, client, args.prune_every), daemon=True).start()
+    print(f"Обработчик событий: {url} (порт {args.port})", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
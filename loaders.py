@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Загрузчики данных Bitrix24 БУРМАШ — без Streamlit.
+Дашборд оборачивает их в st.cache_data (bx_get_*), фоновые задачи и бенчмарки
+вызывают напрямую с собственным BitrixClient и хранилищами из store.py.
+"""
+
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+from store import DEAL_FIELDS
+
+HISTORY_LOOKBACK_DAYS = 90  # история стадий с (начало периода − N дней); сделки старше — догрузка по ID
+
+
+def _utc_day(d):
+    """Начало дня d в UTC для фильтра Bitrix: дни периода — UTC, как в DealStore и кадре сделок."""
+    return f"{d:%Y-%m-%d}T00:00:00+00:00"
+
+def deals_by_date(client, field_from, field_to, limit=3000, max_id=None, assigned=None):
+    """Первые limit сделок диапазона дат [from, to] (дни UTC, to — целиком) по возрастанию ID;
+    лимит соблюдается при пагинации. assigned — фильтр по ответственным на стороне Bitrix
+    (filter[ASSIGNED_BY_ID][])."""
+    params = {"select[]": DEAL_FIELDS}
+    if field_from: params[f"filter[>={field_from[0]}]"] = _utc_day(field_from[1])
+    if field_to:   params[f"filter[<{field_to[0]}]"]   = _utc_day(field_to[1] + timedelta(days=1))
+    if max_id:     params["filter[<=ID]"] = int(max_id)
+    if assigned is not None: params["filter[ASSIGNED_BY_ID][]"] = [int(x) for x in assigned]
+    return client.get_all("crm.deal.list", params, keyset=True, limit=limit)
+
+def deals_dual(client, store, start, end, limit=3000, assigned=None):
+    """Сделки, созданные или закрытые в периоде (limit=None — все). store (DealStore) —
+    локальная база: из Bitrix идут только сделки, изменённые после прошлой синхронизации.
+    assigned — только сделки этих ответственных (None — все); пустой набор — нет сделок."""
+    if assigned is not None and not len(assigned):
+        return []
+    if store is not None:
+        store.sync(client)
+        return store.deals_for_period(start, end, limit=limit, assigned=assigned)
+    created = deals_by_date(client, ("DATE_CREATE", start), ("DATE_CREATE", end), limit=limit, assigned=assigned)
+    # Если созданных уже limit, сделки закрытия с ID выше последнего в итог не попадут
+    max_id = int(created[-1]["ID"]) if limit and len(created) >= limit else None
+    closed  = deals_by_date(client, ("CLOSEDATE",  start), ("CLOSEDATE",  end), limit=limit, max_id=max_id,
+                            assigned=assigned)
+    by_id = {}
+    for r in created + closed:
+        by_id[int(r["ID"])] = r
+    out = [by_id[k] for k in sorted(by_id.keys())][:limit]
+    return out
+
+def categories(client):
+    try:
+        cats = client.get_all("crm.dealcategory.list")
+        return {int(c["ID"]): c.get("NAME","Воронка") for c in cats}
+    except Exception:
+        try:
+            cats = client.get_all("crm.category.list")
+            return {int(c["ID"]): c.get("NAME","Воронка") for c in cats}
+        except Exception:
+            return {}
+
+def stage_map_by_category(client, category_ids):
+    sort_map, name_map = {}, {}
+    if not category_ids:
+        return sort_map, name_map
+    cids = sorted(set(int(x) for x in category_ids if pd.notna(x)))
+    try:
+        by_cat = client.batch_get_all({f"c{cid}": ("crm.dealcategory.stage.list", {"id": cid}) for cid in cids})
+    except Exception:
+        by_cat = {}
+    for cid in cids:
+        for s in by_cat.get(f"c{cid}", []):
+            sid = s.get("STATUS_ID") or s.get("ID")
+            if not sid: continue
+            sort_map[sid] = int(s.get("SORT", 5000))
+            name_map[sid] = s.get("NAME") or sid
+    if not name_map:
+        try:
+            base = client.get_all("crm.status.list", {"filter[ENTITY_ID]":"DEAL_STAGE"})
+            for s in base:
+                sid = s.get("STATUS_ID")
+                if not sid: continue
+                sort_map[sid] = int(s.get("SORT", 5000))
+                name_map[sid] = s.get("NAME") or sid
+        except Exception:
+            pass
+    return sort_map, name_map
+
+def departments(client):
+    try:
+        return client.get_all("department.get", {})
+    except:
+        return []
+
+def users_full(client):
+    users = client.get_all("user.get", {})
+    out = {}
+    for u in users:
+        depts = u.get("UF_DEPARTMENT") or []
+        if isinstance(depts, str):
+            depts = [int(x) for x in depts.split(",") if x]
+        out[int(u["ID"])] = {
+            "name": ((u.get("NAME","")+" "+u.get("LAST_NAME","")).strip() or u.get("LOGIN","")).strip(),
+            "depts": list(map(int, depts)) if depts else [],
+            "active": (u.get("ACTIVE","Y")=="Y")
+        }
+    return out
+
+def fetch_activities(client, deal_ids):
+    """Все активности (открытые и завершённые) указанных сделок: {deal_id: [...]}."""
+    out = {}
+    if not deal_ids: return out
+    chunks = np.array_split(list(map(int, deal_ids)), max(1, len(deal_ids)//40 + 1))
+    commands = {f"c{i}": ("crm.activity.list", {
+        "filter[OWNER_TYPE_ID]":2, "filter[OWNER_ID][]":[int(x) for x in chunk]
+    }) for i, chunk in enumerate(chunks)}
+    # без try/except: исчерпанные повторы не должны кэшироваться как «нет активностей»
+    for acts in client.batch_get_all(commands, keyset=True).values():
+        for a in acts:
+            out.setdefault(int(a["OWNER_ID"]), []).append(a)
+    return out
+
+def activities(client, cache, deal_versions, include_completed=True):
+    """deal_versions: {ID: версия сделки}. Активности кэшируются по каждой сделке отдельно
+    (cache — ActivityCache), в Bitrix уходят только новые, изменённые или устаревшие сделки."""
+    acts = cache.get_many(deal_versions, lambda ids: fetch_activities(client, ids))
+    if not include_completed:
+        acts = {k: [a for a in v if a.get("COMPLETED") != "Y"] for k, v in acts.items()}
+    return {k: v for k, v in acts.items() if v}
+
+def stage_history(client, store, deal_ids, since):
+    """История стадий всех сделок: массовая загрузка с даты since в локальную базу
+    (store — HistoryStore; далее — только новые записи), без цикла по сделкам.
+    Сделки без записи создания (созданы раньше since) догружаются по ID — иначе
+    у старых проваленных сделок нет предыдущего этапа."""
+    if not deal_ids: return {}
+    store.sync(client, since)
+    history = store.for_deals(deal_ids)
+    partial = [int(d) for d in deal_ids if not any(str(h.get("TYPE_ID")) == "1" for h in history.get(int(d), ()))]
+    if partial and store.backfill(client, partial):
+        history = store.for_deals(deal_ids)
+    return history
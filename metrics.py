@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Замеры производительности дашборда — без Streamlit.
+Recorder — этапы одного прогона (span): время, запросы к Bitrix, байты, повторы и
+результат кэша (memory — кэш процесса, shared — общий кэш, miss — загрузка из Bitrix).
+Registry — накопленные итоги процесса: гистограмма времени по этапам и счётчики,
+экспорт в JSON и текстовый формат Prometheus; serve() отдаёт их по HTTP (/metrics).
+
+Этапы внутри библиотечного кода (pipeline) — metrics.span(...): пишет в активный
+Recorder потока или ничего не делает, если замер не включён (бенчмарки, precompute).
+"""
+
+import json, threading, time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CLIENT_FIELDS = ("requests", "bytes", "retries", "seconds")
+_local = threading.local()
+
+
+class Recorder:
+    """Этапы одного прогона скрипта. client — BitrixClient: его счётчики до/после этапа
+    дают запросы, байты, повторы и время HTTP (при параллельных сессиях — с их запросами)."""
+
+    def __init__(self, client=None, registry=None):
+        self.client, self.registry = client, registry
+        self.spans, self._open = [], []
+        self.t0 = time.perf_counter()
+
+    def activate(self):
+        """Делает этот Recorder текущим для потока: его пишут metrics.span/metrics.mark."""
+        _local.recorder = self
+        return self
+
+    @contextmanager
+    def span(self, name, kind="compute"):
+        s = {"name": name, "kind": kind, "depth": len(self._open), "start": time.perf_counter() - self.t0,
+             "seconds": 0.0, "requests": 0, "bytes": 0, "retries": 0, "http_seconds": 0.0, "cache": ""}
+        before = self.client.counters() if self.client else None
+        self._open.append(s)
+        try:
+            yield s
+        finally:
+            s["seconds"] = time.perf_counter() - self.t0 - s["start"]
+            self._open.pop()
+            if before:
+                after = self.client.counters()
+                for k in ("requests", "bytes", "retries"):
+                    s[k] = after[k] - before[k]
+                s["http_seconds"] = after["seconds"] - before["seconds"]
+            if kind == "bitrix" and not s["cache"]:
+                s["cache"] = "memory"  # тело загрузчика не выполнялось — ответ из кэша процесса
+            self.spans.append(s)
+            if self.registry:
+                self.registry.observe(s)
+
+    def mark(self, cache):
+        """Результат кэша для открытого этапа (вызывается из тела загрузчика)."""
+        if self._open:
+            self._open[-1]["cache"] = cache
+
+    def table(self):
+        """Этапы в порядке начала; вложенные — с отступом."""
+        return [{"этап": "  " * s["depth"] + s["name"], "тип": s["kind"], "сек": round(s["seconds"], 3),
+                 "запросов": s["requests"], "КБ": round(s["bytes"] / 1024, 1), "повторов": s["retries"],
+                 "кэш": s["cache"]} for s in sorted(self.spans, key=lambda s: s["start"])]
+
+    def finish(self):
+        if self.registry:
+            self.registry.add_run(sorted(self.spans, key=lambda s: s["start"]))
+
+
+def current():
+    return getattr(_local, "recorder", None)
+
+def span(name, kind="compute"):
+    rec = current()
+    return rec.span(name, kind) if rec else nullcontext({})
+
+def mark(cache):
+    rec = current()
+    if rec:
+        rec.mark(cache)
+
+
+class Registry:
+    """Итоги процесса по этапам (name, kind) и последние keep прогонов. Потокобезопасен:
+    пишут все сессии процесса."""
+
+    def __init__(self, keep=20):
+        self.totals = {}
+        self.runs = deque(maxlen=keep)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, s):
+        with self._lock:
+            t = self.totals.setdefault((s["name"], s["kind"]), {
+                "count": 0, "seconds": 0.0, "buckets": [0] * len(BUCKETS),
+                "requests": 0, "bytes": 0, "retries": 0, "http_seconds": 0.0, "cache": Counter()})
+            t["count"] += 1
+            t["seconds"] += s["seconds"]
+            for i, le in enumerate(BUCKETS):
+                if s["seconds"] <= le:
+                    t["buckets"][i] += 1
+            for k in ("requests", "bytes", "retries", "http_seconds"):
+                t[k] += s[k]
+            if s["cache"]:
+                t["cache"][s["cache"]] += 1
+
+    def add_run(self, spans):
+        with self._lock:
+            self.runs.append({"at": time.time(), "spans": spans})
+
+    def to_json(self):
+        with self._lock:
+            totals = [{"name": n, "kind": k, **{f: v for f, v in t.items() if f not in ("buckets", "cache")},
+                       "cache": dict(t["cache"])} for (n, k), t in self.totals.items()]
+            return {"started": self.started, "totals": totals, "runs": list(self.runs)}
+
+    def prometheus(self):
+        """Текстовый формат Prometheus 0.0.4: гистограмма времени этапов и счётчики Bitrix/кэша."""
+        def labels(name, kind, **extra):
+            esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in {"name": name, "kind": kind, **extra}.items()) + "}"
+        with self._lock:
+            items = sorted(self.totals.items())
+            out = ["# HELP burmash_span_seconds Время этапа дашборда (загрузка, расчёт, отрисовка).",
+                   "# TYPE burmash_span_seconds histogram"]
+            for (n, k), t in items:
+                for le, c in zip(BUCKETS, t["buckets"]):
+                    out.append(f"burmash_span_seconds_bucket{labels(n, k, le=le)} {c}")
+                out.append(f"burmash_span_seconds_bucket{labels(n, k, le='+Inf')} {t['count']}")
+                out.append(f"burmash_span_seconds_sum{labels(n, k)} {t['seconds']:.6f}")
+                out.append(f"burmash_span_seconds_count{labels(n, k)} {t['count']}")
+            for metric, field, help_ in (("bitrix_requests_total", "requests", "HTTP-запросы к Bitrix24 за этап."),
+                                         ("bitrix_bytes_total", "bytes", "Байты ответов Bitrix24 за этап."),
+                                         ("bitrix_retries_total", "retries", "Повторы запросов к Bitrix24 за этап."),
+                                         ("bitrix_http_seconds_total", "http_seconds", "Время HTTP-запросов к Bitrix24 за этап.")):
+                out += [f"# HELP burmash_{metric} {help_}", f"# TYPE burmash_{metric} counter"]
+                out += [f"burmash_{metric}{labels(n, k)} {t[field]}" for (n, k), t in items if k == "bitrix"]
+            out += ["# HELP burmash_cache_total Результат кэша загрузчиков (memory, shared, miss).",
+                    "# TYPE burmash_cache_total counter"]
+            out += [f"burmash_cache_total{labels(n, k, result=r)} {c}"
+                    for (n, k), t in items for r, c in sorted(t["cache"].items())]
+        return "\n".join(out) + "\n"
+
+
+def serve(registry, port=0):
+    """Поднимает /metrics (Prometheus) и /metrics.json в фоновом потоке; возвращает (server, url)."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a): pass
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, ctype = json.dumps(registry.to_json(), ensure_ascii=False).encode(), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, ctype = registry.prometheus().encode(), "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                self.send_response(404); self.send_header("Content-Length", "0"); self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/metrics"
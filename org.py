@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Оргструктура БУРМАШ — без Streamlit.
+OrgIndex строится один раз из department.get и user.get: отдел → массив ID
+сотрудников отдела и всех его подотделов (дерево по PARENT). Фильтр кадра
+по отделам — один isin по массиву, без цикла по пользователям.
+"""
+
+import numpy as np
+
+
+class OrgIndex:
+    def __init__(self, departments, users_full):
+        self.names = {int(d["ID"]): d.get("NAME", "") for d in departments}
+        children = {}
+        for d in departments:
+            parent = d.get("PARENT")
+            if parent not in (None, "", "0", 0):
+                children.setdefault(int(parent), []).append(int(d["ID"]))
+        direct = {}
+        for uid, info in users_full.items():
+            for dep in info["depts"]:
+                direct.setdefault(int(dep), []).append(int(uid))
+        self.subtree = {}
+        for dep in set(self.names) | set(direct):
+            seen, stack = {dep}, [dep]
+            while stack:  # обход вниз; seen — защита от циклов в PARENT
+                for child in children.get(stack.pop(), []):
+                    if child not in seen:
+                        seen.add(child); stack.append(child)
+            self.subtree[dep] = seen
+        self.users = {dep: np.unique(np.array([u for d in sub for u in direct.get(d, [])], dtype="int64"))
+                      for dep, sub in self.subtree.items()}
+
+    def users_in(self, dept_ids):
+        """ID сотрудников выбранных отделов с подотделами — отсортированный массив."""
+        parts = [self.users[int(d)] for d in dept_ids if int(d) in self.users]
+        return np.unique(np.concatenate(parts)) if parts else np.array([], dtype="int64")
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Периоды и временные ряды БУРМАШ.
+— DateIndex: позиции строк, отсортированные по колонке дат; срез периода —
+  два searchsorted, без .dt.date (Python-объект даты на строку).
+— Предыдущий период той же длины, частота агрегации, ряды «текущий/пред.».
+— ts_batch: все ряды дашборда одним groupby на колонку дат.
+Без Streamlit — используется дашбордом и бенчмарками.
+"""
+
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+
+class DateIndex:
+    """Индекс колонки дат (наивные datetime64): order — позиции строк по возрастанию даты,
+    пустые даты не индексируются. Период [start, end] включает оба дня целиком,
+    как .dt.date.between(start, end)."""
+
+    def __init__(self, values, order=None):
+        v = pd.Series(values).to_numpy()
+        if order is None:
+            order = np.argsort(v, kind="stable")  # NaT — в конце
+            order = order[~np.isnat(v[order])]
+        self.size = len(v)
+        self.order = order
+        self.sorted = v[order]
+
+    def _bounds(self, start, end):
+        lo = np.datetime64(pd.Timestamp(start).date(), "D")
+        hi = np.datetime64(pd.Timestamp(end).date(), "D") + 1
+        return self.sorted.searchsorted(lo, "left"), self.sorted.searchsorted(hi, "left")
+
+    def positions(self, start, end):
+        """Позиции строк периода в исходном порядке строк."""
+        lo, hi = self._bounds(start, end)
+        return np.sort(self.order[lo:hi])
+
+    def by_date(self, start, end):
+        """Позиции строк периода по возрастанию даты."""
+        lo, hi = self._bounds(start, end)
+        return self.order[lo:hi]
+
+    def mask(self, start, end):
+        lo, hi = self._bounds(start, end)
+        m = np.zeros(self.size, dtype=bool)
+        m[self.order[lo:hi]] = True
+        return m
+
+    def take(self, df, start, end):
+        return df.iloc[self.positions(start, end)]
+
+
+def previous_period(start, end):
+    length = (end - start).days + 1
+    prev_end = start - timedelta(days=1)
+    prev_start = prev_end - timedelta(days=length-1)
+    return prev_start, prev_end
+
+# Конец месяца: "M" в pandas < 2.2, "ME" — начиная с 2.2 (в pandas 3 "M" уже ошибка)
+MONTH_END = "ME" if tuple(int(x) for x in pd.__version__.split(".")[:2]) >= (2, 2) else "M"
+
+def period_freq(mode):
+    if mode in ("НИТ","Месяц","Неделя","Диапазон дат"): return "D"
+    if mode == "Год": return MONTH_END
+    if mode == "Квартал": return "W-MON"
+    return "D"
+
+def _side(sums, flag, key, agg, as_int, freq):
+    """Ряд одной стороны (текущий/пред. период) в форме resample: сплошные бины
+    от первого до последнего непустого, пустые — 0 (sum/count) или NaN (mean)."""
+    if flag not in sums.index.get_level_values(0):
+        return pd.Series(dtype="float64")
+    s = sums.xs(flag, level="cur")
+    present = s.index[s["n" + key] > 0]
+    if present.empty:
+        return pd.Series(dtype="float64")
+    full = pd.date_range(present.min(), present.max(), freq=freq, name="period")
+    if agg == "count":
+        return s["c" + key].reindex(full, fill_value=0).astype("int64")
+    if agg == "sum":
+        out = s["v" + key].reindex(full, fill_value=0)
+        return out.astype("int64") if as_int else out
+    return (s["v" + key] / s["c" + key]).reindex(full)
+
+def ts_batch(df, specs, start, end, mode, freq_override=None, index=None):
+    """Ряды «текущий/пред. период» для набора спецификаций за один проход.
+    specs: {имя: {"date": колонка дат, "value": колонка, "agg": "sum"|"count"|"mean",
+                  "rows": bool-маска строк df (None — все), "by": колонка группировки,
+                  "groups": значения by в нужном порядке}}.
+    На каждую колонку дат — один groupby по (период, бин частоты) со всеми
+    спецификациями сразу; index — готовые {колонка: DateIndex}.
+    Возвращает {имя: кадр period/value/prev_value} (для by — ещё колонка by),
+    те же кадры, что ts_with_prev по соответствующему поднабору."""
+    freq = freq_override or period_freq(mode)
+    pstart, pend = previous_period(start, end)
+    index = dict(index or {})
+    by_date, out = {}, {}
+    for name, spec in specs.items():
+        by_date.setdefault(spec["date"], []).append(name)
+    for date_col, names in by_date.items():
+        if date_col not in index:
+            index[date_col] = DateIndex(df[date_col])
+        # строки уже по возрастанию даты — группировщику не нужно сортировать
+        cur, prev = index[date_col].by_date(start, end), index[date_col].by_date(pstart, pend)
+        rows = np.concatenate([prev, cur])
+        cols = {"cur": np.repeat([False, True], [len(prev), len(cur)]),
+                "period": df[date_col].to_numpy()[rows]}
+        parts = []  # (имя, группа, ключ колонок)
+        for name in names:
+            spec = specs[name]
+            base = np.ones(len(df), dtype=bool) if spec.get("rows") is None else np.asarray(spec["rows"], dtype=bool)
+            groups = spec.get("groups") or (list(pd.unique(df.loc[base, spec["by"]])) if spec.get("by") else [None])
+            values = df[spec["value"]]
+            for g in groups:
+                m = base if g is None else base & (df[spec["by"]] == g).to_numpy()
+                key = str(len(parts))
+                mr = m[rows]
+                cols["n" + key] = mr                                    # строки поднабора → границы бинов
+                cols["c" + key] = mr & values.notna().to_numpy()[rows]  # непустые значения → count/mean
+                if spec["agg"] != "count":
+                    cols["v" + key] = np.where(mr, values.to_numpy(dtype="float64", na_value=np.nan)[rows], np.nan)
+                parts.append((name, g, key, m.any()))
+        sums = pd.DataFrame(cols).groupby(["cur", pd.Grouper(key="period", freq=freq)]).sum()
+        frames = {}
+        for name, g, key, any_rows in parts:
+            spec = specs[name]
+            if not any_rows:  # пустой поднабор — как ts_with_prev по пустому кадру
+                ts = pd.DataFrame(columns=["period","value","prev_value"])
+            else:
+                as_int = spec["agg"] == "sum" and not pd.api.types.is_float_dtype(df[spec["value"]])
+                cur_s = _side(sums, True, key, spec["agg"], as_int, freq).rename("value")
+                prev_s = _side(sums, False, key, spec["agg"], as_int, freq).rename("prev_value")
+                ts = pd.concat([cur_s, prev_s], axis=1, sort=True).fillna(0)
+                ts.index.name = "period"
+                ts = ts.reset_index()
+            if g is not None:
+                ts[spec["by"]] = g
+            frames.setdefault(name, []).append(ts)
+        for name, group_frames in frames.items():
+            out[name] = group_frames[0] if len(group_frames) == 1 else pd.concat(group_frames, ignore_index=True)
+    return out
+
+def ts_with_prev(df, date_col, value_col, start, end, mode, agg="sum", freq_override=None, index=None):
+    """Ряд value_col за период и за предыдущий период той же длины.
+    index — готовый DateIndex по df[date_col] (иначе строится здесь)."""
+    if df.empty:
+        return pd.DataFrame(columns=["period","value","prev_value"])
+    spec = {"date": date_col, "value": value_col, "agg": agg}
+    return ts_batch(df, {"ts": spec}, start, end, mode, freq_override,
+                    index=None if index is None else {date_col: index})["ts"]
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Сборка кадра сделок БУРМАШ из загруженных данных — без Streamlit.
+Этапы: сырой кадр → скоринг → стадии/менеджеры/воронки → успех/провал →
+античит → этап провала по истории → компактная схема.
+Дашборд, фоновые задачи и бенчмарки собирают кадр одними и теми же функциями.
+Выручка плана/факта: вклад успешных сделок по месяцам (revenue_rows) — из кадра
+или прямо из сделок crm.deal.list, без скоринга.
+"""
+
+import hashlib, json
+import numpy as np
+import pandas as pd
+
+import metrics
+
+from scoring import (SUCCESS_NAME_BY_CAT, to_dt_col, compute_health_scores, is_failure_reason, failure_group,
+                     cheat_flags, CHEAT_RESCHEDULES, CHEAT_MICRO_TASKS, compact_scored, _num_col)
+
+HISTORY_TIME_COLS = ["CREATED_TIME","CREATED","CHANGED_TIME","DATE_CREATE"]
+NUMERIC_FIELDS = ["OPPORTUNITY","PROBABILITY","ASSIGNED_BY_ID","COMPANY_ID","CONTACT_ID","CATEGORY_ID"]
+FALLBACK_ORDER = ["NEW","NEW_LEAD","PREPARATION","PREPAYMENT_INVOICE","EXECUTING","FINAL_INVOICE","WON","LOSE"]
+
+
+def deals_frame(deals):
+    """Сделки crm.deal.list → кадр с числовыми колонками."""
+    df_raw = pd.DataFrame(deals)
+    for c in NUMERIC_FIELDS:
+        df_raw[c] = pd.to_numeric(df_raw.get(c), errors="coerce")
+    return df_raw
+
+def deal_versions(deals):
+    """{ID: версия} для кэша активностей: меняется вместе со сделкой или её активностью."""
+    return {int(d["ID"]): f"{d.get('DATE_MODIFY')}|{d.get('LAST_ACTIVITY_TIME')}" for d in deals}
+
+def raw_version(deals, activities, history_raw, *refs):
+    """Версия исходных данных для кэша производного кадра: версии сделок, активности
+    (ID, LAST_UPDATED, DEADLINE — перенос срока меняет версию при том же числе задач),
+    ID записей истории, справочники (refs — небольшие dict). Дёшево по сравнению с хэшем кадров."""
+    h = hashlib.md5()
+    for d in deals:
+        h.update(f"{d.get('ID')}|{d.get('DATE_MODIFY')}|{d.get('LAST_ACTIVITY_TIME')};".encode())
+    for did in sorted(activities):
+        h.update((f"a{did}:" + "".join([f"{a.get('ID')}|{a.get('LAST_UPDATED')}|{a.get('DEADLINE')};"
+                                        for a in activities[did] or ()])).encode())
+    for did in sorted(history_raw):
+        h.update((f"h{did}:" + ",".join([str(r.get("ID")) for r in history_raw[did] or ()])).encode())
+    for ref in refs:
+        h.update(json.dumps(ref, sort_keys=True, default=str, ensure_ascii=False).encode())
+    return h.hexdigest()
+
+def fallback_sort(sid):
+    sid = str(sid or ""); sid_short = sid.split(":")[1] if ":" in sid else sid
+    return (FALLBACK_ORDER.index(sid_short)*100 if sid_short in FALLBACK_ORDER else 10000 + hash(sid_short)%1000)
+
+def add_stages(df_all, users_map, categories, sort_map, name_map):
+    """Этап/менеджер/воронка и признаки успеха/провала."""
+    df_all["stage_sort"] = df_all["STAGE_ID"].map(lambda s: sort_map.get(str(s), fallback_sort(s)))
+    df_all["stage_name"] = df_all["STAGE_ID"].map(lambda s: name_map.get(str(s), str(s)))
+    df_all["manager"]    = df_all["ASSIGNED_BY_ID"].map(users_map).fillna("Неизвестно")
+    df_all["category"]   = df_all["CATEGORY_ID"].map(lambda x: categories.get(int(x or 0), "Воронка") if pd.notna(x) else "Воронка")
+    df_all["cat_norm"]   = df_all["category"].map(lambda x: str(x or "").strip().casefold())
+
+    # Успех/провал
+    df_all["is_success"] = (df_all["cat_norm"].map(SUCCESS_NAME_BY_CAT) == df_all["stage_name"]).to_numpy(dtype=bool)
+    df_all["is_fail"]    = df_all["stage_name"].map(is_failure_reason)
+    df_all["fail_group"] = df_all["stage_name"].map(failure_group)
+    return df_all
+
+def add_cheat(df_all, activities):
+    """Античит: все активности одним кадром, один groupby по сделке."""
+    cheat = cheat_flags(activities)
+    df_all["reschedules"] = df_all["ID"].map(cheat["reschedules"]).fillna(0).astype(int)
+    df_all["micro_tasks"] = df_all["ID"].map(cheat["micro_tasks"]).fillna(0).astype(int)
+    df_all["cheat_flag"]  = (df_all["reschedules"]>=CHEAT_RESCHEDULES) | (df_all["micro_tasks"]>=CHEAT_MICRO_TASKS)
+    return df_all
+
+def history_frame(history_raw):
+    """{deal_id: [записи crm.stagehistory.list]} → один кадр DEAL_ID/STAGE_ID/TS,
+    по сделке и времени (UTC). Время — первая из HISTORY_TIME_COLS, заполненная у сделки."""
+    rows = [(did, r) for did, items in history_raw.items() for r in items]
+    if not rows:
+        return pd.DataFrame(columns=["DEAL_ID","STAGE_ID","TS"])
+    h = pd.DataFrame([r for _, r in rows])
+    h["DEAL_ID"] = np.fromiter((did for did, _ in rows), dtype="int64", count=len(rows))
+    if "STAGE_ID" not in h.columns:
+        h["STAGE_ID"] = h["STATUS_ID"] if "STATUS_ID" in h.columns else None
+    ts = pd.Series(pd.NaT, index=h.index, dtype="datetime64[ns]")
+    taken = pd.Series(False, index=h.index)
+    for c in [c for c in HISTORY_TIME_COLS if c in h.columns]:
+        has = h[c].notna().groupby(h["DEAL_ID"]).transform("any") & ~taken
+        ts[has] = to_dt_col(h.loc[has, c])
+        taken |= has
+    h = h.assign(TS=ts).dropna(subset=["TS"])
+    return h.sort_values(["DEAL_ID","TS"], kind="stable")[["DEAL_ID","STAGE_ID","TS"]].reset_index(drop=True)
+
+def add_fail_stage(df_all, history, name_map):
+    """Этап, с которого сделка ушла в провал (предпоследняя запись истории)."""
+    if history is not None and not history.empty:
+        prev = history.groupby("DEAL_ID").nth(-2).set_index("DEAL_ID")["STAGE_ID"]
+        fail_from_stage = prev.map(lambda sid: name_map.get(str(sid), str(sid)))
+        df_all["fail_from_stage_hist"] = df_all["ID"].map(fail_from_stage)
+    else:
+        df_all["fail_from_stage_hist"] = np.nan
+    return df_all
+
+def build_deals_frame(df_raw, activities, users_map, categories, sort_map, name_map,
+                      history=None, stuck_days=5, now=None):
+    """Все этапы подряд: кадр сделок дашборда в компактной схеме."""
+    with metrics.span("compute_health_scores"):
+        df_all = compute_health_scores(df_raw, {k:v for k,v in activities.items() if v}, stuck_days=stuck_days, now=now)
+    with metrics.span("add_stages"):
+        df_all = add_stages(df_all, users_map, categories, sort_map, name_map)
+    with metrics.span("add_cheat"):
+        df_all = add_cheat(df_all, activities)
+    with metrics.span("add_fail_stage"):
+        df_all = add_fail_stage(df_all, history, name_map)
+    with metrics.span("compact_scored"):
+        return compact_scored(df_all)
+
+
+# ============ Выручка по месяцам (план/факт) ============
+REVENUE_COLS = ["ID", "year", "month", "cat_norm", "ASSIGNED_BY_ID", "OPPORTUNITY"]
+
+def revenue_frame(deals, categories, name_map):
+    """Сделки crm.deal.list → кадр для revenue_rows теми же правилами, что add_stages
+    и compute_health_scores (воронка, название стадии, успех, даты UTC, сумма)."""
+    df = pd.DataFrame(deals, columns=["ID", "STAGE_ID", "CATEGORY_ID", "ASSIGNED_BY_ID", "OPPORTUNITY",
+                                      "CLOSEDATE", "DATE_MODIFY"])
+    cat_norm = df["CATEGORY_ID"].map(lambda x: categories.get(int(x or 0), "Воронка") if pd.notna(x) else "Воронка")
+    cat_norm = cat_norm.map(lambda x: str(x or "").strip().casefold())
+    stage_name = df["STAGE_ID"].map(lambda s: name_map.get(str(s), str(s)))
+    return pd.DataFrame({
+        "ID": pd.to_numeric(df["ID"], errors="coerce").astype("int64"),
+        "cat_norm": cat_norm,
+        "is_success": (cat_norm.map(SUCCESS_NAME_BY_CAT) == stage_name).to_numpy(dtype=bool),
+        "ASSIGNED_BY_ID": _num_col(df, "ASSIGNED_BY_ID", 0.0).astype(np.int64),
+        "OPPORTUNITY": _num_col(df, "OPPORTUNITY", 0.0),
+        "CLOSEDATE": to_dt_col(df["CLOSEDATE"]),
+        "DATE_MODIFY": to_dt_col(df["DATE_MODIFY"]),
+    })
+
+def revenue_rows(df):
+    """Вклад сделок в выручку плана/факта: успешные сделки (SUCCESS_NAME_BY_CAT), месяц —
+    по CLOSEDATE, без неё — по DATE_MODIFY. df — кадр сделок дашборда или revenue_frame."""
+    succ = df[df["is_success"].to_numpy(dtype=bool) & df["cat_norm"].isin(list(SUCCESS_NAME_BY_CAT)).to_numpy()]
+    rev_date = succ["CLOSEDATE"].fillna(succ["DATE_MODIFY"])
+    out = pd.DataFrame({
+        "ID": succ["ID"].astype("int64"), "year": rev_date.dt.year, "month": rev_date.dt.month,
+        "cat_norm": succ["cat_norm"].astype(str), "ASSIGNED_BY_ID": succ["ASSIGNED_BY_ID"].astype("int64"),
+        "OPPORTUNITY": succ["OPPORTUNITY"].astype(float),
+    })
+    return out[out["year"].notna()].astype({"year": "int64", "month": "int64"})[REVENUE_COLS].reset_index(drop=True)
+
+def revenue_months(rows):
+    """Вклады → агрегат месяц × воронка × менеджер: сумма и число сделок."""
+    return (rows.groupby(["year", "month", "cat_norm", "ASSIGNED_BY_ID"], as_index=False)
+                .agg(amount=("OPPORTUNITY", "sum"), deals=("ID", "size")))
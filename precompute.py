@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновая предрасчётка снимков дашборда БУРМАШ (без Streamlit), для cron/systemd:
+
+    BITRIX24_WEBHOOK=https://.../rest/1/xxx/ python precompute.py --dir .cache/snapshots
+    python precompute.py --dir .cache/snapshots --every 900      # цикл: снимок каждые 15 минут
+
+Дашборд с SNAPSHOT_DIR в Secrets читает последний снимок, если период попадает в его окно.
+Настройки — из окружения (как Secrets дашборда) или аргументов.
+"""
+
+import argparse, os, sys, time
+from datetime import datetime
+
+import snapshot
+from bitrix import BitrixClient
+
+
+def run_once(args):
+    client = BitrixClient(args.webhook, max_workers=args.workers, rate=args.rate, burst=args.burst)
+    try:
+        df, meta = snapshot.build(client, store_path=args.store, days=args.days,
+                                  stuck_days=args.stuck_days, use_history=not args.no_history)
+    finally:
+        client.close()
+    version = snapshot.write(args.dir, df, meta, keep=args.keep)
+    stages = ", ".join(f"{k} {v:.1f}с" for k, v in meta["timings"].items())
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} снимок {version}: {meta['rows']} сделок, "
+          f"окно {meta['window'][0]} → {meta['window'][1]} ({stages})", flush=True)
+
+
+def main():
+    env = os.environ.get
+    ap = argparse.ArgumentParser(description="Снимки кадра сделок для дашборда")
+    ap.add_argument("--webhook", default=(env("BITRIX24_WEBHOOK") or "").strip())
+    ap.add_argument("--dir", default=env("SNAPSHOT_DIR") or ".cache/snapshots", help="каталог снимков")
+    ap.add_argument("--store", default=env("DEAL_STORE_PATH", ".cache/deals.sqlite"),
+                    help='локальная база сделок/активностей/истории ("" — в памяти)')
+    ap.add_argument("--days", type=int, default=400, help="окно снимка, дней до сегодня")
+    ap.add_argument("--stuck-days", type=int, default=5, help="порог «нет активности» в снимке")
+    ap.add_argument("--no-history", action="store_true", help="без истории стадий")
+    ap.add_argument("--keep", type=int, default=5, help="сколько версий хранить")
+    ap.add_argument("--every", type=int, default=0, help="повторять каждые N секунд (0 — один раз)")
+    ap.add_argument("--workers", type=int, default=int(env("BITRIX24_MAX_WORKERS") or 4))
+    ap.add_argument("--rate", type=float, default=float(env("BITRIX24_RATE") or 2))
+    ap.add_argument("--burst", type=int, default=int(env("BITRIX24_BURST") or 50))
+    args = ap.parse_args()
+    if not args.webhook:
+        sys.exit("Не указан BITRIX24_WEBHOOK (окружение или --webhook)")
+    while True:
+        t = time.monotonic()
+        try:
+            run_once(args)
+        except Exception as e:
+            if not args.every:
+                raise
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} ошибка: {e}", file=sys.stderr, flush=True)
+        if not args.every:
+            break
+        time.sleep(max(0, args.every - (time.monotonic() - t)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Скоринг сделок БУРМАШ: здоровье/потенциал/флаги, причины провалов, античит.
+Без Streamlit — используется дашбордом, фоновыми задачами и бенчмарками.
+"""
+
+import numpy as np
+import pandas as pd
+
+# ============ Константы ============
+CAT_MAIN   = "основная воронка продаж"
+CAT_PHYS   = "физ.лица"
+CAT_LOW    = "не приоритетные сделки"
+SUCCESS_NAME_BY_CAT = {
+    CAT_MAIN: "Успешно реализовано",
+    CAT_PHYS: "Сделка успешна",
+    CAT_LOW:  "Сделка успешна",
+}
+FAIL_GROUP1 = {
+    "Недозвон","Не абонент","СПАМ","Нецелевой","Дорого","Организация не действует","Был конфликт",
+    "Не одобрили отсрочку платежа","Не устроили сроки","Сделка отменена клиентом","Удалено из неразобр. Авито"
+}
+FAIL_GROUP2 = {
+    "Выбрали конкурентов","Дорого","Был конфликт","Не одобрили отсрочку платежа","Не устроили сроки","Сделка отменена клиентом"
+}
+
+# ============ Даты ============
+def to_dt(x):
+    try:
+        ts = pd.to_datetime(x, utc=True, errors="coerce")
+        if pd.isna(ts): return pd.NaT
+        return ts.tz_convert(None)
+    except:
+        return pd.NaT
+
+def to_dt_col(values):
+    """Колоночный to_dt: ISO8601 одним проходом, нестандартные строки — поэлементным разбором."""
+    s = pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values.astype(object)
+    ts = pd.to_datetime(s, utc=True, errors="coerce", format="ISO8601")
+    bad = ts.isna() & s.notna() & (s.astype(str).str.strip() != "")
+    if bad.any():
+        ts[bad] = pd.to_datetime(s[bad], utc=True, errors="coerce", format="mixed")
+    return ts.dt.tz_convert(None)
+
+# ============ Безопасные численные преобразования ============
+def safe_float(x, default=0.0):
+    try:
+        v = float(x)
+        if np.isnan(v) or np.isinf(v):
+            return default
+        return v
+    except Exception:
+        return default
+
+def clamp(v, lo, hi):
+    try:
+        v = float(v)
+        if np.isnan(v) or np.isinf(v):
+            return lo
+    except Exception:
+        return lo
+    return max(lo, min(hi, v))
+
+# ============ Скоринг/метки ============
+def _num_col(df, col, default):
+    """Колоночный safe_float: нечисловое/NaN/inf → default."""
+    if col not in df.columns:
+        return pd.Series(default, index=df.index, dtype=float)
+    v = pd.to_numeric(df[col], errors="coerce").astype(float)
+    return v.where(np.isfinite(v), default)
+
+def _days_col(later, earlier):
+    """Целые дни между датами (не меньше 0), пропуски → 0."""
+    d = np.trunc((later - earlier) / pd.Timedelta(days=1))
+    return d.clip(lower=0).fillna(0).astype(int)
+
+def _health(no_company, no_contact, no_tasks, stuck, lost):
+    """Здоровье по флагам: штрафы от 100, проигранная сделка — не выше 15."""
+    score = (100 - 10*no_company - 10*no_contact - 25*no_tasks - 25*stuck).astype(int)
+    return score.where(~lost, np.minimum(score, 15)).clip(0, 100).astype(int)
+
+def compute_health_scores(df, open_tasks_map, stuck_days=5, now=None):
+    """Здоровье, потенциал, флаги и счётчики дней по всем сделкам — колоночно (без iterrows).
+    Поведение совпадает с прежней построчной версией, включая её особенности:
+    пустые LAST_ACTIVITY_TIME/BEGINDATE не подменяются DATE_MODIFY/DATE_CREATE
+    (в `to_dt(...) or ...` NaT истинно), а дни от пустой даты равны 0."""
+    now = to_dt(pd.Timestamp.utcnow()) if now is None else now
+    df = df.reset_index(drop=True)
+    get = lambda col, default: df[col] if col in df.columns else pd.Series(default, index=df.index, dtype=object)
+
+    create_dt = to_dt_col(get("DATE_CREATE", None))
+    last      = to_dt_col(get("LAST_ACTIVITY_TIME", None))
+    begin_dt  = to_dt_col(get("BEGINDATE", None))
+
+    d_work  = _days_col(now, create_dt)
+    d_noact = _days_col(now, last)
+    d_stage = _days_col(now, begin_dt)
+
+    ids = _num_col(df, "ID", 0.0).astype(np.int64)
+    with_tasks = {int(k) for k, v in open_tasks_map.items() if len(v) > 0}
+
+    flag_no_company = np.trunc(_num_col(df, "COMPANY_ID", 0.0)) == 0
+    flag_no_contact = np.trunc(_num_col(df, "CONTACT_ID", 0.0)) == 0
+    flag_no_tasks   = ~ids.isin(with_tasks)
+    flag_stuck      = d_noact >= stuck_days
+    flag_lost       = get("STAGE_ID", "").astype(str).str.upper().str.contains("LOSE", regex=False)
+
+    health = _health(flag_no_company, flag_no_contact, flag_no_tasks, flag_stuck, flag_lost)
+
+    # Потенциал (устойчиво к NaN/inf)
+    opp  = _num_col(df, "OPPORTUNITY", 0.0)
+    prob = _num_col(df, "PROBABILITY", 0.0).clip(0.0, 100.0)
+    opp_boost = 30 + np.minimum(70, np.log10(np.maximum(1.0, opp)) / 5.0 * 70.0)
+    prob_coef = 0.4 + (prob/100.0)*0.6
+    potential = np.round(opp_boost * prob_coef).clip(0, 100).where(opp > 0, 0).astype(int)
+
+    return pd.DataFrame({
+        "ID": ids,
+        "TITLE": get("TITLE", ""),
+        "ASSIGNED_BY_ID": _num_col(df, "ASSIGNED_BY_ID", 0.0).astype(np.int64),
+        "STAGE_ID": get("STAGE_ID", ""),
+        "CATEGORY_ID": _num_col(df, "CATEGORY_ID", np.nan),
+        "OPPORTUNITY": opp,
+        "PROBABILITY": prob,
+        "DATE_CREATE": create_dt,
+        "DATE_MODIFY": to_dt_col(get("DATE_MODIFY", None)),
+        "LAST_ACTIVITY_TIME": last,
+        "BEGINDATE": begin_dt,
+        "CLOSEDATE": to_dt_col(get("CLOSEDATE", None)),
+        "SEMANTIC": get("STAGE_SEMANTIC_ID", "").fillna("").astype(str).str.upper(),
+        "days_in_work": d_work,
+        "days_no_activity": d_noact,
+        "days_on_stage": d_stage,
+        "health": health,
+        "potential": potential,
+        "flag_no_company": flag_no_company,
+        "flag_no_contact": flag_no_contact,
+        "flag_no_tasks": flag_no_tasks,
+        "flag_stuck": flag_stuck,
+        "flag_lost": flag_lost,
+    })
+
+def apply_stuck_days(df, stuck_days):
+    """Другой порог «нет активности»: пересчёт flag_stuck и health по days_no_activity,
+    без повторного скоринга. Остальные колонки не меняются."""
+    stuck = df["days_no_activity"] >= stuck_days
+    health = _health(df["flag_no_company"], df["flag_no_contact"], df["flag_no_tasks"], stuck, df["flag_lost"])
+    return df.assign(flag_stuck=stuck, health=health.astype(df["health"].dtype))
+
+def is_failure_reason(stage_name):
+    name = str(stage_name or "")
+    return (name in FAIL_GROUP1) or (name in FAIL_GROUP2)
+def failure_group(stage_name):
+    name = str(stage_name or "")
+    if name in FAIL_GROUP1: return "Группа 1 (ранние этапы)"
+    if name in FAIL_GROUP2: return "Группа 2 (поздние этапы)"
+    return "Прочее"
+
+# ============ Античит ============
+CHEAT_RESCHEDULES = 3   # переносов дедлайна на сделку
+CHEAT_MICRO_TASKS = 5   # задач ≤15 минут на сделку
+
+def cheat_flags(activities):
+    """Эвристики обхода системы по всем сделкам за один проход:
+    reschedules — переносы дедлайнов (уникальные дни DEADLINE по SUBJECT, минус один);
+    micro_tasks — задачи ≤15 минут. activities: {deal_id: [активности]}.
+    Возвращает DataFrame с индексом deal_id (только сделки с активностями)."""
+    cols = ["SUBJECT", "DEADLINE", "START_TIME", "END_TIME"]
+    owners = [int(k) for k, acts in activities.items() for _ in (acts or [])]
+    if not owners:
+        return pd.DataFrame({"reschedules": pd.Series(dtype=int), "micro_tasks": pd.Series(dtype=int)})
+    df = pd.DataFrame.from_records([a for acts in activities.values() for a in (acts or [])], columns=cols)
+    df["owner"] = owners
+    for col in ["DEADLINE", "START_TIME", "END_TIME"]:
+        df[col] = to_dt_col(df[col])
+
+    # Переносы дедлайна (по SUBJECT → уникальные дни DEADLINE)
+    dl = df[df["DEADLINE"].notna() & df["SUBJECT"].notna()]
+    uniq = dl.assign(day=dl["DEADLINE"].dt.floor("D")).groupby(["owner", "SUBJECT"])["day"].nunique()
+    reschedules = (uniq - 1).clip(lower=0).groupby(level="owner").sum()
+
+    # Микро-задачи (<= 15 минут)
+    timed = df[df["START_TIME"].notna() & df["END_TIME"].notna()]
+    micro = ((timed["END_TIME"] - timed["START_TIME"]).dt.total_seconds() / 60.0 <= 15).groupby(timed["owner"]).sum()
+
+    out = pd.DataFrame(index=pd.Index(sorted(set(owners)), name="owner"))
+    out["reschedules"] = reschedules.reindex(out.index, fill_value=0).astype(int)
+    out["micro_tasks"] = micro.reindex(out.index, fill_value=0).astype(int)
+    return out
+
+# ============ Компактная схема кадра сделок ============
+SCORED_INTS = {  # узкие целые; дни обрезаются по границе типа
+    "ID": np.int32, "ASSIGNED_BY_ID": np.int32, "stage_sort": np.int32,
+    "days_in_work": np.int16, "days_no_activity": np.int16, "days_on_stage": np.int16,
+    "reschedules": np.int16, "micro_tasks": np.int16,
+    "health": np.int8, "potential": np.int8,
+}
+SCORED_FLOATS = {"CATEGORY_ID": np.float32, "PROBABILITY": np.float32}  # OPPORTUNITY остаётся float64 (деньги)
+SCORED_CATEGORIES = ["STAGE_ID", "SEMANTIC", "stage_name", "manager", "category", "cat_norm",
+                     "fail_group", "fail_from_stage_hist"]
+SCORED_FLAGS = ["flag_no_company", "flag_no_contact", "flag_no_tasks", "flag_stuck", "flag_lost",
+                "is_success", "is_fail", "cheat_flag"]
+
+def compact_scored(df):
+    """Кадр сделок в компактной схеме: категории вместо строк, узкие числа, bool-флаги.
+    Группировки по категориальным колонкам — с observed=True."""
+    out = df.copy()
+    for col, t in SCORED_INTS.items():
+        if col in out.columns:
+            info = np.iinfo(t)
+            out[col] = pd.to_numeric(out[col], errors="coerce").fillna(0).clip(info.min, info.max).astype(t)
+    for col, t in SCORED_FLOATS.items():
+        if col in out.columns:
+            out[col] = out[col].astype(t)
+    for col in SCORED_CATEGORIES:
+        if col in out.columns:
+            out[col] = out[col].astype("category")
+    for col in SCORED_FLAGS:
+        if col in out.columns:
+            out[col] = out[col].fillna(False).astype(bool)
+    return out
+
+def memory_report(df):
+    """Память кадра по колонкам (МБ, deep) — для сравнения схем."""
+    mem = df.memory_usage(deep=True, index=True) / 2**20
+    return pd.DataFrame({"dtype": df.dtypes.astype(str).reindex(mem.index).fillna(""), "MB": mem.round(3)})
+
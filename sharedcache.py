@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Общий кэш загрузчиков Bitrix24 для нескольких процессов (реплик) дашборда — без Streamlit.
+st.cache_data живёт в памяти процесса: каждая реплика за балансировщиком сама качает
+те же сделки, активности и пользователей и расходует общий лимит Bitrix. SharedCache —
+второй уровень под st.cache_data: результат загрузчика хранится в общем хранилище с тем же
+сроком жизни, и грузит его только одна реплика — остальные ждут её (блокировка set nx).
+
+Хранилище — любой объект с get(key), set(key, value, ex=, nx=), delete(*keys):
+    sqlite:///.cache/shared.sqlite   — store.KVStore, процессы одной машины;
+    redis://host:6379/0             — redis.Redis (pip install redis), несколько машин.
+"""
+
+import hashlib, pickle, threading, time
+
+from store import KVStore
+
+
+def connect(url):
+    """URL хранилища → объект хранилища; "" — без общего кэша (None)."""
+    url = (url or "").strip()
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Для SHARED_CACHE_URL=redis://… нужен пакет redis (pip install redis)")
+        return redis.Redis.from_url(url)
+    return KVStore(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url)
+
+
+class SharedCache:
+    """get_or_load(name, args, ttl, load): значение из хранилища или load() с записью на ttl секунд.
+    Значения — pickle: хранилище должно быть доступно только дашборду."""
+
+    def __init__(self, backend, prefix="burmash:", lock_ttl=120, wait=0.1):
+        self.backend, self.prefix = backend, prefix
+        self.lock_ttl, self.wait = lock_ttl, wait  # lock_ttl — дольше самой долгой загрузки
+        self.stats = {"hits": 0, "misses": 0, "waits": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def key(self, name, args):
+        return f"{self.prefix}{name}:{hashlib.md5(pickle.dumps(args, protocol=4)).hexdigest()}"
+
+    def _count(self, what):
+        with self._lock:
+            self.stats[what] += 1
+
+    def _get(self, key):
+        try:
+            raw = self.backend.get(key)
+        except Exception:  # хранилище недоступно — грузим из Bitrix, дашборд не падает
+            self._count("errors")
+            return None
+        return None if raw is None else pickle.loads(raw)
+
+    def get_or_load(self, name, args, ttl, load):
+        key = self.key(name, args)
+        value = self._get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        lock = key + ":lock"
+        try:
+            owner = self.backend.set(lock, b"1", ex=self.lock_ttl, nx=True)
+        except Exception:
+            owner = True
+        if not owner:  # грузит другая реплика — ждём её результат, но не дольше lock_ttl
+            self._count("waits")
+            deadline = time.time() + self.lock_ttl
+            while time.time() < deadline:
+                time.sleep(self.wait)
+                value = self._get(key)
+                if value is not None:
+                    self._count("hits")
+                    return value
+                try:
+                    if self.backend.get(lock) is None:  # загрузка упала — грузим сами
+                        break
+                except Exception:
+                    break
+        self._count("misses")
+        try:
+            value = load()
+            if value is not None:
+                try:
+                    self.backend.set(key, pickle.dumps(value, protocol=4), ex=ttl)
+                except Exception:
+                    self._count("errors")
+            return value
+        finally:
+            if owner:
+                try:
+                    self.backend.delete(lock)
+                except Exception:
+                    pass
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Снимки кадра сделок БУРМАШ — без Streamlit.
+Фоновая задача (precompute.py) собирает кадр за окно дат тем же конвейером,
+что и дашборд, и пишет версионированный снимок: Parquet (компактная схема,
+категории сохраняются) + JSON с метаданными и справочниками. Дашборд читает
+последний снимок вместо загрузки из Bitrix.
+
+Каталог снимков:
+    LATEST                       — имя последней версии
+    deals-<версия>.parquet       — кадр build_deals_frame за окно
+    deals-<версия>.json          — метаданные (окно, stuck_days, пользователи, отделы, тайминги)
+"""
+
+import json, os, time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import loaders
+from store import ActivityCache, DealStore, HistoryStore
+from pipeline import deals_frame, deal_versions, history_frame, build_deals_frame
+
+SNAPSHOT_SCHEMA = 1
+
+
+def build(client, store_path="", days=400, stuck_days=5, use_history=True, now=None):
+    """Полный конвейер за окно [сегодня − days, сегодня]: (кадр, метаданные).
+    store_path — локальная база (DealStore/ActivityCache/HistoryStore); "" — в памяти."""
+    now = now or datetime.now()
+    end = now.date(); start = end - timedelta(days=days)
+    timings = {}
+    def stage(name, fn, *args, **kw):
+        t = time.perf_counter()
+        out = fn(*args, **kw)
+        timings[name] = round(time.perf_counter() - t, 3)
+        return out
+
+    store = DealStore(store_path) if store_path else None
+    deals = stage("deals", loaders.deals_dual, client, store, start, end, limit=None)
+    if store is not None:  # удалённые в Bitrix сделки — здесь, а не в запросе дашборда
+        stage("prune", store.prune, client)
+    users = stage("users", loaders.users_full, client)
+    departments = stage("departments", loaders.departments, client)
+    categories = stage("categories", loaders.categories, client)
+    df_raw = deals_frame(deals)
+    cat_ids = df_raw["CATEGORY_ID"].dropna().astype(int).unique().tolist() if deals else []
+    sort_map, name_map = stage("stages", loaders.stage_map_by_category, client, cat_ids)
+    acts = stage("activities", loaders.activities, client, ActivityCache(store_path or ":memory:"),
+                 deal_versions(deals), True)
+    history = None
+    if use_history:
+        history_raw = stage("history", loaders.stage_history, client, HistoryStore(store_path or ":memory:"),
+                            [int(d["ID"]) for d in deals], start - timedelta(days=loaders.HISTORY_LOOKBACK_DAYS))
+        history = stage("history_frame", history_frame, history_raw)
+    users_map = {uid: u["name"] for uid, u in users.items()}
+    df = stage("build", build_deals_frame, df_raw, acts, users_map, categories, sort_map, name_map,
+               history=history, stuck_days=stuck_days, now=now) if deals else pd.DataFrame()
+    meta = {
+        "schema": SNAPSHOT_SCHEMA,
+        "built_at": now.isoformat(timespec="seconds"),
+        "window": [start.isoformat(), end.isoformat()],
+        "stuck_days": stuck_days,
+        "has_history": bool(use_history),
+        "rows": len(df),
+        "activities": sum(len(v) for v in acts.values()),
+        "timings": timings,
+        "users_full": {str(k): v for k, v in users.items()},
+        "departments": departments,
+    }
+    return df, meta
+
+def _replace(path, write):
+    """Атомарная запись: во временный файл рядом, затем os.replace."""
+    tmp = f"{path}.tmp{os.getpid()}"
+    write(tmp)
+    os.replace(tmp, path)
+
+def write(directory, df, meta, keep=5):
+    """Пишет снимок новой версии и переключает LATEST; старше keep версий — удаляются.
+    Читатель видит либо прежнюю, либо новую версию целиком."""
+    os.makedirs(directory, exist_ok=True)
+    version = datetime.now().strftime("%Y%m%d-%H%M%S")
+    meta = dict(meta, version=version)
+    base = os.path.join(directory, f"deals-{version}")
+    _replace(base + ".parquet", lambda p: df.to_parquet(p, index=False))
+    def dump(p):
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+    _replace(base + ".json", dump)
+    def point(p):
+        with open(p, "w") as f:
+            f.write(version)
+    _replace(os.path.join(directory, "LATEST"), point)
+    versions = sorted(f[6:-5] for f in os.listdir(directory) if f.startswith("deals-") and f.endswith(".json"))
+    for old in versions[:-keep] if keep else []:
+        for ext in (".parquet", ".json"):
+            try: os.remove(os.path.join(directory, f"deals-{old}{ext}"))
+            except OSError: pass
+    return version
+
+def latest(directory):
+    """Версия последнего снимка или None."""
+    try:
+        with open(os.path.join(directory, "LATEST")) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def read(directory, version):
+    """(кадр, метаданные) снимка; ключи users_full — снова int."""
+    base = os.path.join(directory, f"deals-{version}")
+    with open(base + ".json", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("schema") != SNAPSHOT_SCHEMA:
+        raise ValueError(f"Снимок {version}: схема {meta.get('schema')}, ожидается {SNAPSHOT_SCHEMA}")
+    meta["users_full"] = {int(k): v for k, v in meta["users_full"].items()}
+    return pd.read_parquet(base + ".parquet"), meta
+
+def covers(meta, start, end):
+    """Начало периода внутри окна снимка. Конец может быть позже даты сборки —
+    сделок оттуда в снимке ещё нет, как и в Bitrix на момент сборки."""
+    w_start, w_end = (pd.Timestamp(x).date() for x in meta["window"])
+    return w_start <= start and start <= w_end
+
+def period_slice(df, start, end, limit=None, assigned=None):
+    """Как deals_dual: сделки, созданные или закрытые в [start, end] (и ответственных
+    из assigned, если задан), по возрастанию ID, первые limit."""
+    if df.empty:
+        return df
+    lo, hi = pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=1)
+    m = df["DATE_CREATE"].between(lo, hi, inclusive="left") | df["CLOSEDATE"].between(lo, hi, inclusive="left")
+    if assigned is not None:
+        m &= df["ASSIGNED_BY_ID"].isin(assigned)
+    out = df[m.to_numpy()].sort_values("ID", kind="stable")
+    return out.head(limit) if limit else out
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""
+Локальное хранилище сделок (SQLite) с инкрементальной синхронизацией из Bitrix24.
+— Холодный старт: один полный keyset-обход crm.deal.list.
+— Далее: только сделки с DATE_MODIFY ≥ отметки прошлой синхронизации.
+— Удалённые в Bitrix сделки — события ONCRMDEALDELETE (events.py) и фоновый обход
+  только ID (prune: precompute.py, events.py), не в запросе дашборда.
+— Периоды отвечаются из базы по индексам DATE_CREATE/CLOSEDATE (UTC).
+Кэш активностей по сделкам: запись на сделку со своей версией и сроком свежести,
+в Bitrix уходят только новые/изменённые/устаревшие сделки.
+История стадий: массовая загрузка crm.stagehistory.list по диапазону CREATED_TIME
+(без цикла по сделкам), далее — только новые записи по курсору ID; сделки, созданные
+раньше диапазона, догружаются по OWNER_ID один раз.
+Ответы AI: по ключу запроса (хэш модели и промпта) со сроком свежести.
+Выручка по месяцам (план/факт): вклад каждой успешной сделки и агрегат месяц × воронка ×
+менеджер поверх базы сделок; разбираются только изменённые сделки.
+KVStore: ключ → байты со сроком жизни, подмножество команд Redis (get/set ex nx/delete) —
+общий кэш загрузчиков для нескольких процессов дашборда на одной машине.
+"""
+
+import json, os, sqlite3, threading, time
+from datetime import timedelta
+import pandas as pd
+
+DEAL_FIELDS = [
+    "ID","TITLE","STAGE_ID","OPPORTUNITY","ASSIGNED_BY_ID","COMPANY_ID","CONTACT_ID",
+    "PROBABILITY","DATE_CREATE","DATE_MODIFY","LAST_ACTIVITY_TIME","CATEGORY_ID",
+    "BEGINDATE","CLOSEDATE","STAGE_SEMANTIC_ID"
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deals(
+    id INTEGER PRIMARY KEY,
+    date_create TEXT, closedate TEXT, date_modify TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deals_date_create ON deals(date_create);
+CREATE INDEX IF NOT EXISTS deals_closedate ON deals(closedate);
+CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS deal_activities(
+    deal_id INTEGER PRIMARY KEY,
+    version TEXT, fetched_at REAL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stage_history(
+    id INTEGER PRIMARY KEY,
+    owner_id INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stage_history_owner ON stage_history(owner_id);
+CREATE TABLE IF NOT EXISTS stage_history_backfill(owner_id INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS ai_answers(
+    key TEXT PRIMARY KEY,
+    created_at REAL,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS revenue_deals(
+    deal_id INTEGER PRIMARY KEY,
+    year INTEGER, month INTEGER, cat TEXT, assigned INTEGER, amount REAL
+);
+CREATE TABLE IF NOT EXISTS revenue_months(
+    year INTEGER, month INTEGER, cat TEXT, assigned INTEGER,
+    amount REAL, deals INTEGER,
+    PRIMARY KEY(year, month, cat, assigned)
+);
+CREATE TABLE IF NOT EXISTS kv(
+    key TEXT PRIMARY KEY,
+    expires_at REAL,
+    value BLOB NOT NULL
+);
+"""
+SQLITE_VARS = 900  # запас до лимита параметров SQLite в IN (...)
+
+
+def _connect(path):
+    if path != ":memory:" and os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def utc_keys(values):
+    """Время Bitrix (ISO с поясом) → 'YYYY-MM-DD HH:MM:SS' в UTC, сравнимое строкой."""
+    ts = pd.to_datetime(pd.Series(list(values), dtype=object), utc=True, errors="coerce", format="ISO8601")
+    return ts.dt.strftime("%Y-%m-%d %H:%M:%S").astype(object).where(ts.notna(), None).tolist()
+
+
+class DealStore:
+    def __init__(self, path):
+        self.path = path
+        self.db = _connect(path)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()  # одна синхронизация на процесс, остальные ждут её
+
+    def _meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?)", (key, str(value)))
+
+    def _write(self, deals):
+        """Запись сделок; возвращает число действительно изменённых строк (те же данные не переписываются)."""
+        cols = [utc_keys(d.get(c) for d in deals) for c in ("DATE_CREATE", "CLOSEDATE", "DATE_MODIFY")]
+        before = self.db.total_changes
+        self.db.executemany(
+            "INSERT INTO deals(id, date_create, closedate, date_modify, data) VALUES(?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET date_create=excluded.date_create, closedate=excluded.closedate, "
+            "date_modify=excluded.date_modify, data=excluded.data WHERE deals.data IS NOT excluded.data",
+            [(int(d["ID"]), c, cl, m, json.dumps(d, ensure_ascii=False)) for d, c, cl, m in zip(deals, *cols)])
+        return self.db.total_changes - before
+
+    def _bump(self):
+        self.db.execute("INSERT INTO meta(key, value) VALUES('revision', '1') "
+                        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    def revision(self):
+        """Счётчик изменений базы (синхронизация, события): часть ключа кэша дашборда.
+        Общий для процессов — приёмник событий пишет в тот же файл."""
+        with self._lock:
+            return int(self._meta("revision", 0))
+
+    def touch(self):
+        """Новая ревизия без записи сделок: изменились их активности (события), а строки
+        сделок те же — ключи кэша дашборда всё равно должны смениться."""
+        with self._lock:
+            self._bump()
+
+    def upsert(self, deals):
+        with self._lock:
+            self.db.execute("BEGIN")
+            if self._write(deals): self._bump()
+            self.db.execute("COMMIT")
+        return len(deals)
+
+    def delete(self, ids):
+        ids = [int(x) for x in ids]
+        with self._lock:
+            self.db.execute("BEGIN")
+            if self.db.executemany("DELETE FROM deals WHERE id=?", [(i,) for i in ids]).rowcount > 0: self._bump()
+            self.db.execute("COMMIT")
+        return len(ids)
+
+    def sync(self, client):
+        """Догружает изменённые сделки (холодный старт — все); возвращает число полученных из Bitrix строк."""
+        with self._sync_lock:
+            return self._sync(client)
+
+    def _sync(self, client):
+        with self._lock:
+            mark = self._meta("deals_modified_mark")
+        params = {"select[]": DEAL_FIELDS}
+        if mark:
+            # ≥, а не >: сделки, изменённые в ту же секунду после прошлой синхронизации, не теряются
+            params["filter[>=DATE_MODIFY]"] = mark
+        deals = client.get_all("crm.deal.list", params, keyset=True)
+        with self._lock:
+            self.db.execute("BEGIN")
+            changed = self._write(deals)
+            marks = [(k, d["DATE_MODIFY"]) for k, d in zip(utc_keys(d.get("DATE_MODIFY") for d in deals), deals) if k]
+            if marks:
+                self._set_meta("deals_modified_mark", max(marks)[1])
+            if changed or not mark: self._bump()
+            self.db.execute("COMMIT")
+        return len(deals)
+
+    def prune(self, client):
+        """Удаляет сделки, которых больше нет в Bitrix: keyset-обход только ID (select[]=ID).
+        Для фоновых задач (precompute.py, events.py), не для запроса дашборда. Сделки с ID
+        больше последнего полученного не трогаются — созданы после обхода. Возвращает число удалённых."""
+        live = {int(d["ID"]) for d in client.get_all("crm.deal.list", {"select[]": ["ID"]}, keyset=True)}
+        top = max(live, default=0)
+        with self._lock:
+            gone = [i for (i,) in self.db.execute("SELECT id FROM deals WHERE id <= ?", (top,)) if i not in live]
+        if gone:
+            self.delete(gone)
+        return len(gone)
+
+    def deals_for_period(self, start, end, limit=None, assigned=None):
+        """Сделки, созданные или закрытые в [start, end] (даты UTC), по возрастанию ID.
+        assigned — только сделки этих ответственных (ASSIGNED_BY_ID)."""
+        lo = f"{start:%Y-%m-%d} 00:00:00"
+        hi = f"{end + timedelta(days=1):%Y-%m-%d} 00:00:00"
+        sql = ("SELECT data FROM deals WHERE ((date_create >= ? AND date_create < ?) "
+               "OR (closedate >= ? AND closedate < ?))")
+        args = [lo, hi, lo, hi]
+        if assigned is not None:
+            sql += " AND CAST(json_extract(data, '$.ASSIGNED_BY_ID') AS TEXT) IN (SELECT value FROM json_each(?))"
+            args.append(json.dumps([str(int(x)) for x in assigned]))
+        sql += " ORDER BY id"
+        if limit:
+            sql += " LIMIT ?"; args.append(int(limit))
+        with self._lock:
+            return [json.loads(r[0]) for r in self.db.execute(sql, args)]
+
+
+class ActivityCache:
+    """Активности по сделкам. Запись свежа, пока версия сделки (DATE_MODIFY/LAST_ACTIVITY_TIME)
+    не изменилась и не истёк ttl. Счётчики hits/misses — по сделкам, за время жизни процесса."""
+
+    def __init__(self, path=":memory:", ttl=3600):
+        self.ttl = ttl
+        self.db = _connect(path)
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.last = (0, 0)  # (из кэша, из Bitrix) в последнем вызове
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _read(self, ids):
+        out = {}
+        with self._lock:
+            for i in range(0, len(ids), SQLITE_VARS):
+                part = ids[i:i + SQLITE_VARS]
+                q = f"SELECT deal_id, version, fetched_at, data FROM deal_activities WHERE deal_id IN ({','.join('?' * len(part))})"
+                for did, version, fetched_at, data in self.db.execute(q, part):
+                    out[did] = (version, fetched_at, data)
+        return out
+
+    def get_many(self, versions, fetch):
+        """versions: {deal_id: версия}; fetch(ids) → {deal_id: [активности]} для устаревших.
+        Возвращает {deal_id: [активности]} для всех сделок из versions."""
+        versions = {int(k): str(v or "") for k, v in versions.items()}
+        cached, now = self._read(list(versions)), time.time()
+        out, stale = {}, []
+        for did, version in versions.items():
+            row = cached.get(did)
+            if row and row[0] == version and now - row[1] < self.ttl:
+                out[did] = json.loads(row[2])
+            else:
+                stale.append(did)
+        fetched = fetch(stale) if stale else {}
+        rows = []
+        for did in stale:
+            out[did] = fetched.get(did, [])
+            rows.append((did, versions[did], now, json.dumps(out[did], ensure_ascii=False)))
+        with self._lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO deal_activities(deal_id, version, fetched_at, data) "
+                                "VALUES(?, ?, ?, ?)", rows)
+            self.db.execute("COMMIT")
+            self.hits += len(versions) - len(stale)
+            self.misses += len(stale)
+            self.last = (len(versions) - len(stale), len(stale))
+        return out
+
+    def invalidate(self, deal_ids):
+        """Сбрасывает записи сделок: следующий get_many загрузит их активности заново."""
+        with self._lock:
+            self.db.executemany("DELETE FROM deal_activities WHERE deal_id=?", [(int(d),) for d in deal_ids])
+
+    def owners_of(self, activity_ids):
+        """Сделки, в кэше которых есть эти активности (для удалённых активностей — в Bitrix их уже нет)."""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT DISTINCT deal_id FROM deal_activities, json_each(deal_activities.data) "
+                "WHERE CAST(json_extract(json_each.value, '$.ID') AS TEXT) IN (SELECT value FROM json_each(?))",
+                (json.dumps([str(int(a)) for a in activity_ids]),))
+            return {r[0] for r in rows}
+
+
+class HistoryStore:
+    """История стадий сделок. Покрытый диапазон — от meta.history_from до текущего момента:
+    более ранний since догружается одним диапазонным обходом, новые записи — по ID > max.
+    Сделки, созданные до history_from, — записи до начала диапазона по OWNER_ID (backfill)."""
+
+    PARAMS = {"entityTypeId": 2, "select[]": ["ID", "OWNER_ID", "TYPE_ID", "STAGE_ID", "CREATED_TIME"]}
+
+    def __init__(self, path=":memory:"):
+        self.db = _connect(path)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def _meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _store(self, items, **meta):
+        with self._lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO stage_history(id, owner_id, data) VALUES(?, ?, ?)",
+                                [(int(h["ID"]), int(h["OWNER_ID"]), json.dumps(h, ensure_ascii=False)) for h in items])
+            ids = [int(h["ID"]) for h in items]
+            if ids:
+                top = max(ids + [int(self._meta("history_max_id") or 0)])
+                self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES('history_max_id', ?)", (str(top),))
+            for key, value in meta.items():
+                self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?)", (key, str(value)))
+            self.db.execute("COMMIT")
+
+    def sync(self, client, since):
+        """Гарантирует историю с даты since; возвращает число загруженных записей."""
+        since = f"{since:%Y-%m-%d}"
+        with self._sync_lock:
+            covered, max_id = self._meta("history_from"), self._meta("history_max_id")
+            loaded = 0
+            if covered is None or since < covered:
+                params = {**self.PARAMS, "filter[>=CREATED_TIME]": f"{since}T00:00:00"}
+                if covered is not None:
+                    params["filter[<CREATED_TIME]"] = f"{covered}T00:00:00"
+                items = client.get_all("crm.stagehistory.list", params, keyset=True)
+                self._store(items, history_from=since)
+                loaded += len(items)
+            if covered is not None:
+                # без известного max ID (пустой первый диапазон) — снова по дате, а не с ID > 0
+                params = self.PARAMS if max_id else {**self.PARAMS, "filter[>=CREATED_TIME]": f"{covered}T00:00:00"}
+                items = client.get_all_keyset("crm.stagehistory.list", params, after_id=int(max_id) if max_id else None)
+                self._store(items)
+                loaded += len(items)
+            return loaded
+
+    def backfill(self, client, deal_ids):
+        """Записи до начала покрытого диапазона для сделок deal_ids (у них нет записи создания,
+        TYPE_ID 1): пачками filter[OWNER_ID][], один раз на сделку. Возвращает число записей."""
+        with self._sync_lock:
+            covered = self._meta("history_from")
+            with self._lock:
+                done = set()
+                for i in range(0, len(deal_ids), SQLITE_VARS):
+                    part = [int(x) for x in deal_ids[i:i + SQLITE_VARS]]
+                    q = f"SELECT owner_id FROM stage_history_backfill WHERE owner_id IN ({','.join('?' * len(part))})"
+                    done.update(r[0] for r in self.db.execute(q, part))
+            ids = [int(x) for x in deal_ids if int(x) not in done]
+            if covered is None or not ids:
+                return 0
+            commands = {f"c{i}": ("crm.stagehistory.list", {**self.PARAMS, "filter[OWNER_ID][]": ids[j:j + 40],
+                                                            "filter[<CREATED_TIME]": f"{covered}T00:00:00"})
+                        for i, j in enumerate(range(0, len(ids), 40))}
+            items = [h for part in client.batch_get_all(commands, keyset=True).values() for h in part]
+            self._store(items)
+            with self._lock:  # и сделки без ранних записей: повторно не запрашиваются
+                self.db.executemany("INSERT OR IGNORE INTO stage_history_backfill(owner_id) VALUES(?)", [(i,) for i in ids])
+            return len(items)
+
+    def for_deals(self, deal_ids):
+        """{deal_id: [записи истории по возрастанию ID]} для сделок с историей."""
+        ids, out = [int(x) for x in deal_ids], {}
+        with self._lock:
+            for i in range(0, len(ids), SQLITE_VARS):
+                part = ids[i:i + SQLITE_VARS]
+                q = f"SELECT owner_id, data FROM stage_history WHERE owner_id IN ({','.join('?' * len(part))}) ORDER BY id"
+                for did, data in self.db.execute(q, part):
+                    out.setdefault(did, []).append(json.loads(data))
+        return out
+
+
+class AnswerCache:
+    """Ответы AI по ключу запроса; запись свежа ttl секунд. Переживает перезапуск
+    процесса, если path — файл. Потокобезопасна: пишут рабочие потоки пула запросов."""
+
+    def __init__(self, path=":memory:", ttl=86400):
+        self.ttl = ttl
+        self.db = _connect(path)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            row = self.db.execute("SELECT created_at, text FROM ai_answers WHERE key=?", (key,)).fetchone()
+        return row[1] if row and time.time() - row[0] < self.ttl else None
+
+    def put(self, key, text):
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO ai_answers(key, created_at, text) VALUES(?, ?, ?)",
+                            (key, time.time(), text))
+
+
+class RevenueStore:
+    """Помесячная выручка плана/факта поверх базы сделок DealStore (тот же файл).
+    revenue_deals — вклад каждой успешной сделки, revenue_months — агрегат месяц × воронка ×
+    менеджер. refresh разбирает только сделки с DATE_MODIFY ≥ отметки прошлого разбора и
+    удалённые из базы: их прежний вклад вычитается из агрегата, новый — прибавляется."""
+
+    def __init__(self, path):
+        self.db = _connect(path)
+        self._lock = threading.Lock()
+
+    def _meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def refresh(self, contrib, rules):
+        """contrib(deals) → кадр pipeline.revenue_rows; rules — отпечаток справочников (воронки,
+        названия стадий), по которым определяется успех: при его смене — полный пересчёт.
+        Разбор и запись — одной транзакцией (BEGIN IMMEDIATE): процессы не перепишут друг друга.
+        Возвращает число разобранных сделок."""
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                mark = self._meta("revenue_mark")
+                full = self._meta("revenue_rules") != rules or not mark
+                if full:
+                    self.db.execute("DELETE FROM revenue_deals")
+                    self.db.execute("DELETE FROM revenue_months")
+                    rows = self.db.execute("SELECT id, date_modify, data FROM deals").fetchall()
+                else:
+                    # ≥: сделки, изменённые в секунду отметки, разбираются повторно — вклад заменяется
+                    rows = self.db.execute("SELECT id, date_modify, data FROM deals WHERE date_modify >= ?",
+                                           (mark,)).fetchall()
+                gone = [r[0] for r in self.db.execute(
+                    "SELECT deal_id FROM revenue_deals WHERE deal_id NOT IN (SELECT id FROM deals)")]
+                new = contrib([json.loads(r[2]) for r in rows])
+                ids = json.dumps([r[0] for r in rows] + gone)
+                old = self.db.execute("SELECT year, month, cat, assigned, amount FROM revenue_deals "
+                                      "WHERE deal_id IN (SELECT value FROM json_each(?))", (ids,)).fetchall()
+                self.db.executemany("UPDATE revenue_months SET amount = amount - ?, deals = deals - 1 "
+                                    "WHERE year=? AND month=? AND cat=? AND assigned=?",
+                                    [(a, y, m, c, u) for y, m, c, u, a in old])
+                self.db.execute("DELETE FROM revenue_deals WHERE deal_id IN (SELECT value FROM json_each(?))", (ids,))
+                add = list(zip(new["ID"].tolist(), new["year"].tolist(), new["month"].tolist(), new["cat_norm"].tolist(),
+                               new["ASSIGNED_BY_ID"].tolist(), new["OPPORTUNITY"].tolist()))
+                self.db.executemany("INSERT INTO revenue_deals(deal_id, year, month, cat, assigned, amount) "
+                                    "VALUES(?, ?, ?, ?, ?, ?)", add)
+                self.db.executemany("INSERT INTO revenue_months(year, month, cat, assigned, amount, deals) "
+                                    "VALUES(?, ?, ?, ?, ?, 1) ON CONFLICT(year, month, cat, assigned) "
+                                    "DO UPDATE SET amount = amount + excluded.amount, deals = deals + 1",
+                                    [(y, m, c, u, a) for _, y, m, c, u, a in add])
+                self.db.execute("DELETE FROM revenue_months WHERE deals <= 0")
+                marks = [r[1] for r in rows if r[1]]
+                if marks:
+                    top = max(marks + ([mark] if mark and not full else []))
+                    self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES('revenue_mark', ?)", (top,))
+                self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES('revenue_rules', ?)", (rules,))
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def months(self, year):
+        """Агрегат года: кадр year, month, cat_norm, ASSIGNED_BY_ID, amount, deals."""
+        with self._lock:
+            rows = self.db.execute("SELECT year, month, cat, assigned, amount, deals FROM revenue_months "
+                                   "WHERE year=? ORDER BY month, cat, assigned", (int(year),)).fetchall()
+        return pd.DataFrame(rows, columns=["year", "month", "cat_norm", "ASSIGNED_BY_ID", "amount", "deals"])
+
+
+class KVStore:
+    """Ключ → байты со сроком жизни в SQLite; те же вызовы, что у redis.Redis
+    (get, set(ex=, nx=), delete), поэтому SharedCache работает с любым из них.
+    Каждая запись — одна инструкция SQLite: читатель видит старое значение или новое целиком,
+    в том числе из другого процесса (WAL)."""
+
+    def __init__(self, path=":memory:"):
+        self.db = _connect(path)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self.db.execute("SELECT value FROM kv WHERE key=? AND (expires_at IS NULL OR expires_at > ?)",
+                                  (key, time.time())).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key, value, ex=None, nx=False):
+        """nx=True — записать, только если ключа нет (или он истёк); True — записано."""
+        now = time.time()
+        expires = now + ex if ex else None
+        with self._lock:
+            if nx:
+                cur = self.db.execute("INSERT INTO kv(key, expires_at, value) VALUES(?, ?, ?) "
+                                      "ON CONFLICT(key) DO UPDATE SET expires_at=excluded.expires_at, value=excluded.value "
+                                      "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?", (key, expires, value, now))
+            else:
+                cur = self.db.execute("INSERT OR REPLACE INTO kv(key, expires_at, value) VALUES(?, ?, ?)",
+                                      (key, expires, value))
+            self._writes += 1
+            if self._writes % 200 == 0:  # истёкшие записи вычищаются попутно
+                self.db.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+        return cur.rowcount > 0
+
+    def delete(self, *keys):
+        with self._lock:
+            return self.db.executemany("DELETE FROM kv WHERE key=?", [(k,) for k in keys]).rowcount